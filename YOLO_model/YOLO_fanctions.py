@@ -2,8 +2,30 @@ import streamlit as st
 import numpy as np
 from PIL import Image
 
-def delete_detection_callback(player_key, index_to_delete):
-    """認識結果リストから特定の項目を削除するコールバック"""
-    if player_key in st.session_state and isinstance(st.session_state[player_key], list):
-        if 0 <= index_to_delete < len(st.session_state[player_key]):
-            st.session_state[player_key].pop(index_to_delete)
+def delete_detection_callback(player_key, index_to_delete, photos_key=None, pile_key=None):
+    """認識結果（Detections）から特定の項目を削除するコールバック
+
+    photos_key を渡すと、複数の写真をまとめた PhotoDetections からも削除する。
+    pile_key を渡すと、取り札の集合（cards.CapturePile）からもその1枚だけを除き、
+    その札が関わる出来役だけを判定し直す。
+    """
+    detections = st.session_state.get(player_key)
+    if detections is None or not 0 <= index_to_delete < len(detections):
+        return
+    card_name = detections.names()[index_to_delete]
+    photo_set = st.session_state.get(photos_key) if photos_key else None
+    if photo_set is not None:
+        photo_set.exclude(int(detections.class_ids[index_to_delete]))
+        st.session_state[player_key] = photo_set.merged()
+    else:
+        st.session_state[player_key] = detections.without(index_to_delete)
+    pile = st.session_state.get(pile_key) if pile_key else None
+    if pile is not None and pile.source is detections:
+        pile.remove(card_name, source=st.session_state[player_key])
+
+def remove_photo_callback(photos_key, detections_key, photo_key):
+    """複数の写真のうち1枚を外し、認識結果をまとめ直すコールバック"""
+    photo_set = st.session_state.get(photos_key)
+    if photo_set is not None:
+        photo_set.remove(photo_key, dismiss=True)
+        st.session_state[detections_key] = photo_set.merged()
@@ -0,0 +1,72 @@
+import os
+
+from YOLO_model.detections import Detections, class_table_for
+
+# 推論バックエンドと重みファイルの対応（HANAFUDA_DETECTOR_BACKEND で選択する）
+BACKEND_WEIGHTS = {
+    "torch": os.path.join("YOLO_model", "best.pt"),
+    "onnx": os.path.join("YOLO_model", "best.onnx"),
+    "onnx-int8": os.path.join("YOLO_model", "best.int8.onnx"),
+}
+DEFAULT_BACKEND = "torch"
+
+
+def configured_backend():
+    """設定（環境変数 HANAFUDA_DETECTOR_BACKEND）で選ばれたバックエンド名を返す"""
+    return os.environ.get("HANAFUDA_DETECTOR_BACKEND", DEFAULT_BACKEND)
+
+
+def weights_path(backend):
+    """バックエンドの重みファイルのパス"""
+    if backend not in BACKEND_WEIGHTS:
+        raise ValueError(f"不明な推論バックエンドです: {backend}（{', '.join(BACKEND_WEIGHTS)} から選択）")
+    return BACKEND_WEIGHTS[backend]
+
+
+def load_detector(backend=DEFAULT_BACKEND):
+    """バックエンドに応じた検出器を読み込む
+
+    どのバックエンドも ultralytics の YOLO 経由で読み込むので、PyTorch でも
+    ONNX Runtime (INT8 量子化版を含む) でも、呼び出し方と戻り値 (Results) は同じになる。
+    """
+    from ultralytics import YOLO
+
+    path = weights_path(backend)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{backend} 用の重みファイルが見つかりません: {path}")
+    return YOLO(path, task="detect")
+
+
+def detections_from_results(result, class_names):
+    """1枚分の推論結果を、アプリ共通の認識結果 Detections（クラスIDと信頼度の配列）に変換する"""
+    return Detections.from_result(result, class_table_for(class_names))
+
+
+def export_onnx(imgsz=640, int8=False):
+    """PyTorch の重みから ONNX（と、必要なら INT8 動的量子化版）を書き出し、書き出したパスのリストを返す"""
+    from ultralytics import YOLO
+
+    exported = YOLO(weights_path("torch")).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    onnx_path = weights_path("onnx")
+    if os.path.abspath(exported) != os.path.abspath(onnx_path):
+        os.replace(exported, onnx_path)
+    paths = [onnx_path]
+    if int8:
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+        except ImportError as e:
+            raise ImportError("INT8 量子化には onnxruntime が必要です（pip install onnxruntime）") from e
+        quantize_dynamic(onnx_path, weights_path("onnx-int8"), weight_type=QuantType.QUInt8)
+        paths.append(weights_path("onnx-int8"))
+    return paths
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="best.pt を ONNX（と INT8 量子化版）に書き出す")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--int8", action="store_true", help="INT8 動的量子化版も書き出す")
+    args = parser.parse_args()
+    for path in export_onnx(args.imgsz, args.int8):
+        print(path)
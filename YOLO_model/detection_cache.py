@@ -0,0 +1,101 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+def weights_version(path):
+    """モデルの重みファイルのサイズと更新日時から、モデルのバージョン文字列を作る"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "unknown"
+    return hashlib.md5(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:12]
+
+
+def cache_key(content_hash, model_version, profile_token):
+    """画像の内容ハッシュ・モデルのバージョン・推論設定（しきい値など）からキャッシュのキーを作る"""
+    return f"{content_hash}-{model_version}-{profile_token}"
+
+
+class DetectionCache:
+    """画像の内容ハッシュから認識結果（Detections.to_payload() の辞書）を引く、プロセス全体で共有のLRUキャッシュ
+
+    メモリ上の件数ではなく、認識結果をJSONにしたときのバイト数の合計が
+    max_bytes を超えたら古いものから捨てる。disk_dir を指定すると、
+    認識結果をJSONファイルとしても保存し、サーバーを再起動しても再利用できる。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def get(self, key):
+        """キャッシュされた認識結果を返す（なければ None）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return entry[0]
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), encoding="utf-8") as f:
+                    payload = json.load(f)
+            except (OSError, ValueError):
+                payload = None
+            if payload is not None:
+                self._store(key, payload)
+                with self._lock:
+                    self._counters["disk_hits"] += 1
+                return payload
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def put(self, key, payload):
+        """認識結果をキャッシュに保存する（payload は呼び出し後に変更しないこと）"""
+        self._store(key, payload)
+        if self.disk_dir:
+            tmp_path = self._disk_path(key) + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(payload, f, ensure_ascii=False)
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError:
+                pass
+
+    def _store(self, key, payload):
+        size = len(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (payload, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._counters["evictions"] += 1
+
+    def stats(self):
+        """ヒット数・ミス数・件数・使用バイト数を返す"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
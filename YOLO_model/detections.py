@@ -0,0 +1,202 @@
+import collections
+import threading
+
+import numpy as np
+
+from rules import TYPE_ABBREVIATION_MAP
+from scoring import CARD_TYPES
+
+_KASU = CARD_TYPES.index("カス")
+
+
+class ClassTable:
+    """モデルのクラスID → 札の名前・札の種類（CARD_TYPES の番号）の対応表
+
+    yolo_model.names から1回だけ作り、同じモデルを使う全セッションで共有する。
+    """
+
+    __slots__ = ("names", "card_types")
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.card_types = np.array([_card_type_index(name) for name in self.names], dtype=np.int8)
+
+    @classmethod
+    def from_model_names(cls, model_names):
+        """yolo_model.names（{クラスID: 名前} または名前のリスト）から作る"""
+        if isinstance(model_names, dict):
+            model_names = [model_names[i] for i in range(len(model_names))]
+        return cls(model_names)
+
+
+def _card_type_index(card_name):
+    """'1-hkr' のような名前から札の種類の番号を返す（不明なものはカスとして扱う）"""
+    try:
+        type_abbr = card_name.split('-')[1]
+    except IndexError:
+        return _KASU
+    return CARD_TYPES.index(TYPE_ABBREVIATION_MAP.get(type_abbr, "カス"))
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def class_table_for(model_names):
+    """names の中身ごとに1つの ClassTable を返す（同じクラス構成なら最初の1回だけ作る）
+
+    ultralytics の YOLO.names は参照するたびに新しい dict を返すので、オブジェクトではなく中身で引く。
+    """
+    if isinstance(model_names, dict):
+        key = tuple(sorted(model_names.items()))
+    else:
+        key = tuple(enumerate(model_names))
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is None:
+            table = ClassTable.from_model_names(model_names)
+            _tables[key] = table
+        return table
+
+
+class Detections:
+    """1枚の写真の認識結果を、クラスID (int16) と信頼度 (float32) の配列で持つクラス
+
+    点数の計算は札の種類ごとの bincount と札の点数との内積だけで済み、
+    札の名前は表示するときにだけ ClassTable から引く。
+    """
+
+    __slots__ = ("class_ids", "confs", "table")
+
+    def __init__(self, class_ids, confs, table):
+        self.class_ids = np.asarray(class_ids, dtype=np.int16)
+        self.confs = np.asarray(confs, dtype=np.float32)
+        self.table = table
+
+    @classmethod
+    def from_result(cls, result, table):
+        """ultralytics の Results 1枚分から作る"""
+        boxes = result.boxes
+        return cls(_to_numpy(boxes.cls), _to_numpy(boxes.conf), table)
+
+    @classmethod
+    def from_names(cls, names, confs, table):
+        """札の名前のリストから作る（表にない名前は無視する）"""
+        index = {name: i for i, name in enumerate(table.names)}
+        pairs = [(index[n], c) for n, c in zip(names, confs) if n in index]
+        return cls([p[0] for p in pairs], [p[1] for p in pairs], table)
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    def names(self):
+        """表示用の札の名前のリスト"""
+        return [self.table.names[i] for i in self.class_ids]
+
+    def card_type_counts(self):
+        """(光, タネ, 短冊, カス) の枚数"""
+        counts = np.bincount(self.table.card_types[self.class_ids], minlength=len(CARD_TYPES))
+        return tuple(int(c) for c in counts)
+
+    def points(self, card_scores):
+        """札の点数 (CARD_TYPES 順) との内積で取り札の点数を計算する"""
+        counts = np.bincount(self.table.card_types[self.class_ids], minlength=len(CARD_TYPES))
+        return int(counts @ np.asarray(card_scores))
+
+    def without(self, index):
+        """index 番目の認識結果を除いた新しい Detections を返す"""
+        keep = np.ones(len(self), dtype=bool)
+        keep[index] = False
+        return Detections(self.class_ids[keep], self.confs[keep], self.table)
+
+    def order_by_conf(self):
+        """信頼度の高い順に並べたときの元の番号"""
+        return np.argsort(-self.confs, kind="stable")
+
+    # --- キャッシュ用 ---
+    def to_payload(self):
+        """JSON にできる形にする（クラスIDと信頼度のみ）"""
+        return {"class_ids": self.class_ids.tolist(), "confs": self.confs.tolist()}
+
+    @classmethod
+    def from_payload(cls, payload, table):
+        return cls(payload["class_ids"], payload["confs"], table)
+
+
+def _to_numpy(values):
+    """torch.Tensor・numpy配列・リストのどれでも numpy 配列にする"""
+    if hasattr(values, "cpu"):
+        values = values.cpu()
+    if hasattr(values, "numpy"):
+        return values.numpy()
+    return np.asarray(values)
+
+
+class PhotoDetections:
+    """1人分の複数の写真の認識結果を、札のクラスごとに重複を除いて1つにまとめるクラス
+
+    同じ札は山に1枚しかないので、複数の写真に写った札は1枚として数える（クラスごとの枚数は、
+    1枚の写真に写っていたその札の最大の枚数にする）。写真を追加・削除したときは、
+    その写真に写っていたクラスだけをまとめ直し、ほかの写真を推論し直すことはない。
+    """
+
+    def __init__(self):
+        self.photos = {}  # 写真の内容ハッシュ -> Detections
+        self.sources = {}  # 写真の内容ハッシュ -> "upload" / "camera"
+        self.failed = set()  # 認識に失敗した写真（再実行のたびに推論し直さない）
+        self.dismissed = set()  # 一覧から外した写真（カメラに残っていても足し直さない）
+        self.table = None
+        self._by_class = {}  # クラスID -> 信頼度の高い順の配列
+        self._excluded = collections.Counter()  # 一覧から削除された枚数
+        self._merged = None
+
+    def __contains__(self, photo_key):
+        return photo_key in self.photos or photo_key in self.failed or photo_key in self.dismissed
+
+    def add(self, photo_key, detections, source="upload"):
+        """1枚分の認識結果を加える（detections が None なら失敗として記録する）"""
+        if photo_key in self:
+            return
+        self.sources[photo_key] = source
+        if detections is None:
+            self.failed.add(photo_key)
+            return
+        self.photos[photo_key] = detections
+        if self.table is None:
+            self.table = detections.table
+        self._remerge(set(detections.class_ids.tolist()))
+
+    def remove(self, photo_key, dismiss=False):
+        """1枚分の認識結果を取り除く（dismiss=True なら同じ写真をもう足さない）"""
+        if dismiss:
+            self.dismissed.add(photo_key)
+        self.failed.discard(photo_key)
+        self.sources.pop(photo_key, None)
+        detections = self.photos.pop(photo_key, None)
+        if detections is not None:
+            self._remerge(set(detections.class_ids.tolist()))
+
+    def exclude(self, class_id):
+        """まとめた一覧から札を1枚削除する（写真を足し直しても戻らない）"""
+        self._excluded[class_id] += 1
+        self._remerge({class_id})
+
+    def _remerge(self, class_ids):
+        for class_id in class_ids:
+            per_photo = [d.confs[d.class_ids == class_id] for d in self.photos.values()]
+            count = max((len(confs) for confs in per_photo), default=0) - self._excluded[class_id]
+            if count <= 0:
+                self._by_class.pop(class_id, None)
+            else:
+                self._by_class[class_id] = np.sort(np.concatenate(per_photo))[::-1][:count]
+        self._merged = None
+
+    def merged(self):
+        """すべての写真をまとめた Detections（写真がなければ None）"""
+        if self.table is None or not self.photos:
+            return None
+        if self._merged is None:
+            class_ids = [class_id for class_id, confs in self._by_class.items() for _ in range(len(confs))]
+            confs = np.concatenate(list(self._by_class.values())) if self._by_class else []
+            self._merged = Detections(class_ids, confs, self.table)
+        return self._merged
@@ -0,0 +1,206 @@
+import contextlib
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+
+class InferenceQueueFull(RuntimeError):
+    """推論待ちのキューが満杯で、リクエストを受け付けられないときの例外"""
+
+
+class _Request:
+    __slots__ = ("image", "options", "deadline", "future", "enqueued_at", "dequeued_at")
+
+    def __init__(self, image, options, deadline):
+        self.image = image
+        self.options = options
+        self.deadline = deadline
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.dequeued_at = None
+
+
+class InferenceService:
+    """全セッションからの推論リクエストをまとめて、1回のバッチ推論で処理するクラス
+
+    リクエストは上限付きのキューに積まれ、ワーカースレッドが最初のリクエストから
+    max_wait 秒待つか max_batch_size 件集まった時点で、同じ推論オプション同士を
+    1回の yolo_model([画像, ...]) で推論し、結果をそれぞれの呼び出し元に返す。
+    呼び出し側からはモデルと同じように service(image) で使える。
+
+    scheduler (thread_budget.InferenceScheduler) を渡すと、スロットの数だけワーカーを起動し、
+    推論はスケジューラーのスロットの中で行う。ultralytics は同じモデルへの推論を内部のロックで
+    1つずつしか動かさないので、同時に推論させたいときは replicas にスロットの数だけモデルを渡す
+    （ワーカー i は replicas[i % len(replicas)] を使う）。同じモデルを使うワーカー同士は
+    モデルごとのロックで順番に推論し、ロックの待ち（model_wait）も計算時間とは別に記録する。
+    待ち時間はキューの待ち（queue_wait）・スロットの待ち（slot_wait）・モデルの待ち（model_wait）に分け、
+    推論そのものの時間（compute）とは別に記録する。
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait=0.02, max_queue=64, timeout=30.0, scheduler=None, tracer=None,
+                 replicas=None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self.tracer = tracer
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "timed_out": 0,
+            "batches": 0, "batched_images": 0, "max_queue_depth": 0,
+            "queue_wait_total": 0.0, "slot_wait_total": 0.0, "model_wait_total": 0.0, "inference_total": 0.0,
+        }
+        self._closed = threading.Event()
+        models = list(replicas) if replicas else [model]
+        locks = {}
+        for m in models:
+            locks.setdefault(id(m), threading.Lock())
+        workers = scheduler.max_slots if scheduler is not None else 1
+        self._workers = []
+        for i in range(workers):
+            worker_model = models[i % len(models)]
+            self._workers.append(threading.Thread(
+                target=self._run, args=(worker_model, locks[id(worker_model)]), name=f"yolo-inference-{i}", daemon=True
+            ))
+        for worker in self._workers:
+            worker.start()
+
+    # --- 呼び出し側 ---
+    @property
+    def names(self):
+        return self.model.names
+
+    def submit(self, image, timeout=None, **options):
+        """推論リクエストをキューに積み、結果（ultralytics の Results）を受け取る Future を返す"""
+        if self._closed.is_set():
+            raise RuntimeError("推論サービスは停止しています。")
+        timeout = self.timeout if timeout is None else timeout
+        request = _Request(image, options, time.monotonic() + timeout)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            self._count("rejected")
+            raise InferenceQueueFull(f"推論待ちが上限（{self._queue.maxsize}件）に達しています。") from None
+        with self._stats_lock:
+            self._stats["submitted"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue.qsize())
+        return request.future
+
+    def __call__(self, image, timeout=None, **options):
+        """モデルと同じ呼び出し方で推論し、[Results] を返す（タイムアウトしたら TimeoutError）"""
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(image, timeout=timeout, **options)
+        try:
+            return [future.result(timeout=timeout)]
+        except FutureTimeoutError:
+            # まだ推論が始まっていなければ取り消して、ワーカーに捨てさせる
+            future.cancel()
+            raise TimeoutError(f"推論が{timeout}秒以内に終わりませんでした。") from None
+
+    def stats(self):
+        """キューの深さ・バッチの大きさ・待ち時間などの統計を返す"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["max_queue"] = self._queue.maxsize
+        stats["avg_batch_size"] = stats["batched_images"] / stats["batches"] if stats["batches"] else 0.0
+        stats["avg_queue_wait"] = stats["queue_wait_total"] / stats["completed"] if stats["completed"] else 0.0
+        stats["avg_slot_wait"] = stats["slot_wait_total"] / stats["completed"] if stats["completed"] else 0.0
+        stats["avg_model_wait"] = stats["model_wait_total"] / stats["batches"] if stats["batches"] else 0.0
+        stats["avg_inference"] = stats["inference_total"] / stats["batches"] if stats["batches"] else 0.0
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.stats()
+        return stats
+
+    def close(self):
+        self._closed.set()
+        for worker in self._workers:
+            worker.join(timeout=1.0)
+
+    # --- ワーカー側 ---
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _collect_batch(self):
+        """最初の1件が来てから max_wait 秒以内に届いたリクエストをまとめて返す"""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, model, model_lock):
+        while not self._closed.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            now = time.monotonic()
+            for request in batch:
+                request.dequeued_at = now
+            groups = {}
+            for request in batch:
+                if now > request.deadline:
+                    # 待っている間に期限切れになったリクエストは推論しない
+                    if request.future.set_running_or_notify_cancel():
+                        request.future.set_exception(TimeoutError("推論待ちの間にタイムアウトしました。"))
+                    self._count("timed_out")
+                    continue
+                if not request.future.set_running_or_notify_cancel():
+                    # 呼び出し元がすでにタイムアウトして取り消した
+                    self._count("timed_out")
+                    continue
+                key = tuple(sorted(request.options.items()))
+                groups.setdefault(key, []).append(request)
+            for requests in groups.values():
+                self._infer(requests, model, model_lock)
+
+    def _slot(self):
+        if self.scheduler is None:
+            return contextlib.nullcontext({"wait": 0.0, "mode": None})
+        return self.scheduler.slot()
+
+    def _infer(self, requests, model, model_lock):
+        with self._slot() as slot:
+            requested = time.monotonic()
+            with model_lock:
+                started = time.monotonic()
+                try:
+                    results = model([r.image for r in requests], **requests[0].options)
+                except Exception as e:
+                    for r in requests:
+                        r.future.set_exception(e)
+                    self._count("failed", len(requests))
+                    return
+                elapsed = time.monotonic() - started
+            model_wait = slot["model_wait"] = started - requested
+        queue_waits = [r.dequeued_at - r.enqueued_at for r in requests]
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["batched_images"] += len(requests)
+            self._stats["completed"] += len(requests)
+            self._stats["inference_total"] += elapsed
+            self._stats["queue_wait_total"] += sum(queue_waits)
+            self._stats["slot_wait_total"] += slot["wait"] * len(requests)
+            self._stats["model_wait_total"] += model_wait
+        if self.tracer is not None:
+            for queue_wait in queue_waits:
+                self.tracer.record("queue_wait", queue_wait * 1000)
+                self.tracer.record("slot_wait", slot["wait"] * 1000, mode=slot["mode"])
+            self.tracer.record("model_wait", model_wait * 1000, mode=slot["mode"])
+            self.tracer.record("compute", elapsed * 1000, batch=len(requests), mode=slot["mode"])
+        for r, result in zip(requests, results):
+            r.future.set_result(result)
@@ -0,0 +1,121 @@
+import base64
+import io
+import os
+import time
+
+import numpy as np
+import streamlit.components.v1 as components
+
+_live_camera = components.declare_component(
+    "live_camera", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "live_camera")
+)
+
+
+def live_camera(sample_ms, imgsz, paused=False, key=None):
+    """ブラウザのカメラ映像から sample_ms ごとにフレームを送るコンポーネント
+
+    戻り値は最後に送られたフレーム {"mount": iframe ごとのID, "frame": 連番, "image": JPEGのdata URL,
+    "thumb": 32x24のグレースケール}（まだフレームがなければ None）。連番は iframe が作り直されると
+    1 に戻る。paused=True の間はフレームを送らない。
+    """
+    return _live_camera(sample_ms=int(sample_ms), imgsz=int(imgsz), paused=bool(paused), key=key, default=None)
+
+
+def decode_frame(frame):
+    """コンポーネントから送られたフレームのJPEGを、認識に渡せるファイルオブジェクトにする"""
+    _, _, data = frame["image"].partition(",")
+    return io.BytesIO(base64.b64decode(data))
+
+
+def same_cards(a, b):
+    """2つの Detections に写っている札（クラスIDの組み合わせ）が同じか"""
+    return np.array_equal(np.sort(a.class_ids), np.sort(b.class_ids))
+
+
+class LiveScan:
+    """ライブスキャン1回分の状態（プレイヤーごとに session_state に1つ持つ）
+
+    送られてきたフレームごとに、次のどれかを行う。
+    - 前回推論したフレームとの差分が diff_threshold 未満なら、推論せずに前の結果を使い回す
+    - 前回の推論から 1 / max_rate 秒たっていなければ、そのフレームは捨てる（セッションごとのCPUの上限）
+    - それ以外は推論し、写っている札が前回と同じなら「安定」として数える
+    stable_frames 回続けて安定したら結果を確定（locked）し、それ以降のフレームは無視する。
+    """
+
+    def __init__(self, max_rate=2.0, stable_frames=3, diff_threshold=6.0):
+        self.max_rate = max_rate
+        self.stable_frames = stable_frames
+        self.diff_threshold = diff_threshold
+        self.reset()
+
+    @classmethod
+    def from_env(cls):
+        """環境変数 HANAFUDA_LIVE_MAX_RATE / HANAFUDA_LIVE_STABLE_FRAMES / HANAFUDA_LIVE_DIFF で上書きした設定で作る"""
+        default = cls()
+        return cls(
+            max_rate=float(os.environ.get("HANAFUDA_LIVE_MAX_RATE", default.max_rate)),
+            stable_frames=int(os.environ.get("HANAFUDA_LIVE_STABLE_FRAMES", default.stable_frames)),
+            diff_threshold=float(os.environ.get("HANAFUDA_LIVE_DIFF", default.diff_threshold)),
+        )
+
+    @property
+    def sample_ms(self):
+        """ブラウザからフレームを送る間隔（推論の上限回数に合わせる）"""
+        return 1000 / self.max_rate
+
+    def reset(self):
+        self.detections = None
+        self.stable_count = 0
+        self.locked = False
+        self.last_frame = 0
+        self.mount = None
+        self._last_thumb = None
+        self._last_inference = None
+        self.stats = {"frames": 0, "inferred": 0, "reused": 0, "skipped": 0}
+
+    def frame_difference(self, thumb):
+        """前回推論したフレームとの差分（グレースケールの画素値の差の平均）"""
+        if self._last_thumb is None or thumb.shape != self._last_thumb.shape:
+            return float("inf")
+        return float(np.abs(thumb - self._last_thumb).mean())
+
+    def offer(self, frame_id, thumb, infer, now=None, mount=None):
+        """1フレーム分を処理し、"inferred" / "reused" / "skipped" / "ignored" / "failed" を返す
+
+        infer は引数なしで呼ぶと Detections（失敗なら None）を返す関数で、推論するときだけ呼ぶ。
+        mount（コンポーネントの iframe ごとのID）が変わったら、連番を数え直したものとして扱う。
+        """
+        if mount != self.mount:
+            self.mount = mount
+            self.last_frame = 0
+        if self.locked or frame_id <= self.last_frame:
+            return "ignored"
+        self.last_frame = frame_id
+        self.stats["frames"] += 1
+        now = time.monotonic() if now is None else now
+        thumb = np.asarray(thumb, dtype=np.int16)
+
+        if self.detections is not None and self.frame_difference(thumb) < self.diff_threshold:
+            self.stats["reused"] += 1
+            self.stable_count += 1
+            action = "reused"
+        elif self._last_inference is not None and now - self._last_inference < 1 / self.max_rate:
+            self.stats["skipped"] += 1
+            return "skipped"
+        else:
+            self._last_inference = now
+            detections = infer()
+            self.stats["inferred"] += 1
+            if detections is None:
+                return "failed"
+            if self.detections is not None and same_cards(detections, self.detections):
+                self.stable_count += 1
+            else:
+                self.stable_count = 1
+            self.detections = detections
+            self._last_thumb = thumb
+            action = "inferred"
+
+        if self.stable_count >= self.stable_frames and len(self.detections):
+            self.locked = True
+        return action
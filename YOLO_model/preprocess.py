@@ -0,0 +1,55 @@
+import os
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps
+
+
+@dataclass(frozen=True)
+class InferenceProfile:
+    """モデルに渡す推論設定（入力サイズ・信頼度/IoUのしきい値・最大検出数）"""
+    imgsz: int = 640
+    conf: float = 0.5
+    iou: float = 0.7
+    max_det: int = 100
+
+    @classmethod
+    def from_env(cls):
+        """環境変数 HANAFUDA_IMGSZ / HANAFUDA_CONF / HANAFUDA_IOU / HANAFUDA_MAX_DET で上書きした設定を作る"""
+        default = cls()
+        return cls(
+            imgsz=int(os.environ.get("HANAFUDA_IMGSZ", default.imgsz)),
+            conf=float(os.environ.get("HANAFUDA_CONF", default.conf)),
+            iou=float(os.environ.get("HANAFUDA_IOU", default.iou)),
+            max_det=int(os.environ.get("HANAFUDA_MAX_DET", default.max_det)),
+        )
+
+    def predict_kwargs(self):
+        """yolo_model(image, **kwargs) にそのまま渡せる引数"""
+        return {"imgsz": self.imgsz, "conf": self.conf, "iou": self.iou, "max_det": self.max_det, "verbose": False}
+
+    def cache_token(self):
+        """認識結果のキャッシュのキーに使う文字列"""
+        return f"{self.imgsz}-{self.conf}-{self.iou}-{self.max_det}"
+
+
+DEFAULT_PROFILE = InferenceProfile()
+
+
+def load_image_for_inference(uploaded_file, imgsz=DEFAULT_PROFILE.imgsz):
+    """写真を推論用に読み込む（JPEGは縮小デコード、EXIFの向きを補正、長辺を imgsz に縮小）
+
+    スマホの写真（12〜48MP）をフル解像度でデコードせず、JPEGのドラフトモードで
+    imgsz 以上の最小の 1/2・1/4・1/8 スケールでデコードしてから1回だけ縮小する。
+    """
+    image = Image.open(uploaded_file)
+    if image.format == "JPEG":
+        # 回転前の縦横どちらが長辺になっても imgsz を下回らないよう正方形で指定する
+        image.draft("RGB", (imgsz, imgsz))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    # 縮小の枠は正方形なので、向きの補正は縮小後の小さい画像に対して行えばよい
+    exif = image.getexif()
+    if max(image.size) > imgsz:
+        image.thumbnail((imgsz, imgsz), Image.Resampling.BILINEAR, reducing_gap=2.0)
+        image.info["exif"] = exif.tobytes()
+    return ImageOps.exif_transpose(image)
@@ -0,0 +1,159 @@
+import contextlib
+import os
+import sys
+import threading
+import time
+
+# 推論スロットの使い方
+FAT = "fat"    # 1つの推論にすべてのスレッドを使う（空いているときのレイテンシ重視）
+THIN = "thin"  # 複数の推論を少ないスレッドで同時に動かす（混んでいるときのスループット重視）
+
+
+class ThreadBudget:
+    """推論に使うCPUスレッドの予算
+
+    PyTorch は何も設定しないと1回の推論で全コアを使うので、複数のセッションから同時に
+    推論すると、スレッドの取り合いで待ち時間の裾が大きく伸びる。ここでは cores 本の
+    スレッドを、1スロット × cores 本（FAT）か、slots スロット × (cores // slots) 本（THIN）の
+    どちらかに割り振る。
+    """
+
+    def __init__(self, cores=None, slots=2, interop_threads=1):
+        self.cores = max(1, cores or os.cpu_count() or 1)
+        self.slots = max(1, min(slots, self.cores))
+        self.interop_threads = max(1, interop_threads)
+
+    @classmethod
+    def from_env(cls):
+        """環境変数 HANAFUDA_CPU_THREADS / HANAFUDA_INFERENCE_SLOTS / HANAFUDA_INTEROP_THREADS で上書きした設定で作る"""
+        default = cls()
+        return cls(
+            cores=int(os.environ.get("HANAFUDA_CPU_THREADS", default.cores)),
+            slots=int(os.environ.get("HANAFUDA_INFERENCE_SLOTS", default.slots)),
+            interop_threads=int(os.environ.get("HANAFUDA_INTEROP_THREADS", default.interop_threads)),
+        )
+
+    def plan(self, mode):
+        """(同時に動かす推論の数, 1つの推論のスレッド数) を返す"""
+        if mode == THIN:
+            return self.slots, max(1, self.cores // self.slots)
+        return 1, self.cores
+
+    def choose(self, load):
+        """実行中と待ち中の推論の数（load）から、FAT と THIN のどちらを使うかを決める"""
+        return THIN if load > 1 and self.slots > 1 else FAT
+
+
+def _torch():
+    """すでに import されている torch（ultralytics の読み込み後）を返す。なければ None"""
+    return sys.modules.get("torch")
+
+
+class InferenceScheduler:
+    """推論の同時実行数を ThreadBudget に合わせて制限する、上限が変わるセマフォ
+
+    with scheduler.slot(): ... の中で推論する。実行中と待ち中の推論の数から FAT / THIN を選び、
+    切り替えるときは実行中の推論がなくなるのを待ってから torch のスレッド数を変える
+    （torch.set_num_threads はプロセス全体の設定なので、推論の途中では変えない）。
+    待ち時間（スロットが空くまで）と計算時間は別々に集計する。スロットの中でモデルのロックを
+    待った時間は、呼び出し側が info["model_wait"] に入れると計算時間から除いて別に集計する。
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.mode = None
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._stats = {
+            "runs": 0, "switches": 0, "wait_total": 0.0, "model_wait_total": 0.0, "compute_total": 0.0, FAT: 0, THIN: 0,
+        }
+
+    @property
+    def max_slots(self):
+        return self.budget.slots
+
+    def configure(self):
+        """モデルの読み込み直後に1回だけ呼び、torch の inter-op のスレッド数と初期のスレッド数を設定する"""
+        torch = _torch()
+        if torch is None:
+            return
+        try:
+            torch.set_num_interop_threads(self.budget.interop_threads)
+        except RuntimeError:
+            # すでに並列処理が始まっていると変更できない（その場合は torch の既定のまま）
+            pass
+        with self._cond:
+            if self._running == 0:
+                self._switch(FAT)
+
+    def _switch(self, mode):
+        _, threads = self.budget.plan(mode)
+        torch = _torch()
+        if torch is not None:
+            torch.set_num_threads(threads)
+        if self.mode is not None:
+            self._stats["switches"] += 1
+        self.mode = mode
+
+    def _can_start(self):
+        mode = self.budget.choose(self._running + self._waiting)
+        if mode != self.mode:
+            if self._running:
+                # 実行中の推論が終わるまで切り替えを待つ（ただし今のモードに空きがあれば先に動かす）
+                return self._running < self.budget.plan(self.mode)[0]
+            self._switch(mode)
+        return self._running < self.budget.plan(self.mode)[0]
+
+    @contextlib.contextmanager
+    def slot(self):
+        """推論1回分のスロットを確保する（yield するのは {"wait": 秒, "mode": ...}。"model_wait" は呼び出し側が入れる）"""
+        requested = time.monotonic()
+        with self._cond:
+            self._waiting += 1
+            try:
+                while not self._can_start():
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+            self._running += 1
+            mode = self.mode
+        started = time.monotonic()
+        info = {"wait": started - requested, "mode": mode}
+        try:
+            yield info
+        finally:
+            model_wait = info.get("model_wait", 0.0)
+            compute = time.monotonic() - started - model_wait
+            with self._cond:
+                self._running -= 1
+                self._stats["runs"] += 1
+                self._stats[mode] += 1
+                self._stats["wait_total"] += info["wait"]
+                self._stats["model_wait_total"] += model_wait
+                self._stats["compute_total"] += compute
+                self._cond.notify_all()
+            info["compute"] = compute
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(mode=self.mode, running=self._running, waiting=self._waiting)
+        stats["threads"] = self.budget.plan(stats["mode"] or FAT)[1]
+        stats["avg_wait"] = stats["wait_total"] / stats["runs"] if stats["runs"] else 0.0
+        stats["avg_model_wait"] = stats["model_wait_total"] / stats["runs"] if stats["runs"] else 0.0
+        stats["avg_compute"] = stats["compute_total"] / stats["runs"] if stats["runs"] else 0.0
+        return stats
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_inference_scheduler():
+    """プロセス全体で1つの InferenceScheduler を返す（推論はすべてこれを通す）"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = InferenceScheduler(ThreadBudget.from_env())
+        return _scheduler
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+
+from YOLO_model.backends import configured_backend, load_detector
+from YOLO_model.detections import class_table_for
+from YOLO_model.preprocess import InferenceProfile
+from YOLO_model.thread_budget import get_inference_scheduler
+
+# 状態
+IDLE = "idle"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+class ModelWarmer:
+    """認識モデルをバックグラウンドのスレッドで import・読み込みし、ダミー画像で1回推論して温めるクラス
+
+    start() は何度呼んでも1回しかスレッドを起動しない。ページ側は state を見て
+    「準備中」を表示するだけで、モデルの読み込みを待ってブロックしない。
+    ultralytics は1つのモデルへの推論を1つずつしか動かさないので、推論スロットの数だけ
+    モデルを読み込み、replicas に入れる（model は replicas[0]）。
+    """
+
+    def __init__(self, backend, profile):
+        self.backend = backend
+        self.profile = profile
+        self.state = IDLE
+        self.model = None
+        self.replicas = []
+        self.error = None
+        self.load_seconds = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def start(self):
+        """まだ起動していなければ、読み込み用のスレッドを起動する"""
+        with self._lock:
+            if self.state != IDLE:
+                return
+            self.state = WARMING
+        threading.Thread(target=self._warm, name="yolo-warmup", daemon=True).start()
+
+    def retry(self):
+        """読み込みに失敗していたら、もう一度読み込み用のスレッドを起動する"""
+        with self._lock:
+            if self.state != FAILED:
+                return
+            self.state = IDLE
+            self.error = None
+        self.start()
+
+    def _warm(self):
+        started = time.monotonic()
+        try:
+            from PIL import Image
+
+            model = load_detector(self.backend)
+            # 最初の推論の前に torch のスレッド数を推論スロットの予算に合わせる
+            scheduler = get_inference_scheduler()
+            scheduler.configure()
+            dummy = Image.new("RGB", (self.profile.imgsz, self.profile.imgsz))
+            replicas = [model]
+            model(dummy, **self.profile.predict_kwargs())
+            # 同時に推論するスロットには、それぞれ別のモデル（と predictor）を持たせる
+            for _ in range(scheduler.max_slots - 1):
+                replica = load_detector(self.backend)
+                replica(dummy, **self.profile.predict_kwargs())
+                replicas.append(replica)
+            # クラスID → 札の種類の対応表は読み込み時に1回だけ作っておく
+            class_table_for(model.names)
+        except Exception as e:
+            self.error = e
+            self.state = FAILED
+            return
+        self.model = model
+        self.replicas = replicas
+        self.load_seconds = time.monotonic() - started
+        self.state = READY
+
+
+_warmer = None
+_warmer_lock = threading.Lock()
+
+
+def get_model_warmer():
+    """プロセス全体で1つの ModelWarmer を返す"""
+    global _warmer
+    with _warmer_lock:
+        if _warmer is None:
+            _warmer = ModelWarmer(configured_backend(), InferenceProfile.from_env())
+        return _warmer
+
+
+def warmup_enabled():
+    """サーバー起動時（最初のページ表示時）に温めるか（HANAFUDA_WARMUP=0 で無効）"""
+    return os.environ.get("HANAFUDA_WARMUP", "1") != "0"
@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.web
+
+from functions import calculate_points_from_detections, detect_cards
+from game_store import DEFAULT_DB_PATH, GameStore
+from ledger import ScoreLedger
+from rule_sets import PRESETS, compile_rules
+from scoring import CARD_TYPES, MonthInput, settle_month, validate_month
+from tracing import get_tracer, new_trace_id
+from YOLO_model.backends import BACKEND_WEIGHTS
+from YOLO_model.detection_cache import DetectionCache, cache_key, weights_version
+from YOLO_model.inference_queue import InferenceQueueFull, InferenceService
+from YOLO_model.preprocess import InferenceProfile
+from YOLO_model.thread_budget import get_inference_scheduler
+from YOLO_model.warmup import FAILED, get_model_warmer
+
+# サーバーの設定（環境変数で変更できる）
+DEFAULT_PORT = int(os.environ.get("HANAFUDA_API_PORT", "8600"))
+API_WORKERS = int(os.environ.get("HANAFUDA_API_WORKERS", "4"))
+MAX_UPLOAD_BYTES = int(os.environ.get("HANAFUDA_API_MAX_UPLOAD", str(64 * 1024 * 1024)))
+# 1回のリクエストで受け付ける月・画像の数の上限
+MAX_BATCH = 64
+# 八八の初期得点（pages/setting.py の初期値と同じ）
+HACHIHACHI_INITIAL_SCORE = 60
+LAST_MONTH = 12
+
+
+class ApiError(tornado.web.HTTPError):
+    """リクエストの内容に誤りがあるときの例外（status_code と message をそのままJSONで返す）"""
+
+    def __init__(self, status, message):
+        super().__init__(status)
+        self.message = message
+
+
+def resolve_rules(value):
+    """プリセット名か game_rules 形式の辞書から CompiledRules を返す"""
+    if isinstance(value, str):
+        if value not in PRESETS:
+            raise ApiError(400, f"不明なプリセットです: {value}（{', '.join(PRESETS)} から選択）")
+        return PRESETS[value]
+    if isinstance(value, dict):
+        try:
+            return compile_rules(value)
+        except (TypeError, ValueError, KeyError) as e:
+            raise ApiError(400, f"ルールの形式が正しくありません: {e}") from None
+    raise ApiError(400, "rules にはプリセット名か game_rules 形式の辞書を指定してください。")
+
+
+def as_batch(body, key):
+    """{"<key>": [...]} ならそのリストを、それ以外なら body 1件だけのリストを返す"""
+    items = body[key] if isinstance(body, dict) and key in body else [body]
+    if not isinstance(items, list) or not items:
+        raise ApiError(400, f"{key} には1件以上のリストを指定してください。")
+    if len(items) > MAX_BATCH:
+        raise ApiError(413, f"1回のリクエストで送れるのは{MAX_BATCH}件までです。")
+    return items
+
+
+def settle(data, rules):
+    """月の入力（MonthInput.from_dict の形）を検証して精算し、{プレイヤー: 点数} を返す"""
+    try:
+        month = MonthInput.from_dict(data)
+    except (TypeError, ValueError, KeyError) as e:
+        raise ApiError(400, f"月の入力の形式が正しくありません: {e}") from None
+    error = validate_month(month, rules.scoring)
+    if error:
+        raise ApiError(400, error)
+    try:
+        return settle_month(month, rules.scoring)
+    except (TypeError, ValueError) as e:
+        raise ApiError(400, f"月の入力の値が正しくありません: {e}") from None
+
+
+def player_scores(value, players, key, partial=False):
+    """{プレイヤー: 整数の点数} の辞書を検証する（partial=True なら一部のプレイヤーだけでもよい）"""
+    if not isinstance(value, dict):
+        raise ApiError(400, f"{key} にはプレイヤーごとの点数の辞書を指定してください。")
+    unknown = set(value) - set(players)
+    if unknown:
+        raise ApiError(400, f"{key} にゲームにいないプレイヤーがいます: {', '.join(sorted(unknown))}")
+    missing = [] if partial else [p for p in players if p not in value]
+    if missing:
+        raise ApiError(400, f"{key} にすべてのプレイヤーの点数を指定してください（不足: {', '.join(missing)}）。")
+    invalid = [p for p, score in value.items() if not isinstance(score, int) or isinstance(score, bool)]
+    if invalid:
+        raise ApiError(400, f"{key} の点数は整数で指定してください: {', '.join(invalid)}")
+    return value
+
+
+def detections_json(detections, rules):
+    """認識結果をレスポンス用の辞書にする"""
+    return {
+        "count": len(detections),
+        "cards": detections.names(),
+        "confidences": [round(float(c), 4) for c in detections.confs],
+        "card_types": dict(zip(CARD_TYPES, detections.card_type_counts())),
+        "points": calculate_points_from_detections(detections, rules),
+    }
+
+
+def game_json(saved):
+    ledger = saved.ledger
+    return {
+        "game_id": saved.game_id,
+        "players": saved.players,
+        "current_month": saved.current_month,
+        "finished": saved.current_month > LAST_MONTH,
+        "rules": saved.game_rules,
+        "ledger": ledger.snapshot(),
+        "totals": ledger.totals(),
+        "updated_at": saved.updated_at,
+    }
+
+
+class ApiHandler(tornado.web.RequestHandler):
+    """JSON を受け取り、JSON を返すハンドラーの共通部分"""
+
+    def initialize(self, app_state):
+        self.app_state = app_state
+
+    def json_body(self):
+        try:
+            return json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise ApiError(400, "リクエストの本文が JSON ではありません。") from None
+
+    def write_json(self, value, status=200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps(value, ensure_ascii=False))
+
+    def write_error(self, status_code, **kwargs):
+        error = kwargs.get("exc_info", (None, None, None))[1]
+        message = error.message if isinstance(error, ApiError) else self._reason
+        self.write_json({"error": message}, status_code)
+
+
+class HealthHandler(ApiHandler):
+    def get(self):
+        warmer = get_model_warmer()
+        service = self.app_state.inference_service
+        self.write_json({
+            "model": warmer.state,
+            "model_error": str(warmer.error) if warmer.error else None,
+            "inference": service.stats() if service is not None else None,
+            "detection_cache": self.app_state.detection_cache.stats(),
+        })
+
+
+class SettleHandler(ApiHandler):
+    """POST /api/settle  {"rules": ..., "month": {...}} または {"rules": ..., "months": [...]}"""
+
+    def post(self):
+        body = self.json_body()
+        if not isinstance(body, dict) or "rules" not in body:
+            raise ApiError(400, "rules を指定してください。")
+        rules = resolve_rules(body["rules"])
+        if "months" in body:
+            months = as_batch(body, "months")
+        elif "month" in body:
+            months = [body["month"]]
+        else:
+            raise ApiError(400, "month か months を指定してください。")
+        self.write_json({"results": [settle(month, rules) for month in months]})
+
+
+class DetectHandler(ApiHandler):
+    """POST /api/detect?rules=八八  画像（multipart の複数ファイル、または本文そのもの）から札を認識する"""
+
+    async def post(self):
+        rules = resolve_rules(self.get_argument("rules", "八八"))
+        service = self.app_state.load_inference_service()
+        if service is None:
+            warmer = get_model_warmer()
+            if warmer.state == FAILED:
+                raise ApiError(500, f"モデルの読み込み中にエラーが発生しました: {warmer.error}")
+            raise ApiError(503, "認識モデルを準備中です。しばらくしてからもう一度送ってください。")
+
+        images = [(f.filename, f.body) for files in self.request.files.values() for f in files]
+        if not images and self.request.body and not self.request.headers.get("Content-Type", "").startswith("multipart/"):
+            images = [(self.get_argument("filename", "image"), self.request.body)]
+        if not images:
+            raise ApiError(400, "画像を送ってください（multipart/form-data か、画像そのものを本文に）。")
+        if len(images) > MAX_BATCH:
+            raise ApiError(413, f"1回のリクエストで送れる画像は{MAX_BATCH}枚までです。")
+
+        # 画像ごとにワーカーで認識する。推論そのものは InferenceService がまとめてバッチにする
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self.app_state.executor, self.app_state.detect, data) for _, data in images
+        ], return_exceptions=True)
+
+        response = []
+        for (filename, data), result in zip(images, results):
+            item = {"filename": filename, "bytes": len(data)}
+            if isinstance(result, InferenceQueueFull):
+                raise ApiError(503, str(result))
+            if isinstance(result, Exception):
+                item["error"] = f"画像処理中にエラーが発生しました: {result}"
+            else:
+                item.update(detections_json(result, rules))
+            response.append(item)
+        self.write_json({"results": response})
+
+
+class GamesHandler(ApiHandler):
+    """GET /api/games（最近のゲームの一覧）・POST /api/games（新しいゲームを作る）"""
+
+    def get(self):
+        try:
+            limit = int(self.get_argument("limit", "20"))
+        except ValueError:
+            raise ApiError(400, "limit には整数を指定してください。") from None
+        self.write_json({"games": [
+            {"game_id": game_id, "players": players, "current_month": month, "updated_at": updated_at}
+            for game_id, players, month, updated_at in self.app_state.store.list_games(limit)
+        ]})
+
+    def post(self):
+        body = self.json_body()
+        players = body.get("players") if isinstance(body, dict) else None
+        if not isinstance(players, list) or len(players) < 2 or len(set(players)) != len(players):
+            raise ApiError(400, "players には重複のない2人以上の名前を指定してください。")
+        rules = resolve_rules(body.get("rules", "八八"))
+        default_score = HACHIHACHI_INITIAL_SCORE if rules.game_name == "八八" else 0
+        given_scores = player_scores(body.get("initial_scores", {}), players, "initial_scores", partial=True)
+        initial_scores = {p: given_scores.get(p, default_score) for p in players}
+        store = self.app_state.store
+        game_id = store.create_game(players, rules.to_dict(), ScoreLedger(initial_scores))
+        self.write_json(game_json(store.load_game(game_id)), 201)
+
+
+class GameHandler(ApiHandler):
+    """GET /api/games/<id>  得点表と合計点を返す"""
+
+    def get(self, game_id):
+        saved = self.app_state.store.load_game(game_id)
+        if saved is None:
+            raise ApiError(404, f"ゲームが見つかりません: {game_id}")
+        game = game_json(saved)
+        game["history"] = [{"label": label, "scores": scores} for label, scores in self.app_state.store.month_history(game_id)]
+        self.write_json(game)
+
+
+class MonthsHandler(ApiHandler):
+    """POST /api/games/<id>/months  月の記録を追加する
+
+    各月は MonthInput.from_dict の形（ゲームのルールで精算する）か、精算済みの {"scores": {...}}。
+    {"months": [...]} で複数の月をまとめて送ると、1つのトランザクションで保存する。
+    ハンドラーはイベントループ上で同期的に動くので、同じゲームへの追加が途中で混ざることはない。
+    """
+
+    def post(self, game_id):
+        store = self.app_state.store
+        saved = store.load_game(game_id)
+        if saved is None:
+            raise ApiError(404, f"ゲームが見つかりません: {game_id}")
+        months = as_batch(self.json_body(), "months")
+        if saved.current_month + len(months) - 1 > LAST_MONTH:
+            raise ApiError(409, f"記録できるのは{LAST_MONTH}月までです（現在 {saved.current_month}月）。")
+
+        rules = compile_rules(saved.game_rules)
+        current_month, recorded = saved.current_month, []
+        for data in months:
+            if isinstance(data, dict) and "scores" in data:
+                month, scores = None, player_scores(data["scores"], saved.players, "scores")
+            else:
+                if not isinstance(data, dict):
+                    raise ApiError(400, "月の入力は辞書で指定してください。")
+                # プレイヤーは保存されたゲームのものを使う（本文の players で上書きさせない）
+                month = {**data, "players": saved.players}
+                scores = settle(month, rules)
+            recorded.append((f"{current_month}月", scores, month))
+            current_month += 1
+        # 全部の月を精算できてから得点表に記録する（途中でエラーになったら何も記録しない）
+        log = saved.log
+        events = [log.record(label, scores, month) for label, scores, month in recorded]
+        store.record_events(game_id, events, saved.players, saved.game_rules, log, current_month)
+
+        game = game_json(store.load_game(game_id))
+        game["recorded"] = [{"label": label, "scores": scores} for label, scores, _ in recorded]
+        self.write_json(game, 201)
+
+
+class AppState:
+    """全ハンドラーで共有するもの（保存先・推論のワーカー・認識結果のキャッシュ）"""
+
+    def __init__(self, store, workers=API_WORKERS, profile=None):
+        self.store = store
+        self.profile = profile or InferenceProfile.from_env()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-detect")
+        self.detection_cache = DetectionCache(disk_dir=os.environ.get("HANAFUDA_DETECTION_CACHE_DIR"))
+        self.inference_service = None
+        self._model_version = None
+
+    def load_inference_service(self):
+        """モデルの準備ができていれば推論サービスを返す（準備中・失敗なら None）"""
+        warmer = get_model_warmer()
+        warmer.start()
+        if not warmer.ready:
+            return None
+        if self.inference_service is None:
+            self.inference_service = InferenceService(
+                warmer.model, scheduler=get_inference_scheduler(), tracer=get_tracer(), replicas=warmer.replicas
+            )
+            self._model_version = weights_version(BACKEND_WEIGHTS.get(warmer.backend, ""))
+        return self.inference_service
+
+    def detect(self, data):
+        """ワーカーのスレッドで1枚を認識する（同じ画像はキャッシュから返す）"""
+        key = cache_key(hashlib.md5(data).hexdigest(), self._model_version, self.profile.cache_token())
+        return detect_cards(io.BytesIO(data), self.inference_service, self.detection_cache, key, self.profile,
+                            new_trace_id())
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if self.inference_service is not None:
+            self.inference_service.close()
+
+
+def make_app(app_state):
+    args = {"app_state": app_state}
+    return tornado.web.Application([
+        (r"/api/health", HealthHandler, args),
+        (r"/api/settle", SettleHandler, args),
+        (r"/api/detect", DetectHandler, args),
+        (r"/api/games", GamesHandler, args),
+        (r"/api/games/([0-9a-f]+)", GameHandler, args),
+        (r"/api/games/([0-9a-f]+)/months", MonthsHandler, args),
+    ])
+
+
+async def serve(host, port, db_path):
+    app_state = AppState(GameStore(db_path))
+    # モデルは起動と同時にバックグラウンドで読み込み始める
+    get_model_warmer().start()
+    server = make_app(app_state).listen(port, address=host, max_body_size=MAX_UPLOAD_BYTES)
+    print(f"Hanafuda API: http://{host}:{port}/api/health")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+        app_state.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="得点の精算・札の認識・得点表をHTTPで提供するローカルサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="ゲームの保存先（アプリと同じ SQLite ファイル）")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.db))
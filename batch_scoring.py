@@ -0,0 +1,88 @@
+import numpy as np
+
+from scoring import CARD_TYPES
+
+# 配列の形状の約束:
+#   counts         (月数, プレイヤー数, 4)  光・タネ・短冊・カスの枚数（CARD_TYPES の順）
+#   base_scores    (月数, プレイヤー数)     取り札の点数（得点入力の人は入力値）
+#   active         (月数, プレイヤー数)     その月に勝負した（出た）プレイヤーなら True
+#   teyaku_totals  (月数, プレイヤー数)     手役の合計点（飛び込み・抜け役を含む）
+#   multipliers    (月数,)                  場の倍率 × 追加の倍率
+# プレイヤーの列の並びは scoring.MonthInput.active_players の並びと揃えること
+# （同点の最高得点者が丸め誤差を吸収するときの優先順位になる）。
+
+
+def card_scores_vector(card_scores):
+    """{'光': 20, ...} 形式の札の点数を CARD_TYPES 順のベクトルにする"""
+    if isinstance(card_scores, dict):
+        card_scores = [card_scores.get(t, 0) for t in CARD_TYPES]
+    return np.asarray(card_scores)
+
+
+def batch_card_points(counts, card_scores):
+    """取り札の枚数の配列から点数の配列を計算する（calculate_score_from_cards と同じく整数に切り捨て）"""
+    points = np.asarray(counts) @ card_scores_vector(card_scores)
+    if points.dtype.kind == 'f':
+        points = np.trunc(points)
+    return points.astype(np.int64)
+
+
+def batch_settle_card_play(base_scores, active):
+    """役なし（取り札勝負）の主得点をまとめて精算する
+
+    2人なら点差をそのままやり取りし、3人以上なら平均との差を四捨五入して
+    丸め誤差を最高得点者に吸収させる（scoring._settle_cards と同じ結果になる）。
+    """
+    base = np.asarray(base_scores, dtype=np.int64)
+    active = np.asarray(active, dtype=bool)
+    masked = np.where(active, base, 0)
+    n = active.sum(axis=1)
+    total = masked.sum(axis=1)
+
+    change = np.zeros_like(base)
+
+    # 2人: 自分 − 相手 = 2×自分 − 合計
+    two = n == 2
+    change[two] = 2 * masked[two] - total[two, None]
+
+    many = n > 2
+    if many.any():
+        m_base = masked[many]
+        m_active = active[many]
+        avg = total[many] / n[many]
+        rounded = np.where(m_active, np.rint(m_base - avg[:, None]), 0).astype(np.int64)
+        err = rounded.sum(axis=1)
+        winner = np.argmax(np.where(m_active, m_base, np.iinfo(np.int64).min), axis=1)
+        rounded[np.arange(len(rounded)), winner] -= err
+        change[many] = rounded
+
+    return np.where(active, change, 0)
+
+
+def batch_settle_teyaku(teyaku_totals, active):
+    """手役の差し引き精算（各人 n×自分の手役 − 参加者全員の合計）"""
+    active = np.asarray(active, dtype=bool)
+    totals = np.where(active, np.asarray(teyaku_totals, dtype=np.int64), 0)
+    n = active.sum(axis=1, keepdims=True)
+    return np.where(active, n * totals - totals.sum(axis=1, keepdims=True), 0)
+
+
+def batch_settle(counts=None, active=None, card_scores=None, base_scores=None,
+                 teyaku_totals=None, multipliers=None):
+    """取り札勝負の月をまとめて精算し、(月数, プレイヤー数) の得点変動を返す
+
+    counts と card_scores の代わりに base_scores を直接渡すこともできる。
+    下り賃・追い込み賃・みずてんは含まない（降りた人の変動は0）。
+    """
+    if base_scores is None:
+        base_scores = batch_card_points(counts, card_scores)
+    base_scores = np.asarray(base_scores, dtype=np.int64)
+    if active is None:
+        active = np.ones(base_scores.shape, dtype=bool)
+
+    change = batch_settle_card_play(base_scores, active)
+    if teyaku_totals is not None:
+        change += batch_settle_teyaku(teyaku_totals, active)
+    if multipliers is not None:
+        change *= np.asarray(multipliers, dtype=np.int64)[:, None]
+    return change
@@ -0,0 +1,87 @@
+"""NumPy 一括精算 (batch_scoring.batch_settle) の計測とスカラー版との一致確認
+
+使い方: python benchmarks/bench_batch_scoring.py [--months 100000] [--players 7]
+ランダムな取り札勝負の月を scoring.settle_month と batch_settle の両方で精算し、
+結果が1点でも食い違えば終了コード1を返す。
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_scoring import batch_settle
+from rules import DEFAULT_HACHIHACHI_RULES
+from scoring import MonthInput, PlayerInput, ScoringRules, ba_multiplier, settle_month
+
+
+def make_batch(months, players, seed=0):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, 8, size=(months, players, 4))
+    active = rng.random((months, players)) < 0.7
+    teyaku = np.where(rng.random((months, players)) < 0.2, rng.choice([24, 36, 48, 72, 96], size=(months, players)), 0)
+    ba = rng.choice(["小場 (x1)", "大場 (x2)", "絶場 (x4)"], size=months)
+    custom = rng.integers(1, 3, size=months)
+    multipliers = np.array([ba_multiplier(b) for b in ba]) * custom
+    return counts, active, teyaku, ba, custom, multipliers
+
+
+def scalar_settle(counts, active, teyaku, ba, custom, rules):
+    """同じ入力を1か月ずつ settle_month で精算する"""
+    months, players = active.shape
+    names = tuple(f"P{i}" for i in range(players))
+    teyaku_name = {score: name for name, score in rules.teyaku.items()}
+    out = np.zeros((months, players), dtype=np.int64)
+    for m in range(months):
+        inputs = {
+            names[i]: PlayerInput(
+                brights=int(counts[m, i, 0]), animals=int(counts[m, i, 1]),
+                ribbons=int(counts[m, i, 2]), chaff=int(counts[m, i, 3]),
+                teyaku=(teyaku_name[int(teyaku[m, i])],) if teyaku[m, i] else (),
+            )
+            for i in range(players)
+        }
+        month = MonthInput(
+            players=names,
+            active_players=tuple(n for i, n in enumerate(names) if active[m, i]),
+            inputs=inputs, ba_status=str(ba[m]), custom_multiplier=int(custom[m]),
+        )
+        out[m] = list(settle_month(month, rules).values())
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--months", type=int, default=100_000)
+    parser.add_argument("--players", type=int, default=7)
+    parser.add_argument("--check", type=int, default=20_000, help="スカラー版と突き合わせる月数")
+    args = parser.parse_args()
+
+    game_rules = dict(DEFAULT_HACHIHACHI_RULES, enable_orichin=False, enable_oikomi=False, enable_mizuten=False)
+    rules = ScoringRules.from_game_rules(game_rules)
+    counts, active, teyaku, ba, custom, multipliers = make_batch(args.months, args.players)
+
+    start = time.perf_counter()
+    batch = batch_settle(counts, active, game_rules['card_scores'], teyaku_totals=teyaku, multipliers=multipliers)
+    batch_elapsed = time.perf_counter() - start
+    print(f"batch_settle: {args.months} months x {args.players} players in {batch_elapsed * 1000:.1f} ms")
+
+    check = min(args.check, args.months)
+    start = time.perf_counter()
+    scalar = scalar_settle(counts[:check], active[:check], teyaku[:check], ba[:check], custom[:check], rules)
+    scalar_elapsed = time.perf_counter() - start
+    print(f"settle_month: {check} months in {scalar_elapsed * 1000:.1f} ms (入力の組み立てを含む)")
+
+    mismatched = np.flatnonzero((scalar != batch[:check]).any(axis=1))
+    if len(mismatched):
+        print(f"FAILED: {len(mismatched)} months differ from the scalar path (first: month {mismatched[0]})")
+        return 1
+    print(f"OK: {check} months match the scalar path")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
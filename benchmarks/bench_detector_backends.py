@@ -0,0 +1,122 @@
+"""推論バックエンド（torch / onnx / onnx-int8）の速度・メモリ計測と認識結果の一致確認
+
+使い方: python benchmarks/bench_detector_backends.py --images 写真のフォルダ [--backends torch onnx onnx-int8]
+重みファイルがないバックエンドは飛ばす。ONNX は事前に python -m YOLO_model.backends --int8 で書き出しておく。
+各バックエンドは別プロセスで読み込み、読み込み時間・推論レイテンシ（p50/p95）・RSS の増分を表示する。
+画像ごとの認識された札の種類（クラス）が torch と食い違ったら終了コード1を返す。
+"""
+import argparse
+import collections
+import glob
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def rss_bytes():
+    """現在のプロセスの RSS（Linux は /proc、それ以外は ru_maxrss で代用）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_backend(backend, image_paths, warmup):
+    """1つのバックエンドで全画像を推論し、計測結果と認識されたクラスを返す（子プロセスで実行）"""
+    os.chdir(ROOT)
+    from YOLO_model.backends import detections_from_results, load_detector
+    from YOLO_model.preprocess import DEFAULT_PROFILE, load_image_for_inference
+
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    model = load_detector(backend)
+    load_time = time.perf_counter() - start
+    images = [load_image_for_inference(path, DEFAULT_PROFILE.imgsz) for path in image_paths]
+    kwargs = DEFAULT_PROFILE.predict_kwargs()
+    for image in images[:warmup]:
+        model(image, **kwargs)
+
+    latencies, classes = [], []
+    for image in images:
+        start = time.perf_counter()
+        results = model(image, **kwargs)
+        latencies.append(time.perf_counter() - start)
+        detections = detections_from_results(results[0], model.names)
+        classes.append(sorted(detections.names()))
+    return {
+        "backend": backend,
+        "load_time": load_time,
+        "latencies": latencies,
+        "rss_delta": rss_bytes() - rss_before,
+        "classes": classes,
+    }
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="計測に使う写真（jpg/png）のフォルダ")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--warmup", type=int, default=2)
+    args = parser.parse_args()
+
+    from YOLO_model.backends import weights_path
+
+    image_paths = sorted(
+        p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(args.images, f"*.{ext}"))
+    )
+    if not image_paths:
+        print(f"画像が見つかりません: {args.images}")
+        return 1
+
+    ctx = multiprocessing.get_context("spawn")
+    reports = []
+    for backend in args.backends:
+        if not os.path.exists(os.path.join(ROOT, weights_path(backend))):
+            print(f"{backend}: 重みファイルがないため飛ばします")
+            continue
+        with ctx.Pool(1) as pool:
+            report = pool.apply(run_backend, (backend, image_paths, args.warmup))
+        reports.append(report)
+        lat = report["latencies"]
+        print(
+            f"{backend:10s} load {report['load_time']:.2f}s  "
+            f"p50 {percentile(lat, 50) * 1000:.1f}ms  p95 {percentile(lat, 95) * 1000:.1f}ms  "
+            f"RSS +{report['rss_delta'] / 2**20:.0f}MiB"
+        )
+
+    if len(reports) < 2:
+        return 0
+    reference = reports[0]
+    failed = False
+    for report in reports[1:]:
+        mismatched = [
+            (path, ref, got)
+            for path, ref, got in zip(image_paths, reference["classes"], report["classes"])
+            if collections.Counter(ref) != collections.Counter(got)
+        ]
+        if mismatched:
+            failed = True
+            print(f"FAILED: {report['backend']} と {reference['backend']} で {len(mismatched)} 枚の認識結果が異なります")
+            for path, ref, got in mismatched[:5]:
+                print(f"  {os.path.basename(path)}: {ref} != {got}")
+        else:
+            print(f"OK: {report['backend']} の認識結果は {reference['backend']} と一致しました")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
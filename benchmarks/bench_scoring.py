@@ -0,0 +1,92 @@
+"""精算エンジン (scoring.settle_month) のスループット計測
+
+使い方: python benchmarks/bench_scoring.py [--months 200000] [--min-rate 100000]
+1コアで1秒あたりに精算できる月数を表示し、--min-rate を下回ったら終了コード1を返す。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rules import DEFAULT_HACHIHACHI_RULES, DEFAULT_KOIKOI_RULES
+from scoring import (
+    MODE_MANUAL, OUTCOME_CARDS, OUTCOME_DEKIYAKU, OUTCOME_SPECIAL,
+    MonthInput, PlayerInput, ScoringRules, settle_month,
+)
+
+
+def make_months(count, seed=0):
+    """八八・こいこいの典型的な月の入力をランダムに作る"""
+    rng = random.Random(seed)
+    hachi = ScoringRules.from_game_rules(DEFAULT_HACHIHACHI_RULES)
+    koikoi = ScoringRules.from_game_rules(DEFAULT_KOIKOI_RULES)
+    teyaku_names = list(DEFAULT_HACHIHACHI_RULES['teyaku'])
+    months = []
+    for _ in range(count):
+        if rng.random() < 0.8:
+            players = ("A", "B", "C", "D", "E")
+            active = ("A", "B", "C")
+            outcome = rng.choice((OUTCOME_CARDS, OUTCOME_CARDS, OUTCOME_DEKIYAKU, OUTCOME_SPECIAL))
+            inputs = {
+                p: PlayerInput(
+                    mode=MODE_MANUAL if rng.random() < 0.2 else "取り札入力",
+                    manual_score=rng.randint(0, 150),
+                    brights=rng.randint(0, 2), animals=rng.randint(0, 4),
+                    ribbons=rng.randint(0, 4), chaff=rng.randint(0, 10),
+                    teyaku=tuple(rng.sample(teyaku_names, 1)) if rng.random() < 0.2 else (),
+                    orichin=rng.randint(0, 12), oikomichin=rng.randint(0, 12),
+                )
+                for p in players
+            }
+            selection = {
+                OUTCOME_DEKIYAKU: ("四光",), OUTCOME_SPECIAL: ("素十六",)
+            }.get(outcome, ())
+            month = MonthInput(
+                players=players, active_players=active, inputs=inputs, outcome_type=outcome,
+                yaku_winner=rng.choice(active), yaku_selection=selection,
+                yaku_extras={"素十六": rng.randint(0, 3)},
+                hatto_players=("B",) if rng.random() < 0.3 else (),
+                mizuten_player=rng.choice(("なし", "A")),
+                ba_status=rng.choice(("小場 (x1)", "大場 (x2)", "絶場 (x4)")),
+            )
+            months.append((month, hachi))
+        else:
+            players = ("A", "B")
+            month = MonthInput(
+                players=players, active_players=players, outcome_type=OUTCOME_DEKIYAKU,
+                yaku_winner=rng.choice(players), yaku_selection=("赤短", "タネ"),
+                yaku_extras={"タネ": rng.randint(0, 4)},
+            )
+            months.append((month, koikoi))
+    return months
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--months", type=int, default=200_000)
+    parser.add_argument("--min-rate", type=float, default=100_000)
+    args = parser.parse_args()
+
+    months = make_months(min(args.months, 10_000))
+    repeat = max(1, args.months // len(months))
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for month, rules in months:
+            settle_month(month, rules)
+    elapsed = time.perf_counter() - start
+
+    settled = repeat * len(months)
+    rate = settled / elapsed
+    print(f"settle_month: {settled} months in {elapsed:.3f}s -> {rate:,.0f} months/s")
+    if rate < args.min_rate:
+        print(f"FAILED: {rate:,.0f} months/s < {args.min_rate:,.0f}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""同時に推論したときのレイテンシ（p50/p95/p99）を、CPUスレッドの割り振り方ごとに比べる
+
+使い方: python benchmarks/bench_thread_budget.py --images 写真のフォルダ [--clients 1 4 8] [--slots 2 4]
+  default   : スケジューラーなし（ワーカー1つ、torch の既定のスレッド数）
+  fat       : InferenceScheduler でスロット1つ（全コア）に制限する
+  slots=N   : InferenceScheduler で FAT / THIN（N スロット）を負荷に応じて切り替える
+各設定は別プロセスで実行し、待ち時間（キュー・スロット）と計算時間を分けて表示する。
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+def run_setting(setting, slots, image_paths, clients, rounds, cores):
+    """1つの設定で clients 個のスレッドから同時に推論し、レイテンシと内訳を返す（子プロセスで実行）"""
+    os.chdir(ROOT)
+    from YOLO_model.backends import configured_backend, load_detector
+    from YOLO_model.inference_queue import InferenceService
+    from YOLO_model.preprocess import DEFAULT_PROFILE, load_image_for_inference
+    from YOLO_model.thread_budget import InferenceScheduler, ThreadBudget
+
+    model = load_detector(configured_backend())
+    images = [load_image_for_inference(path, DEFAULT_PROFILE.imgsz) for path in image_paths]
+    kwargs = DEFAULT_PROFILE.predict_kwargs()
+    model(images[0], **kwargs)
+
+    scheduler = None
+    if setting != "default":
+        scheduler = InferenceScheduler(ThreadBudget(cores=cores, slots=1 if setting == "fat" else slots))
+        scheduler.configure()
+    # バッチにまとめずに、スロットの効果だけを比べる
+    service = InferenceService(model, max_batch_size=1, max_wait=0.0, scheduler=scheduler)
+
+    latencies = []
+    lock = threading.Lock()
+
+    def client(offset):
+        for i in range(rounds):
+            start = time.perf_counter()
+            service(images[(offset + i) % len(images)], **kwargs)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stats = service.stats()
+    service.close()
+    return {"latencies": latencies, "throughput": len(latencies) / elapsed, "stats": stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="計測に使う写真（jpg/png）のフォルダ")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 8], help="同時に推論するセッションの数")
+    parser.add_argument("--slots", type=int, nargs="+", default=[2, 4], help="THIN のときのスロットの数")
+    parser.add_argument("--rounds", type=int, default=5, help="セッションごとの推論回数")
+    parser.add_argument("--cores", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    from YOLO_model.backends import configured_backend, weights_path
+
+    if not os.path.exists(os.path.join(ROOT, weights_path(configured_backend()))):
+        print(f"{configured_backend()}: 重みファイルがないため計測できません")
+        return 1
+    image_paths = sorted(
+        p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(args.images, f"*.{ext}"))
+    )
+    if not image_paths:
+        print(f"画像が見つかりません: {args.images}")
+        return 1
+
+    ctx = multiprocessing.get_context("spawn")
+    settings = [("default", None), ("fat", 1)] + [(f"slots={n}", n) for n in args.slots]
+    for clients in args.clients:
+        print(f"--- 同時 {clients} セッション ---")
+        for setting, slots in settings:
+            with ctx.Pool(1) as pool:
+                report = pool.apply(run_setting, (setting, slots, image_paths, clients, args.rounds, args.cores))
+            lat = report["latencies"]
+            line = (
+                f"{setting:10s} p50 {percentile(lat, 50) * 1000:7.1f}ms  p95 {percentile(lat, 95) * 1000:7.1f}ms  "
+                f"p99 {percentile(lat, 99) * 1000:7.1f}ms  {report['throughput']:.2f}枚/s"
+            )
+            stats = report["stats"]
+            line += (
+                f"  (キュー待ち {stats['avg_queue_wait'] * 1000:.1f}ms / スロット待ち {stats['avg_slot_wait'] * 1000:.1f}ms"
+                f" / 計算 {stats['avg_inference'] * 1000:.1f}ms, 切り替え {stats.get('scheduler', {}).get('switches', 0)}回)"
+            )
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
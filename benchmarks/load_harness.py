@@ -0,0 +1,348 @@
+"""同時にゲームを進めるセッションの数を増やしたときの、再実行のレイテンシ・スループット・メモリの計測
+
+使い方:
+    python benchmarks/load_harness.py --sessions 1 2 4 8 [--players 4] [--months 12] [--output load.json]
+
+各セッションは Streamlit の AppTest で次のゲームを最後まで進める。
+  setting.py : プリセット（八八）を読み込み、人数と名前を入力してゲームを開始する
+  points.py  : 12か月分。月ごとにプレイヤーの入力モードを 取り札入力 / 得点入力 / 写真で自動入力 で回し、
+               4か月に1回は出来役の月にする。写真は合成したJPEGを使う
+  result.py  : 最終結果を表示する
+同時セッション数ごとに別プロセスで実行し、操作（再実行）1回ごとのレイテンシの p50/p95/p99、
+1秒あたりの再実行数・月数、RSS の増加（全体とセッションあたり）を表示する。
+
+AppTest.run は実行のたびにプロセス全体の Runtime を差し替えて最後に消すので、そのままでは同時に動かせない。
+ここでは ConcurrentAppTest がモックの Runtime をプロセス全体で1つだけ用意して共有する。
+スクリプトのコンパイル結果（ScriptCache）も、実際のサーバーと同じく全セッションで共有する
+（セッションごとに別々のスレッドで ast.parse すると Python 3.11 では失敗することがある）。
+また AppTest ではページの移動（st.switch_page）・ファイルのアップロード・フラグメントだけの再実行ができないので、
+ページごとに AppTest を作って session_state を引き継ぎ、写真のアップロード欄は合成画像を返す関数に差し替え、
+操作のたびにページ全体を再実行する（実際のサーバーより重い側の見積もりになる）。
+--detector synthetic（既定）では、推論の代わりに --infer-ms ミリ秒待って決まった札を返す検出器を使う。
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib import parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ("取り札入力", "得点入力", "写真で自動入力")
+# 合成の検出器が返す札（1枚の写真につき8枚）
+SYNTHETIC_CARDS = ["1-hkr", "1-tan", "1-kas", "1-kas", "2-tne", "2-tan", "3-hkr", "3-kas"]
+
+
+class _Boxes:
+    def __init__(self, cls, conf):
+        self.cls = cls
+        self.conf = conf
+
+
+class _Result:
+    def __init__(self, cls, conf, infer_ms):
+        self.boxes = _Boxes(cls, conf)
+        self.speed = {"preprocess": 0.0, "inference": infer_ms, "postprocess": 0.0}
+
+
+class SyntheticDetector:
+    """ultralytics の YOLO と同じ呼び出し方で、infer_ms ミリ秒待ってから決まった札を返す検出器"""
+
+    def __init__(self, infer_ms):
+        import numpy as np
+
+        self.infer_ms = infer_ms
+        self.names = dict(enumerate(sorted(set(SYNTHETIC_CARDS))))
+        index = {name: i for i, name in self.names.items()}
+        self._cls = np.array([index[name] for name in SYNTHETIC_CARDS], dtype=np.float32)
+        self._conf = np.linspace(0.95, 0.6, len(SYNTHETIC_CARDS), dtype=np.float32)
+
+    def __call__(self, source, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        time.sleep(self.infer_ms / 1000 * len(images))
+        return [_Result(self._cls, self._conf, self.infer_ms) for _ in images]
+
+
+class _Uploads:
+    """写真のアップロード欄の代わり。ウィジェットのキーごとに、返すファイルを登録しておく"""
+
+    def __init__(self):
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def set(self, key, files):
+        with self._lock:
+            self.files[key] = files
+
+    def file_uploader(self, label, key=None, accept_multiple_files=False, **kwargs):
+        with self._lock:
+            files = [io.BytesIO(data) for data in self.files.get(key, [])]
+        return files if accept_multiple_files else (files[0] if files else None)
+
+    def camera_input(self, label, key=None, **kwargs):
+        return None
+
+
+_script_cache = None
+
+
+def install_shared_runtime():
+    """全セッションで共有するモックの Runtime と、AppTest 用の設定をプロセス全体に1回だけ入れる"""
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    global _script_cache
+    _script_cache = ScriptCache()
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    config.set_option("global.appTest", True)
+
+
+def concurrent_app_test(path, default_timeout):
+    """同時に動かせる AppTest を作る（先に install_shared_runtime() を呼んでおくこと）"""
+    from streamlit.runtime.pages_manager import PagesManager
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    class ConcurrentAppTest(AppTest):
+        """Runtime と設定の差し替えをせず、ScriptCache を共有する AppTest（それ以外は AppTest._run と同じ）"""
+
+        def _run(self, widget_state=None, timeout=None):
+            script_runner = LocalScriptRunner(
+                self._script_path, self.session_state,
+                PagesManager(self._script_path, _script_cache, setup_watcher=False),
+                args=self.args, kwargs=self.kwargs,
+            )
+            script_runner._script_cache = _script_cache
+            self._tree = script_runner.run(
+                widget_state, self.query_params, timeout or self.default_timeout, self._page_hash
+            )
+            self._tree._runner = self
+            self.query_params = parse.parse_qs(script_runner.event_data[-1]["client_state"].query_string)
+            return self
+
+    return ConcurrentAppTest(path, default_timeout=default_timeout)
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+class Session:
+    """1つのセッション（1卓）で、ゲームを最初から最後まで進める"""
+
+    def __init__(self, number, players, months, uploads, images):
+        self.number = number
+        self.players = [f"S{number}-P{i}" for i in range(players)]
+        self.months = months
+        self.uploads = uploads
+        self.images = images
+        self.samples = []  # (ページ:操作, 秒)
+        self.state = {}
+
+    def _run(self, at, action):
+        start = time.perf_counter()
+        at.run()
+        self.samples.append((action, time.perf_counter() - start))
+        # ページの移動（st.switch_page）は AppTest では例外になるので無視する
+        errors = [e for e in at.exception if "Could not find page" not in e.message]
+        if errors:
+            raise RuntimeError(f"{action}: {errors[0].message}")
+
+    def _page(self, page):
+        at = concurrent_app_test(os.path.join(ROOT, *page.split("/")), default_timeout=120)
+        for key, value in self.state.items():
+            at.session_state[key] = value
+        return at
+
+    def _keep(self, at, keys):
+        self.state.update({key: at.session_state[key] for key in keys if key in at.session_state})
+
+    def setting(self):
+        at = self._page("pages/setting.py")
+        self._run(at, "setting:open")
+        at.radio[0].set_value("八八")
+        next(b for b in at.button if b.label == "プリセットを読み込む").click()
+        self._run(at, "setting:preset")
+        next(n for n in at.number_input if n.label == "プレイヤーの人数").set_value(len(self.players))
+        self._run(at, "setting:players")
+        for i, name in enumerate(self.players):
+            at.text_input(key=f"p{i}").set_value(name)
+            self._run(at, "setting:name")
+        next(b for b in at.button if b.label == "この内容でゲームを開始する").click()
+        self._run(at, "setting:start")
+        self._keep(at, ["game_rules", "players", "scores", "current_month", "input_modes", "game_id"])
+
+    def points(self):
+        at = self._page("pages/points.py")
+        self._run(at, "points:open")
+        for month in range(1, self.months + 1):
+            if month % 4 == 0:
+                self._dekiyaku_month(at)
+            else:
+                self._card_month(at, month)
+            next(b for b in at.button if b.label.endswith("得点を記録する")).click()
+            self._run(at, "points:record")
+        self._keep(at, ["scores", "players", "game_rules", "current_month"])
+
+    def _card_month(self, at, month):
+        at.radio(key="outcome_type").set_value("役なし（取り札勝負）")
+        self._run(at, "points:outcome")
+        for i, player in enumerate(self.players):
+            mode = MODES[(month + i) % len(MODES)]
+            at.selectbox(key=f"mode_select_{player}").set_value(mode)
+            self._run(at, "points:mode")
+            if mode == "取り札入力":
+                at.number_input(key=f"brights_{player}").set_value(1)
+                at.number_input(key=f"chaff_{player}").set_value(5 + i)
+                self._run(at, "points:cards")
+            elif mode == "得点入力":
+                at.number_input(key=f"manual_score_{player}").set_value(20 + 10 * i)
+                self._run(at, "points:manual")
+            else:
+                run_id = at.session_state["run_id"]
+                self.uploads.set(f"uploader_{player}_{run_id}", [self.images[(month + i) % len(self.images)]])
+                self._run(at, "points:photo")
+
+    def _dekiyaku_month(self, at):
+        at.radio(key="outcome_type").set_value("出来役あり")
+        self._run(at, "points:outcome")
+        at.selectbox(key="dekiyaku_winner").set_value(self.players[0])
+        at.multiselect(key="dekiyaku_selection").set_value(["赤短"])
+        self._run(at, "points:dekiyaku")
+
+    def result(self):
+        at = self._page("pages/result.py")
+        self._run(at, "result:open")
+
+    def play(self):
+        self.setting()
+        self.points()
+        self.result()
+        return self.samples
+
+
+def run_level(sessions, players, months, detector, infer_ms):
+    """同時 sessions セッションで最後までゲームを進め、計測結果を返す（子プロセスで実行）"""
+    os.chdir(ROOT)
+    workdir = tempfile.mkdtemp(prefix="hanafuda-load-")
+    os.environ["HANAFUDA_DB_PATH"] = os.path.join(workdir, "load.sqlite3")
+    os.environ.setdefault("HANAFUDA_TRACE_FILE", "")
+    os.environ.setdefault("HANAFUDA_PROFILE_FILE", "")
+
+    import streamlit as st
+    from streamlit.logger import set_log_level
+
+    from run_benchmarks import synthetic_jpeg
+    from tracing import _rss_bytes
+    from YOLO_model.thread_budget import get_inference_scheduler
+    from YOLO_model.warmup import FAILED, READY, get_model_warmer
+
+    install_shared_runtime()
+    # st.switch_page の例外などを毎回ログに出さない
+    set_log_level("critical")
+    uploads = _Uploads()
+    st.file_uploader = uploads.file_uploader
+    st.camera_input = uploads.camera_input
+
+    warmer = get_model_warmer()
+    if detector == "synthetic":
+        # 本物と同じく、推論スロットごとに別の検出器を持たせる
+        warmer.replicas = [SyntheticDetector(infer_ms) for _ in range(get_inference_scheduler().max_slots)]
+        warmer.model, warmer.state = warmer.replicas[0], READY
+    else:
+        warmer.start()
+        while warmer.state not in (READY, FAILED):
+            time.sleep(0.1)
+        if warmer.state == FAILED:
+            raise RuntimeError(f"モデルを読み込めません: {warmer.error}")
+    images = [synthetic_jpeg((1920, 1080), seed) for seed in range(8)]
+
+    # 1セッション分を先に流して、import やキャッシュの初期化をメモリの計測から外す
+    Session(0, players, 1, uploads, images).play()
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        futures = [pool.submit(Session(n, players, months, uploads, images).play) for n in range(1, sessions + 1)]
+        results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - start
+    rss_after = _rss_bytes()
+
+    samples = [s for session in results for s in session]
+    by_action = {}
+    for action, seconds in samples:
+        by_action.setdefault(action, []).append(seconds)
+    latencies = [seconds for _, seconds in samples]
+    return {
+        "sessions": sessions,
+        "reruns": len(samples),
+        "elapsed": elapsed,
+        "reruns_per_sec": len(samples) / elapsed,
+        "months_per_sec": sessions * months / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "actions": {
+            action: {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95)}
+            for action, values in sorted(by_action.items())
+        },
+        "rss_before": rss_before,
+        "rss_after": rss_after,
+        "rss_per_session": (rss_after - rss_before) / sessions if rss_before and rss_after else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8], help="同時に進めるセッションの数")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--detector", choices=["synthetic", "model"], default="synthetic",
+                        help="synthetic: 推論の代わりに待つだけの検出器 / model: 実際のモデル（重みファイルが必要）")
+    parser.add_argument("--infer-ms", type=float, default=80.0, help="合成の検出器が1枚あたりに待つ時間")
+    parser.add_argument("--actions", action="store_true", help="操作ごとのレイテンシも表示する")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    reports = []
+    print(f"{'sessions':>8} {'reruns':>7} {'rerun/s':>8} {'month/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MiB':>8} {'MiB/sess':>9}")
+    for sessions in args.sessions:
+        with ctx.Pool(1) as pool:
+            report = pool.apply(run_level, (sessions, args.players, args.months, args.detector, args.infer_ms))
+        reports.append(report)
+        per_session = report["rss_per_session"]
+        print(
+            f"{sessions:>8} {report['reruns']:>7} {report['reruns_per_sec']:>8.1f} {report['months_per_sec']:>8.2f} "
+            f"{report['p50'] * 1000:>8.1f} {report['p95'] * 1000:>8.1f} {report['p99'] * 1000:>8.1f} "
+            f"{(report['rss_after'] or 0) / 2**20:>8.0f} {per_session / 2**20 if per_session is not None else float('nan'):>9.2f}"
+        )
+        if args.actions:
+            for action, s in report["actions"].items():
+                print(f"    {action:18s} {s['count']:>5}回  p50 {s['p50'] * 1000:7.1f}ms  p95 {s['p95'] * 1000:7.1f}ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "levels": reports}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,403 @@
+"""得点計算・得点表・写真認識のホットパスのベンチマーク一式
+
+使い方:
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json --threshold 0.25
+
+各ベンチマークの1回あたりの所要時間（中央値・p95・最小）を JSON に書き出す。
+--baseline を指定すると、中央値が基準より threshold（割合）以上遅くなったものを
+表示して終了コード1を返す。--only で名前の一部を指定して絞り込める。
+"""
+import argparse
+import contextlib
+import functools
+import inspect
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARKS = {}
+
+
+class Skip(Exception):
+    """実行環境の都合（モデルがないなど）で計測できないベンチマーク"""
+
+
+def benchmark(name, number=1, repeat=20):
+    """setup 関数を登録するデコレーター。setup は計測対象の引数なし関数を返す"""
+    def register(setup):
+        BENCHMARKS[name] = (setup, number, repeat)
+        return setup
+    return register
+
+
+# --- 得点計算 ---
+@benchmark("scoring.settle_month", number=10_000, repeat=10)
+def bench_settle_month():
+    from bench_scoring import make_months
+    from scoring import settle_month
+
+    months = make_months(10_000)
+    it = iter(())
+
+    def run():
+        nonlocal it
+        try:
+            month, rules = next(it)
+        except StopIteration:
+            it = iter(months)
+            month, rules = next(it)
+        settle_month(month, rules)
+    return run
+
+
+def _points_app_test(players):
+    from streamlit.testing.v1 import AppTest
+
+    from ledger import ScoreLedger
+    from rule_sets import PRESETS, RuleOverlay
+
+    at = AppTest.from_file(os.path.join(ROOT, "pages", "points.py"), default_timeout=60)
+    at.session_state.players = list(players)
+    at.session_state.scores = ScoreLedger({p: 60 for p in players})
+    at.session_state.current_month = 1
+    at.session_state.input_modes = {}
+    at.session_state.game_rules = RuleOverlay(PRESETS["八八"])
+    at.session_state.game_id = None
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return at
+
+
+@benchmark("callback.record_scores_apptest", repeat=20)
+def bench_record_scores_callback():
+    """記録ボタンを押してから、コールバックとページ全体の再実行が終わるまで"""
+    at = _points_app_test(["A", "B", "C", "D"])
+
+    def run():
+        # 12月を過ぎるとリザルトに移動してしまうので、毎回1月に戻す
+        at.session_state.current_month = 1
+        at.number_input(key="brights_A").set_value(2)
+        at.number_input(key="chaff_B").set_value(10)
+        button = next(b for b in at.button if b.label.endswith("得点を記録する"))
+        button.click().run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+    return run
+
+
+@benchmark("points.full_rerun[7 players]", repeat=20)
+def bench_points_full_rerun():
+    """7人の卓で points.py 全体を再実行する時間（フラグメント外の操作をしたとき）"""
+    at = _points_app_test([f"P{i}" for i in range(7)])
+
+    def run():
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+    return run
+
+
+class _FragmentRerunner:
+    """points.py を、サーバーと同じ条件でページ全体またはフラグメントだけ再実行する
+
+    AppTest は再実行のたびにスクリプトのコンパイル結果と登録されたフラグメントを捨て、
+    フラグメントだけの再実行もできない。サーバーではどちらも残るので、AppTest の内部を差し替えて
+    両方を共有し、RerunData でフラグメントを指定して再実行する。
+    """
+
+    def __init__(self, players):
+        from streamlit.runtime.fragment import MemoryFragmentStorage
+        from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+        self.script_cache = ScriptCache()
+        self.fragments = MemoryFragmentStorage()
+        with self._patched():
+            self.at = _points_app_test(players)
+        # ブラウザは再実行のたびにすべてのウィジェットの値を送ってくる
+        self.widget_state = self.at._tree.get_widget_states()
+
+    def fragment_id(self, name):
+        """関数名が name のフラグメントのうち、最初に描かれたものの ID"""
+        for fragment_id, wrapped in self.fragments._fragments.items():
+            if inspect.getclosurevars(wrapped).nonlocals["non_optional_func"].__name__ == name:
+                return fragment_id
+        raise RuntimeError(f"フラグメントが見つかりません: {name}")
+
+    @contextlib.contextmanager
+    def _patched(self, fragment_id=None):
+        from streamlit.testing.v1 import app_test, local_script_runner
+
+        patches = {
+            (app_test, "ScriptCache"): lambda: self.script_cache,
+            (local_script_runner, "ScriptCache"): lambda: self.script_cache,
+            (local_script_runner, "MemoryFragmentStorage"): lambda: self.fragments,
+        }
+        if fragment_id is not None:
+            patches[(local_script_runner, "RerunData")] = functools.partial(
+                local_script_runner.RerunData, fragment_id_queue=[fragment_id], is_fragment_scoped_rerun=True,
+            )
+        originals = {key: getattr(*key) for key in patches}
+        for (module, name), value in patches.items():
+            setattr(module, name, value)
+        try:
+            yield
+        finally:
+            for (module, name), value in originals.items():
+                setattr(module, name, value)
+
+    def run(self, fragment_id=None):
+        with self._patched(fragment_id):
+            self.at._run(self.widget_state)
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].message)
+
+
+@benchmark("points.widget_rerun[7 players, full page]", repeat=20)
+def bench_points_widget_rerun_full():
+    """取り札の枚数を変えたときの再実行（フラグメントに分ける前はページ全体を再実行していた）"""
+    rerunner = _FragmentRerunner([f"P{i}" for i in range(7)])
+    return rerunner.run
+
+
+@benchmark("points.widget_rerun[7 players, fragment]", repeat=20)
+def bench_points_widget_rerun_fragment():
+    """取り札の枚数を変えたときの再実行（そのプレイヤーの入力欄のフラグメントだけ）"""
+    rerunner = _FragmentRerunner([f"P{i}" for i in range(7)])
+    return functools.partial(rerunner.run, rerunner.fragment_id("player_input_panel"))
+
+
+@benchmark("functions.calculate_points_from_detections[48]", number=2_000, repeat=10)
+def bench_points_from_detections():
+    import functions
+    from rule_sets import PRESETS
+    from YOLO_model.detections import ClassTable, Detections
+
+    types = ["hkr"] * 5 + ["tne"] * 9 + ["tan"] * 10 + ["kas"] * 24
+    names = [f"{i // 4 + 1}-{t}" for i, t in enumerate(types)]
+    detections = Detections.from_names(names, [0.9] * len(names), ClassTable(names))
+
+    def run():
+        functions.calculate_points_from_detections(detections, PRESETS["八八"])
+    return run
+
+
+# --- 手役の判定 ---
+@benchmark("cards.teyaku_ids[1M hands]", repeat=10)
+def bench_teyaku_ids():
+    import numpy as np
+
+    from cards import CARD_BITS, DECK, teyaku_ids
+
+    rng = np.random.default_rng(0)
+    order = rng.permuted(np.tile(np.arange(len(DECK)), (1_000_000, 1)), axis=1)
+    hands = np.bitwise_or.reduce(CARD_BITS[order[:, :7]], axis=1)
+    fields = np.bitwise_or.reduce(CARD_BITS[order[:, 7:13]], axis=1)
+
+    def run():
+        teyaku_ids(hands, fields)
+    return run
+
+
+@benchmark("cards.hand_teyaku", number=10_000, repeat=10)
+def bench_hand_teyaku():
+    from cards import hand_teyaku, mask_of
+
+    hand, field = mask_of([0, 1, 2, 4, 5, 8, 12]), mask_of([3, 20, 30])
+
+    def run():
+        hand_teyaku(hand, field)
+    return run
+
+
+# --- リザルトページの集計 ---
+def _long_history(months=1_000, players=7):
+    import numpy as np
+
+    from ledger import ScoreLedger
+
+    rng = np.random.default_rng(0)
+    names = [f"P{i}" for i in range(players)]
+    ledger = ScoreLedger({p: 60 for p in names})
+    for m in range(months):
+        deltas = rng.integers(-100, 100, size=players)
+        ledger.append(f"{m + 1}月", dict(zip(names, deltas.tolist())))
+    return ledger
+
+
+@benchmark("result.cumsum_melt[1000x7]", repeat=30)
+def bench_result_line_chart():
+    ledger = _long_history()
+
+    def run():
+        scores_df = ledger.to_frame()
+        cumulative_scores_df = scores_df.astype(float).cumsum()
+        line_df = cumulative_scores_df.reset_index().rename(columns={'index': '月'})
+        line_df.melt(id_vars='月', var_name='Player', value_name='Cumulative Score')
+        ledger._frame = None  # 毎回 DataFrame を作り直すところから測る
+    return run
+
+
+@benchmark("result.csv_build[1000x7]", repeat=30)
+def bench_result_csv():
+    ledger = _long_history()
+
+    def run():
+        csv_table_df = ledger.to_frame().copy()
+        csv_table_df.index = ['初期値'] + [f'{i}月' for i in range(1, len(csv_table_df))]
+        csv_table_df.loc['合計点'] = ledger.totals()
+        csv_table_df.to_csv(index_label='プレイヤー').encode('utf-8-sig')
+        ledger._frame = None
+    return run
+
+
+# --- 写真認識 ---
+IMAGE_RESOLUTIONS = {"vga": (640, 480), "fhd": (1920, 1080), "12mp": (4000, 3000), "48mp": (8000, 6000)}
+
+
+def synthetic_jpeg(size, seed=0):
+    """固定シードのノイズ画像をJPEGにしたバイト列（EXIFの向き情報つき）"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    small = (rng.random((size[1] // 8, size[0] // 8, 3)) * 255).astype("uint8")
+    image = Image.fromarray(small).resize(size)
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=90, exif=exif)
+    return buf.getvalue()
+
+
+def _register_image_benchmarks():
+    for label, size in IMAGE_RESOLUTIONS.items():
+        def decode_setup(size=size):
+            from YOLO_model.preprocess import DEFAULT_PROFILE, load_image_for_inference
+
+            data = synthetic_jpeg(size)
+
+            def run():
+                load_image_for_inference(io.BytesIO(data), DEFAULT_PROFILE.imgsz)
+            return run
+
+        def full_setup(size=size):
+            from functions import calculate_score_from_image
+            from YOLO_model.backends import configured_backend, load_detector
+
+            os.chdir(ROOT)
+            try:
+                model = load_detector(configured_backend())
+            except Exception as e:
+                raise Skip(f"モデルを読み込めません: {e}")
+            data = synthetic_jpeg(size)
+
+            def run():
+                calculate_score_from_image(io.BytesIO(data), model)
+            return run
+
+        benchmark(f"image.decode[{label}]", repeat=10)(decode_setup)
+        benchmark(f"image.calculate_score_from_image[{label}]", repeat=10)(full_setup)
+
+
+_register_image_benchmarks()
+
+
+# --- 実行 ---
+def measure(setup, number, repeat):
+    run = setup()
+    run()  # ウォームアップ
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        samples.append((time.perf_counter() - start) / number)
+    samples.sort()
+    return {
+        "median": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))],
+        "min": samples[0],
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """中央値が基準より threshold 以上遅くなったベンチマークを [(名前, 基準, 今回)] で返す"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or "median" not in base or "median" not in result:
+            continue
+        if result["median"] > base["median"] * (1 + threshold):
+            regressions.append((name, base["median"], result["median"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--baseline", help="比較の基準にする以前の結果のJSONファイル")
+    parser.add_argument("--threshold", type=float, default=0.25, help="許容する遅くなり方の割合（0.25 = 25%%）")
+    parser.add_argument("--only", nargs="*", default=[], help="名前にこの文字列を含むベンチマークだけ実行")
+    args = parser.parse_args()
+
+    results = {}
+    for name, (setup, number, repeat) in BENCHMARKS.items():
+        if args.only and not any(part in name for part in args.only):
+            continue
+        try:
+            result = measure(setup, number, repeat)
+        except Skip as e:
+            results[name] = {"skipped": str(e)}
+            print(f"{name:55s} skipped ({e})")
+            continue
+        results[name] = result
+        print(f"{name:55s} median {result['median'] * 1e6:12.1f} µs   p95 {result['p95'] * 1e6:12.1f} µs")
+
+    report = {
+        "meta": {
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, base, now in regressions:
+            print(f"REGRESSION: {name} {base * 1e6:.1f} µs -> {now * 1e6:.1f} µs (+{(now / base - 1):.0%})")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,389 @@
+import collections
+from dataclasses import dataclass
+
+import numpy as np
+
+from rules import TYPE_ABBREVIATION_MAP
+from scoring import CARD_TYPES
+
+# 月ごとの4枚の札の種類（略称。モデルのクラス名 "1-hkr" などと同じ）
+_MONTH_CARDS = (
+    ("hkr", "tan", "kas", "kas"),  # 1月 松
+    ("tne", "tan", "kas", "kas"),  # 2月 梅
+    ("hkr", "tan", "kas", "kas"),  # 3月 桜
+    ("tne", "tan", "kas", "kas"),  # 4月 藤
+    ("tne", "tan", "kas", "kas"),  # 5月 菖蒲
+    ("tne", "tan", "kas", "kas"),  # 6月 牡丹
+    ("tne", "tan", "kas", "kas"),  # 7月 萩
+    ("hkr", "tne", "kas", "kas"),  # 8月 芒
+    ("tne", "tan", "kas", "kas"),  # 9月 菊
+    ("tne", "tan", "kas", "kas"),  # 10月 紅葉
+    ("hkr", "tne", "tan", "kas"),  # 11月 柳
+    ("hkr", "kas", "kas", "kas"),  # 12月 桐
+)
+
+
+@dataclass(frozen=True, slots=True)
+class Card:
+    """48枚のうちの1枚（index は札の集合のビットの位置）"""
+    index: int
+    month: int
+    abbr: str
+
+    @property
+    def name(self):
+        return f"{self.month}-{self.abbr}"
+
+    @property
+    def card_type(self):
+        return TYPE_ABBREVIATION_MAP[self.abbr]
+
+    @property
+    def label(self):
+        """画面に出す名前（"1月 光"。同じ月に同じ種類が複数あるときは "1月 カス2" のように番号をつける）"""
+        same = [c.index for c in DECK if c.month == self.month and c.abbr == self.abbr]
+        number = same.index(self.index) + 1 if len(same) > 1 else ""
+        return f"{self.month}月 {self.card_type}{number}"
+
+
+# 札の並びは月順・月の中は上の表の順（index = (月 - 1) * 4 + 月の中の番号）
+DECK = tuple(
+    Card(i * 4 + j, i + 1, abbr) for i, abbrs in enumerate(_MONTH_CARDS) for j, abbr in enumerate(abbrs)
+)
+FULL_MASK = (1 << len(DECK)) - 1
+
+
+def card(month, abbr):
+    """月と種類の略称から札を返す（同じ月に同じ種類が複数あるときは最初の1枚）"""
+    return next(c for c in DECK if c.month == month and c.abbr == abbr)
+
+
+def mask_of(cards):
+    """札（Card または index）の並びを札の集合（48ビットの整数）にする"""
+    mask = 0
+    for c in cards:
+        mask |= 1 << (c.index if isinstance(c, Card) else c)
+    return mask
+
+
+def cards_of(mask):
+    """札の集合に含まれる札を index の順に返す"""
+    return [c for c in DECK if mask >> c.index & 1]
+
+
+def mask_from_names(names):
+    """札の名前（モデルのクラス名 "1-kas" など）の並びを札の集合にする
+
+    同じ名前が複数あるときは、その月・種類のまだ入っていない札に順に割り当てる。
+    (札の集合, 割り当てられなかった名前のリスト) を返す。
+    """
+    mask = 0
+    unmatched = []
+    for name in names:
+        free = [c for c in DECK if c.name == name and not mask >> c.index & 1]
+        if free:
+            mask |= 1 << free[0].index
+        else:
+            unmatched.append(name)
+    return mask, unmatched
+
+
+# 月ごと・札の種類ごとの集合（MONTH_MASKS[0] が1月）
+MONTH_MASKS = tuple(mask_of(DECK[m * 4:m * 4 + 4]) for m in range(12))
+TYPE_MASKS = {t: mask_of(c for c in DECK if c.card_type == t) for t in CARD_TYPES}
+
+# 役に使う札
+RAIN_MAN = card(11, "hkr")
+SAKE_CUP = card(9, "tne")
+CURTAIN = card(3, "hkr")
+MOON = card(8, "hkr")
+AKATAN_MASK = mask_of(card(m, "tan") for m in (1, 2, 3))
+AOTAN_MASK = mask_of(card(m, "tan") for m in (6, 9, 10))
+INOSHIKACHO_MASK = mask_of(card(m, "tne") for m in (6, 7, 10))
+HANAMI_MASK = mask_of((CURTAIN, SAKE_CUP))
+TSUKIMI_MASK = mask_of((MOON, SAKE_CUP))
+
+# numpy で札の集合（uint64）をまとめて扱うための配列
+CARD_BITS = np.array([1 << c.index for c in DECK], dtype=np.uint64)
+CARD_MONTHS = np.array([c.month - 1 for c in DECK], dtype=np.int8)
+CARD_TYPE_INDEX = np.array([CARD_TYPES.index(c.card_type) for c in DECK], dtype=np.int8)
+MONTH_MASK_ARRAY = np.array(MONTH_MASKS, dtype=np.uint64)
+TYPE_MASK_ARRAY = np.array([TYPE_MASKS[t] for t in CARD_TYPES], dtype=np.uint64)
+_SHIFTS = np.arange(len(DECK), dtype=np.uint64)
+
+
+def popcount(masks):
+    """札の集合（uint64 の配列）ごとの枚数"""
+    return np.bitwise_count(np.asarray(masks, dtype=np.uint64)).astype(np.int64)
+
+
+def to_bits(masks):
+    """札の集合の配列 (...,) を札ごとの有無 (..., 48) の bool 配列にする"""
+    return (np.asarray(masks, dtype=np.uint64)[..., None] >> _SHIFTS & np.uint64(1)).astype(bool)
+
+
+def type_counts(masks):
+    """札の集合の配列 (...,) から 光・タネ・短冊・カスの枚数 (..., 4) を数える（CARD_TYPES の順）"""
+    return popcount(np.asarray(masks, dtype=np.uint64)[..., None] & TYPE_MASK_ARRAY)
+
+
+def month_counts(masks):
+    """札の集合の配列 (...,) から月ごとの枚数 (..., 12) を数える"""
+    return popcount(np.asarray(masks, dtype=np.uint64)[..., None] & MONTH_MASK_ARRAY)
+
+
+# --- 出来役 ---
+_LIGHTS = TYPE_MASKS["光"]
+_RAIN = 1 << RAIN_MAN.index
+
+
+@dataclass(frozen=True, slots=True)
+class DekiyakuSpec:
+    """出来役1つの条件: 取り札のうち mask の札の枚数が threshold（exact なら ちょうど threshold）で、
+    required の札をすべて持ち、excluded の札を持たないこと。追加の枚数は threshold を超えた枚数
+    """
+    mask: int
+    threshold: int
+    exact: bool = True
+    required: int = 0
+    excluded: int = 0
+
+    @property
+    def cards(self):
+        """成立するかどうかに関わる札の集合"""
+        return self.mask | self.required | self.excluded
+
+
+def _set_spec(mask):
+    return DekiyakuSpec(mask, mask.bit_count())
+
+
+# 光の役は五光・四光・雨四光・三光のどれか1つだけが成立する
+DEKIYAKU_SPECS = {
+    "五光": DekiyakuSpec(_LIGHTS, 5),
+    "四光": DekiyakuSpec(_LIGHTS, 4),
+    "雨四光": DekiyakuSpec(_LIGHTS, 4, required=_RAIN),
+    "三光": DekiyakuSpec(_LIGHTS, 3, excluded=_RAIN),
+    "猪鹿蝶": _set_spec(INOSHIKACHO_MASK),
+    "赤短": _set_spec(AKATAN_MASK),
+    "青短": _set_spec(AOTAN_MASK),
+    "花見で一杯": _set_spec(HANAMI_MASK),
+    "月見で一杯": _set_spec(TSUKIMI_MASK),
+    # 基準の枚数を超えた分を追加点として数える役
+    "七短": DekiyakuSpec(TYPE_MASKS["短冊"], 7, exact=False),
+    "タネ": DekiyakuSpec(TYPE_MASKS["タネ"], 5, exact=False),
+    "短冊": DekiyakuSpec(TYPE_MASKS["短冊"], 5, exact=False),
+    "カス": DekiyakuSpec(TYPE_MASKS["カス"], 10, exact=False),
+}
+# 雨四光もあるルールでは、四光に柳の光を含めない
+_RAIN_SPLIT_SHIKO = DekiyakuSpec(_LIGHTS, 4, excluded=_RAIN)
+
+
+def dekiyaku_specs(names):
+    """names のうち、札から判定できる出来役の {役の名前: DekiyakuSpec}"""
+    specs = {name: DEKIYAKU_SPECS[name] for name in names if name in DEKIYAKU_SPECS}
+    if "四光" in specs and "雨四光" in specs:
+        specs["四光"] = _RAIN_SPLIT_SHIKO
+    return specs
+
+
+def _bit_count(x):
+    return x.bit_count() if isinstance(x, int) else np.bitwise_count(x).astype(np.int64)
+
+
+def dekiyaku_extras(spec, taken):
+    """取り札の集合（整数または uint64 の配列）が spec を満たせば追加の枚数（0以上）、満たさなければ -1"""
+    if not isinstance(taken, int):
+        taken = np.asarray(taken, dtype=np.uint64)
+    count = _bit_count(taken & spec.mask)
+    ok = (count == spec.threshold) if spec.exact else (count >= spec.threshold)
+    if spec.required:
+        ok = ok & (taken & spec.required == spec.required)
+    if spec.excluded:
+        ok = ok & (taken & spec.excluded == 0)
+    if isinstance(taken, int):
+        return count - spec.threshold if ok else -1
+    return np.where(ok, count - spec.threshold, -1)
+
+
+def dekiyaku_of(taken, names):
+    """取り札の集合の配列 (...,) から、names の出来役の成立を調べる
+
+    {役の名前: 追加の枚数の配列} を返す（成立していない要素は -1、
+    七短・タネ・短冊・カスは基準を超えた枚数）。names のうち、札から判定できない役は含めない。
+    """
+    taken = np.asarray(taken, dtype=np.uint64)
+    return {name: dekiyaku_extras(spec, taken) for name, spec in dekiyaku_specs(names).items()}
+
+
+class CapturePile:
+    """写真から認識した1人分の取り札の集合と、そこから成立する出来役
+
+    札を1枚除いたときは、その札が関わる役だけを判定し直す（全体を数え直さない）。
+    yaku は {成立した役の名前: 追加の枚数}。source は最後に反映した認識結果で、
+    呼び出し側はこれが変わったときだけ作り直せばよい。
+    """
+
+    __slots__ = ("specs", "mask", "overflow", "yaku", "source")
+
+    def __init__(self, card_names, yaku_names, source=None):
+        self.specs = dekiyaku_specs(yaku_names)
+        self.mask, unmatched = mask_from_names(card_names)
+        # 山にある枚数より多く認識された札（除くときは先にこちらから減らす）
+        self.overflow = collections.Counter(unmatched)
+        self.yaku = {}
+        self.source = source
+        for name in self.specs:
+            self._update(name)
+
+    @property
+    def yaku_names(self):
+        return tuple(self.specs)
+
+    def _update(self, name):
+        extras = dekiyaku_extras(self.specs[name], self.mask)
+        if extras >= 0:
+            self.yaku[name] = extras
+        else:
+            self.yaku.pop(name, None)
+
+    def remove(self, card_name, source=None):
+        """札を1枚除き、その札が関わる役だけを判定し直す"""
+        self.source = source
+        if self.overflow[card_name] > 0:
+            self.overflow[card_name] -= 1
+            return
+        held = [c for c in DECK if c.name == card_name and self.mask >> c.index & 1]
+        if not held:
+            return
+        bit = 1 << held[-1].index
+        self.mask &= ~bit
+        for name, spec in self.specs.items():
+            if spec.cards & bit:
+                self._update(name)
+
+    def ordered_yaku(self):
+        """成立した役を、ルールの役の順に (役の名前, 追加の枚数) で返す"""
+        return [(name, self.yaku[name]) for name in self.specs if name in self.yaku]
+
+
+# --- 手役（配られた7枚と場札から判定する） ---
+# 札の番号は月順に4枚ずつなので、月 m の札は 4m〜4m+3 ビット目（1つのニブル）に並ぶ。
+# ニブルごとの枚数をビット演算だけで数え（SWAR）、枚数ごとの月の数から表を引くので、
+# 手役の判定は手札の中身によらず一定の回数の演算で済む。
+_NIBBLE_LOW = sum(1 << (4 * m) for m in range(12))  # 各ニブルの最下位ビット
+_PAIRS = _NIBBLE_LOW * 0b0101
+_QUADS = _NIBBLE_LOW * 0b0011
+
+# 月の組み合わせの手役（枚数が4・3・2の月の数 → 役の名前）。立三本・二立三本は三本・二三本から判定する
+MONTH_TEYAKU = {
+    (1, 0, 0): "手四",
+    (1, 0, 1): "一二四",
+    (1, 1, 0): "四三",
+    (0, 1, 0): "三本",
+    (0, 1, 1): "三本",
+    (0, 2, 0): "二三本",
+    (0, 1, 2): "はねけん",
+    (0, 0, 3): "喰付",
+}
+TACHI_TEYAKU = {"三本": (1, "立三本"), "二三本": (2, "二立三本")}
+TYPE_TEYAKU = ("光一", "短一", "十一", "空素", "赤")
+TEYAKU_NAMES = tuple(dict.fromkeys(list(MONTH_TEYAKU.values()) + ["立三本", "二立三本"] + list(TYPE_TEYAKU)))
+
+
+def _month_shape(hand):
+    """手札の (枚数が4の月の数, 3の月の数, 2の月の数, 3枚の月の最下位ビットの集合) を返す"""
+    x = hand - ((hand >> 1) & _PAIRS)
+    x = (x & _QUADS) + ((x >> 2) & _QUADS)  # 各ニブルにその月の枚数（0〜4）が入る
+    bit0 = x & _NIBBLE_LOW
+    bit1 = (x >> 1) & _NIBBLE_LOW
+    bit2 = (x >> 2) & _NIBBLE_LOW
+    threes = bit0 & bit1
+    return _bit_count(bit2), _bit_count(threes), _bit_count(bit1 & ~bit0), threes
+
+
+def _type_teyaku(counts):
+    """光・タネ・短冊・カスの枚数から、札の種類の組み合わせの手役の名前（なければ None）"""
+    hikari, tane, tanzaku, kasu = counts
+    if kasu == 7:
+        return "空素"
+    if kasu == 6:
+        return {(1, 0, 0): "光一", (0, 1, 0): "十一", (0, 0, 1): "短一"}[(hikari, tane, tanzaku)]
+    if hikari == 0 and kasu == 0:
+        return "赤"
+    return None
+
+
+def _build_tables():
+    """枚数の組み合わせ → 手役の番号の表（0 は役なし、番号は TEYAKU_NAMES の位置 + 1）"""
+    ids = {name: i + 1 for i, name in enumerate(TEYAKU_NAMES)}
+    # 月: (4の月, 3の月, 2の月, 立三本の月) を 5進数にした番号で引く
+    month = np.zeros(5 ** 4, dtype=np.int8)
+    for (fours, threes, twos), name in MONTH_TEYAKU.items():
+        for tachi in range(threes + 1):
+            tachi_name = TACHI_TEYAKU.get(name)
+            if tachi_name and tachi == tachi_name[0]:
+                value = ids[tachi_name[1]]
+            else:
+                value = ids[name]
+            month[((fours * 5 + threes) * 5 + twos) * 5 + tachi] = value
+    # 札の種類: (光, タネ, 短冊, カス) を 8進数にした番号で引く
+    kinds = np.zeros(8 ** 4, dtype=np.int8)
+    for code in range(8 ** 4):
+        counts = (code >> 9 & 7, code >> 6 & 7, code >> 3 & 7, code & 7)
+        if sum(counts) == 7:
+            name = _type_teyaku(counts)
+            kinds[code] = ids[name] if name else 0
+    return month, kinds
+
+
+_MONTH_TABLE, _TYPE_TABLE = _build_tables()
+_TYPE_SHIFTS = tuple(zip(TYPE_MASKS.values(), (9, 6, 3, 0)))
+
+
+def teyaku_ids(hands, field=0):
+    """手札（7枚）の集合と場札の集合から、(月の組み合わせの手役の番号, 札の種類の組み合わせの手役の番号) を返す
+
+    番号は TEYAKU_NAMES の位置 + 1（0 は役なし）。hands・field は整数でも uint64 の配列でもよい。
+    7枚でない手札は役なしとする。
+    """
+    scalar = isinstance(hands, int)
+    if not scalar:
+        hands = np.asarray(hands, dtype=np.uint64)
+        field = np.asarray(field, dtype=np.uint64)
+    fours, threes, twos, three_months = _month_shape(hands)
+    # 三本の月の残りの1枚が場にあれば立三本（三本の月の最下位ビットを4ビットに広げて場札と重ねる）
+    tachi = _bit_count(field & ~hands & (three_months * 15))
+    type_code = 0
+    for mask, shift in _TYPE_SHIFTS:
+        type_code = type_code + (_bit_count(hands & mask) << shift)
+    seven = _bit_count(hands) == 7
+    month_code = ((fours * 5 + threes) * 5 + twos) * 5 + tachi
+    if scalar:
+        if not seven:
+            return 0, 0
+        return int(_MONTH_TABLE[month_code]), int(_TYPE_TABLE[type_code])
+    month_code = np.where(seven, month_code, 0)
+    return _MONTH_TABLE[month_code.astype(np.intp)], _TYPE_TABLE[np.where(seven, type_code, 0).astype(np.intp)]
+
+
+def teyaku_of(hands, field, names):
+    """手札（7枚）の集合の配列 (...,) と場札の集合から、names の手役の成立を {役の名前: bool 配列} で返す
+
+    月の組み合わせ（手四・一二四・四三・三本・立三本・二三本・二立三本・はねけん・喰付）と
+    札の種類の組み合わせ（光一・短一・十一・空素・赤）から1つずつまで成立する。
+    立三本・二立三本は、三本の月の残りの1枚が場札にあるもの。
+    """
+    month_ids, type_ids = teyaku_ids(np.asarray(hands, dtype=np.uint64), field)
+    result = {}
+    for name in names:
+        if name in TEYAKU_NAMES:
+            number = TEYAKU_NAMES.index(name) + 1
+            result[name] = (month_ids == number) | (type_ids == number)
+    return result
+
+
+def hand_teyaku(hand, field=0, names=TEYAKU_NAMES):
+    """1人分の手札（7枚）の集合から、names のうち成立する手役の名前を names の順に返す"""
+    found = {TEYAKU_NAMES[i - 1] for i in teyaku_ids(hand, field) if i}
+    return [name for name in names if name in found]
@@ -1,67 +1,220 @@
 import streamlit as st
-import pandas as pd
 import collections
-from PIL import Image
-from rules import TYPE_ABBREVIATION_MAP, ITSUMONO_HACHIHACHI_RULES, DEFAULT_HACHIHACHI_RULES, DEFAULT_KOIKOI_RULES
+import sqlite3
+import pandas as pd
+from game_store import GameStore
+from month_log import MonthLog
+from rule_sets import PRESETS, RuleOverlay, YakuEntry
+from simulator import simulate
+from cards import DECK, MONTH_MASKS, CapturePile, dekiyaku_specs, hand_teyaku, mask_from_names, mask_of
+from tracing import get_tracer
+from YOLO_model.preprocess import DEFAULT_PROFILE, load_image_for_inference
+from YOLO_model.backends import detections_from_results
+from YOLO_model.detections import Detections, class_table_for
+from scoring import (
+    MODE_CARDS, MODE_PHOTO, NO_PLAYER, OUTCOME_CARDS, OUTCOME_DEKIYAKU,
+    MonthInput, PlayerInput, card_points, settle_month, validate_month,
+)
+
+# 役の表の列（役の種類ごとに使う列だけを表示する）
+YAKU_TABLE_COLUMNS = {
+    "dekiyaku": ("役の名前", "点数", "有効", "法度適用", "追加点あり"),
+    "teyaku": ("役の名前", "点数", "有効"),
+    "special_yaku": ("役の名前", "点数", "有効", "追加点あり", "1つあたりの点数", "単位"),
+}
+ITEM_UNITS = ("枚", "点")
+
+def yaku_table_frame(rules, yaku_type_en):
+    """役の一覧を data_editor で編集する表（DataFrame）にする"""
+    rows = []
+    for name, entry in rules.yaku(yaku_type_en).items():
+        row = {
+            "役の名前": name,
+            "点数": entry.score,
+            "有効": entry.active,
+            "法度適用": bool(entry.hatto_applicable),
+            "追加点あり": bool(entry.is_variable),
+            "1つあたりの点数": entry.per_item_score,
+            "単位": entry.item_unit,
+        }
+        if rules.score_unit == "貫/点":
+            kan, ten = divmod(entry.score, 12)
+            row["換算"] = f"{kan}貫{ten}点"
+        rows.append(row)
+    columns = list(YAKU_TABLE_COLUMNS[yaku_type_en]) + (["換算"] if rules.score_unit == "貫/点" else [])
+    return pd.DataFrame(rows, columns=columns)
+
+def parse_yaku_table(table, yaku_type_en, rules):
+    """編集後の表を ((役の名前, YakuEntry), ...) にする。入力に誤りがあればエラーメッセージのリストを返す
+
+    元の役（行番号で対応させる）にない項目は、変更されていなければ None のまま残し、
+    表を開いて閉じただけのときに元のルールとまったく同じになるようにする。
+    """
+    originals = list(rules.yaku(yaku_type_en).values())
+    columns = YAKU_TABLE_COLUMNS[yaku_type_en]
+    entries, errors, seen = [], [], set()
+    for position, (index, row) in enumerate(table.iterrows(), start=1):
+        name = "" if pd.isna(row["役の名前"]) else str(row["役の名前"]).strip()
+        if not name:
+            errors.append(f"{position}行目: 役の名前を入力してください。")
+            continue
+        if name in seen:
+            errors.append(f"{position}行目: 「{name}」が重複しています。")
+            continue
+        seen.add(name)
+        if pd.isna(row["点数"]) or row["点数"] < 0:
+            errors.append(f"「{name}」: 点数は0以上で入力してください。")
+            continue
+        original = originals[index] if index in range(len(originals)) else None
+
+        def flag(column, field):
+            # 表にない列や、元の辞書になかった項目が False のままなら None のままにする
+            before = getattr(original, field) if original is not None else None
+            if column not in columns:
+                return before
+            value = bool(row[column]) if not pd.isna(row[column]) else False
+            return None if before is None and not value else value
+
+        def optional(column, field):
+            if column not in columns:
+                return getattr(original, field) if original is not None else None
+            return None if pd.isna(row[column]) else row[column]
+
+        is_variable = flag("追加点あり", "is_variable")
+        per_item_score = optional("1つあたりの点数", "per_item_score")
+        if per_item_score is not None:
+            if per_item_score < 0:
+                errors.append(f"「{name}」: 1つあたりの点数は0以上で入力してください。")
+                continue
+            per_item_score = int(per_item_score)
+        entries.append((name, YakuEntry(
+            score=int(row["点数"]),
+            active=flag("有効", "active") is not False,
+            is_variable=is_variable,
+            per_item_score=per_item_score,
+            item_unit=optional("単位", "item_unit"),
+            hatto_applicable=flag("法度適用", "hatto_applicable"),
+        )))
+    return tuple(entries), errors
 
 def create_yaku_editor(yaku_type_jp, yaku_type_en):
-    """出来役と手役の編集UIを生成する共通関数"""
-    c1, c2, c3, c4 = st.columns([1, 1, 1, 1])
-    c1.write("**役の名前**")
-    c2.write("**点数**")
-    c3.write("**有効/無効**")
-    c4.write("**法度適用**")
-    
-    for name, data in list(st.session_state.game_rules[yaku_type_en].items()):
-        c1, c2, c3, c4 = st.columns([1, 1, 1, 1])
-        with c1:
-            st.write(name)
-        with c2:
-            input_col, display_col = st.columns([1, 2])
-
-            with input_col:
-                st.number_input(
-                    "点数", 
-                    value=data['score'], 
-                    key=f'score_{yaku_type_en}_{name}', 
-                    on_change=update_yaku_score, 
-                    args=(yaku_type_en, name), 
-                    label_visibility="collapsed"
-                )        
-            # score_unitが「貫/点」の場合のみ、換算値を表示
-            score = data['score']
-            if st.session_state.game_rules.get("score_unit") == "貫/点" and score > 0:
-                kan, ten = divmod(score, 12)
-                with display_col:
-                    st.markdown(f"<div style='padding-top: 8px;'>({kan}貫{ten}点)</div>", unsafe_allow_html=True)
-        with c3:
-            st.toggle(
-                "有効", 
-                value=data['active'], 
-                key=f'toggle_{yaku_type_en}_{name}', 
-                on_change=toggle_yaku_active, 
-                args=(yaku_type_en, name), 
-                label_visibility="collapsed"
-            )
-        if yaku_type_en == 'dekiyaku':
-            with c4:
-                st.toggle(
-                    "法度", 
-                    value=data.get('hatto_applicable', False), 
-                    key=f'hatto_{yaku_type_en}_{name}', 
-                    on_change=toggle_yaku_hatto, 
-                    args=(yaku_type_en, name), 
-                    label_visibility="collapsed"
-                )
-
-    st.write("---")
-    c1, c2, c3 = st.columns([2, 1, 1])
-    with c1:
-        st.text_input("新しい役の名前", key=f'new_{yaku_type_en}_name')
-    with c2:
-        st.number_input("点数", min_value=0, key=f'new_{yaku_type_en}_score', label_visibility="collapsed")
-    with c3:
-        st.button("追加", key=f'add_{yaku_type_en}', on_click=add_yaku, args=(yaku_type_en,))
+    """出来役・手役・特殊な役を1つの表でまとめて編集するUIを生成する共通関数
+
+    表の編集（点数の変更・行の追加/削除など）は「反映」ボタンを押したときに、
+    入力をチェックしてから1回だけルールに書き込む。
+    """
+    rules = current_rules()
+    # 役の一覧が変わったとき（プリセットの読み込み・反映後）だけ表を作り直す
+    table_key = f"yaku_table_{yaku_type_en}_{hash(getattr(rules, yaku_type_en)) & 0xffffffff:08x}"
+    with st.form(f"yaku_form_{yaku_type_en}", border=False):
+        edited = st.data_editor(
+            yaku_table_frame(rules, yaku_type_en),
+            key=table_key,
+            num_rows="dynamic",
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "役の名前": st.column_config.TextColumn(required=True),
+                "点数": st.column_config.NumberColumn(min_value=0, step=1, required=True),
+                "有効": st.column_config.CheckboxColumn(default=True),
+                "法度適用": st.column_config.CheckboxColumn(default=False),
+                "追加点あり": st.column_config.CheckboxColumn(default=False),
+                "1つあたりの点数": st.column_config.NumberColumn(min_value=0, step=1),
+                "単位": st.column_config.SelectboxColumn(options=ITEM_UNITS),
+                "換算": st.column_config.TextColumn(disabled=True),
+            },
+        )
+        submitted = st.form_submit_button(f"{yaku_type_jp}の変更を反映")
+    if submitted:
+        entries, errors = parse_yaku_table(edited, yaku_type_en, rules)
+        if errors:
+            st.error("\n\n".join(errors))
+        else:
+            st.session_state.game_rules.set_yaku_table(yaku_type_en, entries)
+            st.success(f"{yaku_type_jp}を更新しました。")
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def simulate_rules(_rules, fingerprint, months, seed):
+    """ルールのシミュレーション結果（ルールの fingerprint・月数・シードが同じなら使い回す）"""
+    return simulate(_rules, months, seed)
+
+def show_simulation_summary(rules, months, seed):
+    """シミュレーションの集計（決まり方・席ごと・役ごとの期待値と分散）を表示する"""
+    with st.spinner(f"{months:,}か月分をシミュレーションしています..."):
+        summary = simulate_rules(rules, rules.fingerprint, months, seed)
+    st.caption(
+        f"{summary.game_name}・{summary.months:,}か月・シード {summary.seed}・打ち方 {' / '.join(summary.policies)}"
+        "（法度・下り賃・追い込み賃・みずてん・場の倍率は含みません）"
+    )
+    st.dataframe(pd.DataFrame(summary.outcome_rows()), hide_index=True)
+    st.dataframe(pd.DataFrame(summary.seat_rows()), hide_index=True, use_container_width=True)
+    st.dataframe(pd.DataFrame(summary.yaku_rows()), hide_index=True, use_container_width=True)
+
+def tachi_candidates(hand):
+    """手札の三本の月の残りの札（場にあれば立三本になる札）の番号"""
+    hand_mask = mask_of(hand)
+    return [
+        c.index for c in DECK
+        if not hand_mask >> c.index & 1 and (hand_mask & MONTH_MASKS[c.month - 1]).bit_count() == 3
+    ]
+
+def propose_teyaku(hand, field, game_rules):
+    """手札（札の番号7つ）と場札から、ルールで有効な手役のうち成立するものを返す"""
+    return hand_teyaku(mask_of(hand), mask_of(field), game_rules.active_teyaku)
+
+def hand_from_detections(detections):
+    """写真の認識結果（Detections）から手札の札の番号を返す（(番号のリスト, 割り当てられなかった札の名前)）"""
+    hand, unmatched = mask_from_names(detections.names())
+    return [c.index for c in DECK if hand >> c.index & 1], unmatched
+
+def sync_capture_pile(player, game_rules):
+    """写真の認識結果が変わったときだけ、その人の取り札の集合（CapturePile）を作り直して返す
+
+    認識結果の一覧から1枚削除したときは delete_detection_callback が集合から
+    その1枚だけを除くので、ここでは作り直さない。
+    """
+    pile_key = f'pile_{player}'
+    detections = st.session_state.get(f'detections_{player}')
+    pile = st.session_state.get(pile_key)
+    if detections is None:
+        pile = None
+    elif pile is None or pile.source is not detections or pile.yaku_names != tuple(dekiyaku_specs(game_rules.active_dekiyaku)):
+        pile = CapturePile(detections.names(), game_rules.active_dekiyaku, source=detections)
+    st.session_state[pile_key] = pile
+    return pile
+
+def format_pile_yaku(pile, game_rules):
+    """取り札から成立する出来役の表示（追加点のある役は「カス（+2枚）」のように）"""
+    labels = []
+    for name, extras in pile.ordered_yaku():
+        if name in game_rules.variable_yaku['dekiyaku']:
+            labels.append(f"{name}（+{extras}{game_rules.yaku('dekiyaku')[name].item_unit or '枚'}）")
+        else:
+            labels.append(name)
+    return "・".join(labels)
+
+def prefill_dekiyaku(winner, game_rules):
+    """勝者の取り札から判定した出来役を、出来役の選択欄と追加点の欄に入れる（出来役の選択欄を描く前に呼ぶ）
+
+    勝者か取り札の集合が変わったときだけ入れ直すので、入れたあとに手で直した選択はそのまま残る。
+    取り札の写真がなければ何もせず None を返す。
+    """
+    pile = st.session_state.get(f'pile_{winner}')
+    if pile is None:
+        return None
+    applied = (winner, pile.mask)
+    if st.session_state.get('dekiyaku_prefill') != applied:
+        yaku = pile.ordered_yaku()
+        st.session_state.dekiyaku_selection = [name for name, _ in yaku]
+        for name, extras in yaku:
+            if name in game_rules.variable_yaku['dekiyaku']:
+                st.session_state[f'dekiyaku_extra_{name}'] = extras
+        st.session_state.dekiyaku_prefill = applied
+    return pile
+
+def select_teyaku_callback(player, teyaku):
+    """提案された手役を手役の選択欄に入れるコールバック"""
+    st.session_state[f'teyaku_selection_{player}'] = list(teyaku)
 
 def generate_unique_names(names):
     counts = collections.Counter(names)
@@ -76,40 +229,13 @@ def generate_unique_names(names):
     return new_names
 
 def load_preset(game_type):
-    if game_type == '八八':
-        st.session_state.game_rules = DEFAULT_HACHIHACHI_RULES.copy()
-    elif game_type == 'こいこい':
-        st.session_state.game_rules = DEFAULT_KOIKOI_RULES.copy()
-    elif game_type == 'いつもの八八':
-        st.session_state.game_rules = ITSUMONO_HACHIHACHI_RULES.copy()
-
-def toggle_yaku_active(yaku_type, yaku_name):
-    """役の有効/無効を切り替えるコールバック"""
-    current_status = st.session_state.game_rules[yaku_type][yaku_name]['active']
-    st.session_state.game_rules[yaku_type][yaku_name]['active'] = not current_status
-
-def update_yaku_score(yaku_type, yaku_name):
-    """役の点数を更新するコールバック"""
-    key = f'score_{yaku_type}_{yaku_name}'
-    if key in st.session_state:
-        st.session_state.game_rules[yaku_type][yaku_name]['score'] = st.session_state[key]
-
-def add_yaku(yaku_type):
-    """新しい役を追加するコールバック"""
-    new_name = st.session_state[f'new_{yaku_type}_name']
-    new_score = st.session_state[f'new_{yaku_type}_score']
-    if new_name and new_name not in st.session_state.game_rules[yaku_type]:
-        st.session_state.game_rules[yaku_type][new_name] = {"score": new_score, "active": True}
-        st.session_state[f'new_{yaku_type}_name'] = ""
-        st.session_state[f'new_{yaku_type}_score'] = 0
-
-def toggle_yaku_hatto(yaku_type, yaku_name):
-    """役の法度適用を切り替えるコールバック"""
-    if yaku_name in st.session_state.game_rules[yaku_type]:
-        current_status = st.session_state.game_rules[yaku_type][yaku_name].get('hatto_applicable', False)
-        st.session_state.game_rules[yaku_type][yaku_name]['hatto_applicable'] = not current_status
-    else:
-        st.warning(f"Warning: 役'{yaku_name}'が見つかりませんでした。")
+    if game_type in PRESETS:
+        # プリセットは全セッションで共有し、このセッションの変更は RuleOverlay に別に記録する
+        st.session_state.game_rules = RuleOverlay(PRESETS[game_type])
+
+def current_rules():
+    """このセッションの現在のルール（CompiledRules）を返す関数"""
+    return st.session_state.game_rules.compiled
 
 def format_score(score, unit, delta_mode=False):
     """指定された単位に合わせてスコアをフォーマットする"""
@@ -125,235 +251,163 @@ def format_score(score, unit, delta_mode=False):
 
 def calculate_score_from_cards(brights, animals, ribbons, chaff):
     """取り札の枚数から点数を計算する関数"""
-    card_scores = st.session_state.game_rules['card_scores']
-    score = (
-        brights * card_scores.get('光', 0) +
-        animals * card_scores.get('タネ', 0) +
-        ribbons * card_scores.get('短冊', 0) +
-        chaff * card_scores.get('カス', 0)
-    )
-    return int(score)
-
-def calculate_points_from_detections(detected_card_names, game_rules):
-    """認識されたカード名のリストから、取り札の合計点を計算する関数"""
-    counts = {"光": 0, "タネ": 0, "短冊": 0, "カス": 0}
-    for card_name in detected_card_names:
-        try:
-            type_abbr = card_name.split('-')[1]
-            card_type = TYPE_ABBREVIATION_MAP.get(type_abbr, "カス") # 不明なものはカスとして扱う
-            counts[card_type] += 1
-        except IndexError:
-            continue
-    
-    return calculate_score_from_cards(
-        counts["光"], counts["タネ"], counts["短冊"], counts["カス"]
-    )
-def calculate_score_from_image(uploaded_file, yolo_model):
-    """画像からYOLOで認識し、カード名、信頼度、合計点を返す関数"""
+    return card_points(current_rules().card_scores, brights, animals, ribbons, chaff)
+
+def calculate_points_from_detections(detections, game_rules):
+    """認識結果（Detections）と CompiledRules から、取り札の合計点を計算する関数"""
+    return detections.points(game_rules.card_scores)
+
+# ultralytics の Results.speed のキーと、トレースに記録する区間名の対応
+MODEL_SPEED_STAGES = {"preprocess": "model_preprocess", "inference": "forward", "postprocess": "nms"}
+
+def calculate_score_from_image(uploaded_file, yolo_model, detection_cache=None, cache_key=None, profile=DEFAULT_PROFILE, trace_id=None):
+    """画像からYOLOで認識し、認識結果（Detections）を返す関数（失敗したときは None）
+
+    信頼度のしきい値などは profile (InferenceProfile) でモデルに渡す。
+    detection_cache と cache_key を渡すと、同じ画像の認識結果を使い回す。
+    各処理の所要時間は trace_id をつけてトレースに記録する。
+    """
     if yolo_model is None:
-        return 0, []
+        return None
     try:
-        image = Image.open(uploaded_file).convert("RGB")
-        results = yolo_model(image)
-        
-        boxes = results[0].boxes
-        detected_indices = boxes.cls.tolist()
-        confidences = boxes.conf.tolist()
-        class_names = yolo_model.names
-        
-        confidence_threshold = 0.5 
-        
-        # 認識結果を構築する際に、信頼度がしきい値以上のものだけをリストに含める
-        detections = [
-            {"name": class_names[int(i)], "conf": conf}
-            for i, conf in zip(detected_indices, confidences)
-            if conf >= confidence_threshold
-        ]
-
-        return detections
+        return detect_cards(uploaded_file, yolo_model, detection_cache, cache_key, profile, trace_id)
     except Exception as e:
         st.error(f"画像処理中にエラーが発生しました: {e}")
-        return []
+        return None
 
-def record_scores_callback():
-    # --- Step 1: 準備 ---
-    st.session_state.form_error = None
-    st.session_state.score_sum_warning = None
-    active_players = st.session_state.get('active_players', st.session_state.players)
-    orita_players = [p for p in st.session_state.players if p not in active_players]
-    game_rules = st.session_state.game_rules
+def detect_cards(uploaded_file, yolo_model, detection_cache=None, cache_key=None, profile=DEFAULT_PROFILE, trace_id=None):
+    """calculate_score_from_image の本体（Streamlit を使わず、失敗したときは例外を投げる）"""
+    tracer = get_tracer()
+    if detection_cache is not None and cache_key is not None:
+        with tracer.span("cache_lookup", trace_id) as span:
+            cached = detection_cache.get(cache_key)
+            span["hit"] = cached is not None
+        if cached is not None:
+            return Detections.from_payload(cached, class_table_for(yolo_model.names))
+    with tracer.span("decode", trace_id) as span:
+        image = load_image_for_inference(uploaded_file, profile.imgsz)
+        span["size"] = image.size
+    with tracer.span("model_call", trace_id):
+        results = yolo_model(image, **profile.predict_kwargs())
+    # モデル内部の前処理・推論・NMS の時間は ultralytics が測った値を記録する
+    for key, stage in MODEL_SPEED_STAGES.items():
+        speed = (getattr(results[0], "speed", None) or {}).get(key)
+        if speed is not None:
+            tracer.record(stage, speed, trace_id)
+
+    # 信頼度のしきい値はモデル側 (profile.conf) で適用済み。どのバックエンドでも同じ形に揃える
+    with tracer.span("build_detections", trace_id) as span:
+        detections = detections_from_results(results[0], yolo_model.names)
+        span["count"] = len(detections)
+
+    # エラーにならなかった結果だけをキャッシュする
+    if detection_cache is not None and cache_key is not None:
+        detection_cache.put(cache_key, detections.to_payload())
+    return detections
+
+@st.cache_resource
+def get_game_store():
+    """ゲーム保存用の GameStore をサーバー全体で共有する関数"""
+    return GameStore()
 
-    if len(st.session_state.players) >= 4 and len(active_players) < 2:
-        st.session_state.form_error = "参加者が2人未満です。出る人を2人以上選択してください。"
+def start_saved_game():
+    """進行中のゲームを新しく保存し、ゲームIDをsession_stateに記録する関数"""
+    ss = st.session_state
+    try:
+        ss.game_id = get_game_store().create_game(ss.players, current_rules().to_dict(), ss.scores, ss.current_month)
+    except sqlite3.Error as e:
+        ss.game_id = None
+        st.warning(f"ゲームの保存中にエラーが発生しました: {e}")
+
+def get_month_log():
+    """進行中のゲームの MonthLog を返す関数（得点表が作り直されていたら、その得点表で作り直す）"""
+    ss = st.session_state
+    log = ss.get('month_log')
+    if log is None or log.ledger is not ss.scores:
+        log = MonthLog(ss.scores)
+        ss.month_log = log
+    return log
+
+def save_current_game(events=()):
+    """進行中のゲームを保存する関数（MonthLog に適用したイベントを渡すと、その記録も保存する）"""
+    ss = st.session_state
+    if not ss.get('game_id'):
         return
+    try:
+        store = get_game_store()
+        if not events:
+            store.save_game(ss.game_id, ss.players, current_rules().to_dict(), ss.scores, ss.current_month)
+        else:
+            store.record_events(ss.game_id, events, ss.players, current_rules().to_dict(), get_month_log(), ss.current_month)
+    except sqlite3.Error as e:
+        if events:
+            # 保存できなかったイベントが抜けるので、次の保存ではスナップショットから書き直す
+            get_month_log().snapshot_seq = None
+        st.warning(f"ゲームの保存中にエラーが発生しました: {e}")
 
-    # --- Step 2: その月の参加者間のスコア変動を記録する辞書を初期化 ---
-    monthly_score_change = {player: 0 for player in active_players}
-    outcome_type = st.session_state.get('outcome_type', '役なし（取り札勝負）')
-
-    # --- Step 3: 主得点を計算 ---
-    # A) 役なし（取り札勝負）の場合
-    if outcome_type == "役なし（取り札勝負）":
-        base_scores = {}
-        for player in active_players:
-            mode = st.session_state.input_modes.get(player, "取り札入力")
-            if mode == "得点入力":
-                base_scores[player] = st.session_state.get(f'manual_score_{player}', 0)
-            elif mode == "取り札入力":
-                b = st.session_state.get(f'brights_{player}', 0); a = st.session_state.get(f'animals_{player}', 0)
-                r = st.session_state.get(f'ribbons_{player}', 0); c = st.session_state.get(f'chaff_{player}', 0)
-                base_scores[player] = calculate_score_from_cards(b, a, r, c)
-            elif mode == "写真で自動入力":
-                # session_stateに保存された認識結果からスコアを計算
-                detections = st.session_state.get(f'detections_{player}', [])
-                detected_names = [d['name'] for d in detections]
-                base_scores[player] = calculate_points_from_detections(detected_names, game_rules)
-        
-        if len(active_players) == 2:
-            # 【2人プレイの場合】 点差を直接やり取り
-            p1, p2 = active_players
-            score1 = base_scores.get(p1, 0)
-            score2 = base_scores.get(p2, 0)
-            difference = abs(score1 - score2)
-            
-            if score1 > score2:
-                monthly_score_change[p1] = difference
-                monthly_score_change[p2] = -difference
-            elif score2 > score1:
-                monthly_score_change[p1] = -difference
-                monthly_score_change[p2] = difference
-            # 同点の場合は変動なし (初期値0のまま)
-
-        elif len(active_players) > 2:
-            avg = sum(base_scores.values()) / len(active_players)
-            float_s = {p: base_scores.get(p, 0) - avg for p in active_players}
-            rounded_s = {p: int(round(s)) for p, s in float_s.items()}
-            err = sum(rounded_s.values())
-            if err != 0 and base_scores:
-                winner = max(base_scores, key=base_scores.get); rounded_s[winner] -= err
-            monthly_score_change = rounded_s
-
-    # B) 役で勝負が決まる場合
-    else:
-        yaku_type_en, state_prefix = "", ""
-        if outcome_type == "出来役あり": yaku_type_en, state_prefix = "dekiyaku", "dekiyaku"
-        else: yaku_type_en, state_prefix = "special_yaku", "special_yaku"
-
-        winner = st.session_state.get(f'{state_prefix}_winner', 'なし')
-        if winner != 'なし' and winner in active_players:
-            selected_yaku = st.session_state.get(f'{state_prefix}_selection', [])
-            total_yaku_score = 0
-            for yaku in selected_yaku:
-                yaku_data = game_rules[yaku_type_en][yaku]
-                base_score = yaku_data['score']
-                if yaku_data.get('is_variable', False):
-                    extra_items = st.session_state.get(f'{state_prefix}_extra_{yaku}', 0)
-                    base_score += extra_items * yaku_data.get('per_item_score', 1)
-                total_yaku_score += base_score
-
-            losers = [p for p in active_players if p != winner]
-            hatto_players = st.session_state.get('hatto_players', [])
-            is_hatto_round = any(game_rules['dekiyaku'][yaku].get('hatto_applicable', False) for yaku in selected_yaku)
-
-            winner_gain = 0
-            if outcome_type == "出来役あり":
-                hatto_players = st.session_state.get('hatto_players', [])
-                is_hatto_round = any(game_rules['dekiyaku'][yaku].get('hatto_applicable', False) for yaku in selected_yaku)
-                
-                if is_hatto_round and hatto_players:
-                    # 法度が発生した場合の特別な精算
-                    winner_gain = 0
-                    for loser in losers:
-                        if loser in hatto_players:
-                            payment = total_yaku_score * 2 
-                            monthly_score_change[loser] = -payment
-                            winner_gain += payment
-                        else:
-                            monthly_score_change[loser] = 0
-                    monthly_score_change[winner] = winner_gain
-                else:
-                    # 法度がない通常の役での勝利
-                    if losers:
-                        monthly_score_change[winner] = total_yaku_score * len(losers)
-                        for loser in losers:
-                            monthly_score_change[loser] = -total_yaku_score
-            else: # 特殊役の場合は法度を考慮しない
-                if losers:
-                    monthly_score_change[winner] = total_yaku_score * len(losers)
-                    for loser in losers:
-                        monthly_score_change[loser] = -total_yaku_score
-
-    if outcome_type != "特殊役あり":
-        teyaku_totals = {}
-        for p in active_players:
-            selected_teyaku = st.session_state.get(f'teyaku_selection_{p}', [])
-            base_teyaku_score = sum(game_rules['teyaku'][y]['score'] for y in selected_teyaku)
-            
-            # チェックボックスがONならボーナス点を加算
-            if st.session_state.get(f'tobikomi_{p}', False):
-                base_teyaku_score += 12
-            if st.session_state.get(f'nukeyaku_{p}', False):
-                base_teyaku_score += 12
-            
-            teyaku_totals[p] = base_teyaku_score
-        if any(teyaku_totals.values()):
-            for p1 in active_players:
-                for p2 in active_players:
-                    if p1 != p2: monthly_score_change[p1] += teyaku_totals[p1] - teyaku_totals[p2]
-
-    orita_players = [p for p in st.session_state.players if p not in active_players]
-
-    scores_to_record = {player: 0 for player in st.session_state.players}
-    for player in st.session_state.players:
-        scores_to_record[player] = monthly_score_change.get(player, 0)
-
-    if game_rules.get("enable_orichin", False) and orita_players and monthly_score_change:
-        winner_for_orichin = max(monthly_score_change, key=monthly_score_change.get)
-        for player in orita_players:
-            orichin = st.session_state.get(f'orichin_{player}', 0)
-            if orichin > 0:
-                scores_to_record[player] -= orichin
-                scores_to_record[winner_for_orichin] += orichin
-    
-    if game_rules.get("enable_oikomi", False) and orita_players and active_players:
-        for player in orita_players:
-            oikomichin = st.session_state.get(f'oikomichin_{player}', 0)
-            if oikomichin > 0:
-                scores_to_record[player] += oikomichin * len(active_players)
-                for active_player in active_players:
-                    scores_to_record[active_player] -= oikomichin
-
-    if game_rules.get("enable_mizuten", False):
-        mizuten_player = st.session_state.get('mizuten_player', 'なし')
-        if mizuten_player != 'なし':
-            scores_to_record[mizuten_player] += 12 * (len(st.session_state.players) - 1)
-            for player in st.session_state.players:
-                if player != mizuten_player:
-                    scores_to_record[player] -= 12
-
-    # Step 4: 場の状況に応じて点数を倍化
-    ba_multiplier = 1
-    if game_rules.get("zetsuba_oba", True):
-        ba_choice = st.session_state.get('ba_status', '小場 (x1)')
-        if "大場" in ba_choice: ba_multiplier = 2
-        if "絶場" in ba_choice: ba_multiplier = 4
-    
-    # 次に追加の倍率を取得
-    custom_multiplier = st.session_state.get('custom_multiplier', 1)
-
-    # 最終的な倍率を計算
-    final_multiplier = ba_multiplier * custom_multiplier
-    
-    if final_multiplier > 1:
-        for player in active_players:
-            scores_to_record[player] *= final_multiplier
-  
-    final_scores_to_record = {player: int(round(score)) for player, score in scores_to_record.items()}
-    new_row = pd.DataFrame([final_scores_to_record], index=[f'{st.session_state.current_month}月'])
-    st.session_state.scores = pd.concat([st.session_state.scores, new_row])
-    st.session_state.current_month += 1
-    
-    game_rules = st.session_state.game_rules 
+def resume_saved_game(game_id):
+    """保存されたゲームをsession_stateに読み込む関数。見つからなければFalseを返す"""
+    saved = get_game_store().load_game(game_id)
+    if saved is None:
+        return False
+    st.session_state.game_id = saved.game_id
+    st.session_state.players = saved.players
+    st.session_state.game_rules = RuleOverlay(saved.game_rules)
+    st.session_state.scores = saved.ledger
+    st.session_state.month_log = saved.log
+    st.session_state.current_month = saved.current_month
+    # 前のゲームの今月の入力（参加者・役・入力方法など）を残さない
+    reset_month_inputs(current_rules())
+    st.session_state.navigate_to_results = False
+    return True
+
+def month_input_from_session():
+    """st.session_state に入力された今月の内容を MonthInput にまとめる"""
+    ss = st.session_state
+    players = tuple(ss.players)
+    active_players = tuple(ss.get('active_players', ss.players))
+
+    inputs = {}
+    for player in players:
+        mode = ss.input_modes.get(player, MODE_CARDS)
+        b, a, r, c = (ss.get(f'brights_{player}', 0), ss.get(f'animals_{player}', 0),
+                      ss.get(f'ribbons_{player}', 0), ss.get(f'chaff_{player}', 0))
+        if mode == MODE_PHOTO:
+            # session_stateに保存された認識結果を札の種類ごとの枚数に直す
+            detections = ss.get(f'detections_{player}')
+            b, a, r, c = detections.card_type_counts() if detections else (0, 0, 0, 0)
+        inputs[player] = PlayerInput(
+            mode=mode,
+            manual_score=ss.get(f'manual_score_{player}', 0),
+            brights=b, animals=a, ribbons=r, chaff=c,
+            teyaku=tuple(ss.get(f'teyaku_selection_{player}', [])),
+            tobikomi=ss.get(f'tobikomi_{player}', False),
+            nukeyaku=ss.get(f'nukeyaku_{player}', False),
+            orichin=ss.get(f'orichin_{player}', 0),
+            oikomichin=ss.get(f'oikomichin_{player}', 0),
+        )
+
+    outcome_type = ss.get('outcome_type', OUTCOME_CARDS)
+    state_prefix = "dekiyaku" if outcome_type == OUTCOME_DEKIYAKU else "special_yaku"
+    yaku_selection = tuple(ss.get(f'{state_prefix}_selection', []))
+    yaku_extras = {yaku: ss.get(f'{state_prefix}_extra_{yaku}', 0) for yaku in yaku_selection}
+
+    return MonthInput(
+        players=players,
+        active_players=active_players,
+        inputs=inputs,
+        outcome_type=outcome_type,
+        yaku_winner=ss.get(f'{state_prefix}_winner', NO_PLAYER),
+        yaku_selection=yaku_selection,
+        yaku_extras=yaku_extras,
+        hatto_players=tuple(ss.get('hatto_players', [])),
+        mizuten_player=ss.get('mizuten_player', NO_PLAYER),
+        ba_status=ss.get('ba_status', '小場 (x1)'),
+        custom_multiplier=ss.get('custom_multiplier', 1),
+    )
+
+def reset_month_inputs(game_rules):
+    """今月の入力欄と月ごとの設定を初期状態に戻す関数"""
     for player in st.session_state.players:
         # 点数入力・取り札入力
         st.session_state[f'manual_score_{player}'] = 0
@@ -364,6 +418,9 @@ def record_scores_callback():
         # 役選択
         st.session_state[f'yaku_dekiyaku_{player}'] = []
         st.session_state[f'teyaku_selection_{player}'] = []
+        st.session_state[f'hand_cards_{player}'] = []
+        st.session_state[f'hand_field_{player}'] = []
+        st.session_state[f'hand_photo_hash_{player}'] = None
         st.session_state[f'tobikomi_{player}'] = False
         st.session_state[f'nukeyaku_{player}'] = False
         # 下り賃・追い込み賃
@@ -372,15 +429,19 @@ def record_scores_callback():
         # 写真モード関連
         st.session_state[f'uploader_{player}'] = None
         st.session_state[f'cam_input_{player}'] = None
-        st.session_state[f'detections_{player}'] = []
-        st.session_state[f'last_photo_hash_{player}'] = None
+        st.session_state[f'detections_{player}'] = None
+        st.session_state[f'photos_{player}'] = None
+        st.session_state[f'live_scan_{player}'] = None
+        st.session_state[f'pile_{player}'] = None
 
     # 月ごとの設定をリセット
+    st.session_state.editing_month = None
+    st.session_state.dekiyaku_prefill = None
     st.session_state.active_players = st.session_state.players
     st.session_state.ba_status = "小場 (x1)"
     st.session_state.custom_multiplier = 1
     st.session_state.input_modes = {}
-    if game_rules.get('game_name') == 'こいこい':
+    if game_rules.game_name == 'こいこい':
         st.session_state.outcome_type = '出来役あり'
     else:
         st.session_state.outcome_type = '役なし（取り札勝負）'
@@ -389,13 +450,128 @@ def record_scores_callback():
     st.session_state.hatto_players = []; st.session_state.mizuten_player = 'なし'
     # 可変点数役の入力欄をリセット
     for yaku_type_en in ['dekiyaku', 'special_yaku']:
-        if yaku_type_en in game_rules:
-            for yaku, data in game_rules[yaku_type_en].items():
-                if data.get('is_variable', False): 
-                    st.session_state[f'{yaku_type_en}_extra_{yaku}'] = 0
-    if st.session_state.current_month > 12:
+        for yaku in game_rules.variable_yaku[yaku_type_en]:
+            st.session_state[f'{yaku_type_en}_extra_{yaku}'] = 0
+
+def load_month_input(month, game_rules):
+    """記録済みの月の入力（MonthInput）を入力欄に戻す関数
+
+    写真で入力した人は写真が残っていないので、札の種類ごとの枚数を取り札入力の欄に戻す。
+    今のルールで無効になっている役は外す。
+    """
+    reset_month_inputs(game_rules)
+    ss = st.session_state
+    for player in ss.players:
+        pi = month.inputs.get(player)
+        if pi is None:
+            continue
+        mode = MODE_CARDS if pi.mode == MODE_PHOTO else pi.mode
+        ss[f'mode_select_{player}'] = mode
+        ss.input_modes[player] = mode
+        ss[f'manual_score_{player}'] = pi.manual_score
+        ss[f'brights_{player}'] = pi.brights
+        ss[f'animals_{player}'] = pi.animals
+        ss[f'ribbons_{player}'] = pi.ribbons
+        ss[f'chaff_{player}'] = pi.chaff
+        ss[f'teyaku_selection_{player}'] = [y for y in pi.teyaku if y in game_rules.active_teyaku]
+        ss[f'tobikomi_{player}'] = pi.tobikomi
+        ss[f'nukeyaku_{player}'] = pi.nukeyaku
+        ss[f'orichin_{player}'] = pi.orichin
+        ss[f'oikomichin_{player}'] = pi.oikomichin
+
+    ss.active_players = [p for p in month.active_players if p in ss.players]
+    ss.outcome_type = month.outcome_type
+    if month.outcome_type != OUTCOME_CARDS:
+        is_dekiyaku = month.outcome_type == OUTCOME_DEKIYAKU
+        state_prefix = "dekiyaku" if is_dekiyaku else "special_yaku"
+        active_yaku = game_rules.active_dekiyaku if is_dekiyaku else game_rules.active_special_yaku
+        ss[f'{state_prefix}_winner'] = month.yaku_winner if month.yaku_winner in ss.active_players else NO_PLAYER
+        ss[f'{state_prefix}_selection'] = [y for y in month.yaku_selection if y in active_yaku]
+        for yaku, extra in month.yaku_extras.items():
+            if yaku in game_rules.variable_yaku[state_prefix]:
+                ss[f'{state_prefix}_extra_{yaku}'] = extra
+    ss.hatto_players = [p for p in month.hatto_players if p in ss.active_players]
+    ss.mizuten_player = month.mizuten_player if month.mizuten_player in ss.players else NO_PLAYER
+    ss.ba_status = month.ba_status
+    ss.custom_multiplier = month.custom_multiplier
+
+def record_scores_callback():
+    # --- Step 1: 準備 ---
+    st.session_state.form_error = None
+    st.session_state.score_sum_warning = None
+    month_input = month_input_from_session()
+    game_rules = current_rules()
+
+    form_error = validate_month(month_input, game_rules.scoring)
+    if form_error:
+        st.session_state.form_error = form_error
+        return
+
+    # --- Step 2: 精算エンジンで今月の得点変動を計算 ---
+    scores_to_record = settle_month(month_input, game_rules.scoring)
+
+    # --- Step 3: イベントとして記録する（過去の月の修正中なら、その月の行だけを置き換える） ---
+    log = get_month_log()
+    editing_month = st.session_state.get('editing_month')
+    if editing_month:
+        event = log.amend(editing_month, scores_to_record, month_input.to_dict())
+    else:
+        event = log.record(f'{st.session_state.current_month}月', scores_to_record, month_input.to_dict())
+        st.session_state.current_month += 1
+    save_current_game([event])
+
+    reset_month_inputs(game_rules)
+    if editing_month:
+        st.session_state.run_id += 1
+        st.session_state.success_message = f"{event.label}のスコアを修正しました。"
+    elif st.session_state.current_month > 12:
         st.session_state.navigate_to_results = True
     else:
         month_recorded = st.session_state.current_month - 1
         st.session_state.run_id += 1  # run_idをインクリメントして、次の入力に備える
-        st.session_state.success_message = f"{month_recorded}月のスコアを記録しました。 [今月の設定に戻る](#top_anchor)"
\ No newline at end of file
+        st.session_state.success_message = f"{month_recorded}月のスコアを記録しました。 [今月の設定に戻る](#top_anchor)"
+
+def undo_month_callback():
+    """最後に記録した月を取り消し、その月の入力を入力欄に戻す関数（直して記録し直せるようにする）"""
+    log = get_month_log()
+    event = log.undo()
+    if event is None:
+        return
+    st.session_state.current_month -= 1
+    save_current_game([event])
+    undone = log.next_redo()
+    if undone.month is not None:
+        load_month_input(MonthInput.from_dict(undone.month), current_rules())
+    else:
+        reset_month_inputs(current_rules())
+    st.session_state.run_id += 1
+    st.session_state.success_message = f"{event.label}の記録を取り消しました。入力を直して記録し直すか、やり直しで元に戻せます。"
+
+def redo_month_callback():
+    """取り消した月を元に戻す関数"""
+    log = get_month_log()
+    event = log.redo()
+    if event is None:
+        return
+    st.session_state.current_month += 1
+    save_current_game([event])
+    reset_month_inputs(current_rules())
+    if st.session_state.current_month > 12:
+        st.session_state.navigate_to_results = True
+    else:
+        st.session_state.run_id += 1
+        st.session_state.success_message = f"{event.label}の記録を元に戻しました。"
+
+def edit_month_callback(row):
+    """記録済みの月の入力を入力欄に戻し、記録ボタンでその月を修正するようにする関数"""
+    entry = get_month_log().entry(row)
+    if entry is None or entry.month is None:
+        return
+    load_month_input(MonthInput.from_dict(entry.month), current_rules())
+    st.session_state.editing_month = row
+    st.session_state.run_id += 1
+
+def cancel_edit_callback():
+    """過去の月の修正をやめて、今月の入力に戻る関数"""
+    reset_month_inputs(current_rules())
+    st.session_state.run_id += 1
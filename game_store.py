@@ -0,0 +1,234 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from ledger import ScoreLedger
+from month_log import AMEND, RECORD, REDO, UNDO, MonthEvent, MonthLog
+
+# 保存先（環境変数で変更できる）
+DEFAULT_DB_PATH = os.environ.get("HANAFUDA_DB_PATH", os.path.join("data", "hanafuda.sqlite3"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id            TEXT PRIMARY KEY,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL,
+    players       TEXT NOT NULL,
+    rules         TEXT NOT NULL,
+    current_month INTEGER NOT NULL,
+    ledger        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_updated_at ON games (updated_at DESC);
+CREATE TABLE IF NOT EXISTS months (
+    game_id     TEXT NOT NULL REFERENCES games (id) ON DELETE CASCADE,
+    seq         INTEGER NOT NULL,
+    label       TEXT NOT NULL,
+    scores      TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (game_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS month_events (
+    game_id     TEXT NOT NULL REFERENCES games (id) ON DELETE CASCADE,
+    seq         INTEGER NOT NULL,
+    kind        TEXT NOT NULL,
+    row         INTEGER NOT NULL,
+    label       TEXT NOT NULL,
+    scores      TEXT NOT NULL,
+    month       TEXT,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (game_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS month_snapshots (
+    game_id TEXT NOT NULL REFERENCES games (id) ON DELETE CASCADE,
+    seq     INTEGER NOT NULL,
+    state   TEXT NOT NULL,
+    PRIMARY KEY (game_id, seq)
+) WITHOUT ROWID;
+"""
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class SavedGame:
+    """保存されたゲーム1件（再開に必要な情報をすべて持つ）"""
+
+    def __init__(self, game_id, players, game_rules, current_month, log, updated_at):
+        self.game_id = game_id
+        self.players = players
+        self.game_rules = game_rules
+        self.current_month = current_month
+        self.log = log
+        self.ledger = log.ledger
+        self.updated_at = updated_at
+
+
+class GameStore:
+    """ゲームを SQLite (WAL モード) に保存・再開するクラス
+
+    games テーブルの1行に、プレイヤー・ルール・最新の得点表をまとめて持つ
+    （ゲームの一覧や、月のイベントがない古いゲームの再開に使う）。
+    月の記録・修正・取り消しは month_events テーブルに書き換えずに追記し、
+    month_snapshots テーブルには MonthLog の状態を SNAPSHOT_INTERVAL イベントごとに残す。
+    再開するときは最後のスナップショットから後のイベントだけを再生する。
+    months テーブルには今有効な各月の記録を持つ。書き込みはすべて1つのトランザクションにまとめる。
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, statements):
+        """(SQL, パラメータ, 複数行か) のリストを1つのトランザクションで実行する"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params, many in statements:
+                    if many:
+                        self._conn.executemany(sql, params)
+                    else:
+                        self._conn.execute(sql, params)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _snapshot_params(self, players, game_rules, current_month, ledger):
+        return (_dumps(list(players)), _dumps(game_rules), current_month, _dumps(ledger.snapshot()))
+
+    # --- 書き込み ---
+    def create_game(self, players, game_rules, ledger, current_month=1):
+        """新しいゲームを保存し、ゲームIDを返す"""
+        game_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        self._transaction([(
+            "INSERT INTO games (id, created_at, updated_at, players, rules, current_month, ledger) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (game_id, now, now) + self._snapshot_params(players, game_rules, current_month, ledger),
+            False,
+        )])
+        return game_id
+
+    def save_game(self, game_id, players, game_rules, ledger, current_month):
+        """プレイヤーの途中参加などで変わったスナップショットを上書きする"""
+        self._transaction([(
+            "UPDATE games SET updated_at = ?, players = ?, rules = ?, current_month = ?, ledger = ? WHERE id = ?",
+            (time.time(),) + self._snapshot_params(players, game_rules, current_month, ledger) + (game_id,),
+            False,
+        )])
+
+    def record_events(self, game_id, events, players, game_rules, log, current_month):
+        """MonthLog に適用したイベントを追記し、months テーブルと最新の得点表を1つのトランザクションで更新する
+
+        スナップショットの頃合いなら、適用後の MonthLog の状態もあわせて保存する。
+        """
+        now = time.time()
+        event_rows = [
+            (game_id, event.seq, event.kind, event.row, event.label, _dumps(event.scores),
+             None if event.month is None else _dumps(event.month), event.recorded_at)
+            for event in events
+        ]
+        statements = [
+            ("INSERT INTO month_events (game_id, seq, kind, row, label, scores, month, recorded_at) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", event_rows, True),
+        ]
+        # 同じ行を取り消してから記録し直すこともあるので、months テーブルはイベントの順に反映する
+        for event in events:
+            if event.kind == UNDO:
+                statements.append(("DELETE FROM months WHERE game_id = ? AND seq = ?", (game_id, event.row), False))
+            elif event.kind in (RECORD, REDO, AMEND):
+                statements.append((
+                    "INSERT OR REPLACE INTO months (game_id, seq, label, scores, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                    (game_id, event.row, event.label, _dumps(event.scores), event.recorded_at), False,
+                ))
+        snapshot = log.snapshot() if log.snapshot_due() else None
+        if snapshot is not None:
+            statements.append((
+                "INSERT OR REPLACE INTO month_snapshots (game_id, seq, state) VALUES (?, ?, ?)",
+                (game_id, snapshot["seq"], _dumps(snapshot)), False,
+            ))
+        statements.append((
+            "UPDATE games SET updated_at = ?, players = ?, rules = ?, current_month = ?, ledger = ? WHERE id = ?",
+            (now,) + self._snapshot_params(players, game_rules, current_month, log.ledger) + (game_id,), False,
+        ))
+        self._transaction(statements)
+        if snapshot is not None:
+            log.snapshot_seq = snapshot["seq"]
+
+    def delete_game(self, game_id):
+        self._transaction([("DELETE FROM games WHERE id = ?", (game_id,), False)])
+
+    # --- 読み込み ---
+    def load_game(self, game_id):
+        """ゲームIDから保存されたゲームを読み込む（見つからなければ None）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, players, rules, current_month, ledger, updated_at FROM games WHERE id = ?",
+                (game_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            snapshot = self._conn.execute(
+                "SELECT state FROM month_snapshots WHERE game_id = ? ORDER BY seq DESC LIMIT 1", (game_id,)
+            ).fetchone()
+            if snapshot is not None:
+                snapshot = json.loads(snapshot[0])
+                # 再生するのはスナップショットより後のイベントだけ
+                # （古い形式のスナップショットが seq で参照しているイベントもあわせて読む）
+                refs = [ref for _, ref in snapshot["entries"]] + snapshot["redo"]
+                referenced = [ref for ref in refs if isinstance(ref, int)]
+                event_rows = self._conn.execute(
+                    "SELECT seq, kind, row, label, scores, month, recorded_at FROM month_events "
+                    f"WHERE game_id = ? AND (seq > ? OR seq IN ({', '.join('?' * len(referenced))})) ORDER BY seq",
+                    (game_id, snapshot["seq"], *referenced),
+                ).fetchall()
+        game_id, players, rules, current_month, ledger, updated_at = row
+        if snapshot is None:
+            # 月のイベントがまだない（またはイベントを記録する前に保存された）ゲーム
+            log = MonthLog(ScoreLedger.from_snapshot(json.loads(ledger)))
+        else:
+            events = [
+                MonthEvent(seq, kind, event_row, label, json.loads(scores), None if month is None else json.loads(month), recorded_at)
+                for seq, kind, event_row, label, scores, month, recorded_at in event_rows
+            ]
+            log = MonthLog.restore(snapshot, events)
+        return SavedGame(
+            game_id=game_id,
+            players=json.loads(players),
+            game_rules=json.loads(rules),
+            current_month=current_month,
+            log=log,
+            updated_at=updated_at,
+        )
+
+    def list_games(self, limit=20):
+        """最近更新されたゲームを [(ゲームID, プレイヤー, 現在の月, 更新日時), ...] で返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, players, current_month, updated_at FROM games ORDER BY updated_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [(game_id, json.loads(players), month, updated_at) for game_id, players, month, updated_at in rows]
+
+    def month_history(self, game_id):
+        """記録された月を順番に [(ラベル, {プレイヤー: 点数}), ...] で返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT label, scores FROM months WHERE game_id = ? ORDER BY seq", (game_id,)
+            ).fetchall()
+        return [(label, json.loads(scores)) for label, scores in rows]
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+# 初期値の行 + 12か月分。プレイヤーは最大7人まで途中参加できる
+DEFAULT_ROW_CAPACITY = 13
+DEFAULT_PLAYER_CAPACITY = 7
+
+
+class ScoreLedger:
+    """得点表（初期値の行 + 各月の得点変動）を事前確保した整数配列で持つクラス
+
+    合計点と直近の行は記録のたびに差分で更新するので、画面の再実行ごとに
+    DataFrame を集計し直す必要はない。DataFrame は表示・CSV出力用に
+    to_frame() で必要になったときだけ作る（変更がない限り使い回す）。
+    """
+
+    def __init__(self, initial_scores=None, row_capacity=DEFAULT_ROW_CAPACITY):
+        initial_scores = dict(initial_scores or {})
+        self._players = list(initial_scores)
+        self._col_index = {p: i for i, p in enumerate(self._players)}
+        self._data = np.zeros(
+            (max(row_capacity, 1), max(len(self._players), DEFAULT_PLAYER_CAPACITY)), dtype=np.int64
+        )
+        self._labels = []
+        self._totals = np.zeros(self._data.shape[1], dtype=np.int64)
+        self._frame = None
+        if initial_scores:
+            self.append(0, initial_scores)
+
+    # --- 参照 ---
+    @property
+    def players(self):
+        return list(self._players)
+
+    @property
+    def empty(self):
+        return not self._labels or not self._players
+
+    def __len__(self):
+        return len(self._labels)
+
+    def total(self, player):
+        """プレイヤーの合計点（初期値を含む）"""
+        col = self._col_index.get(player)
+        return 0 if col is None else int(self._totals[col])
+
+    def totals(self):
+        """{プレイヤー: 合計点} を返す"""
+        return {p: int(self._totals[i]) for i, p in enumerate(self._players)}
+
+    def last_delta(self, player):
+        """最後に記録された行（月がまだなければ初期値）の点数"""
+        col = self._col_index.get(player)
+        if col is None or not self._labels:
+            return 0
+        return int(self._data[len(self._labels) - 1, col])
+
+    def label(self, row_index):
+        """行のラベル（初期値の行は 0、各月は '1月' など）"""
+        return self._labels[row_index]
+
+    def rows(self):
+        """記録済みの行を (行数, プレイヤー数) の配列で返す（コピーではなくビュー）"""
+        return self._data[:len(self._labels), :len(self._players)]
+
+    # --- 更新 ---
+    def append(self, label, scores):
+        """1行（{プレイヤー: 点数}）を追加し、合計点を差分で更新する"""
+        row_index = len(self._labels)
+        if row_index >= self._data.shape[0]:
+            self._grow(rows=self._data.shape[0] * 2)
+        row = self._data[row_index]
+        for player, score in scores.items():
+            col = self._col_index.get(player)
+            if col is None:
+                col = self._add_column(player)
+                row = self._data[row_index]
+            row[col] = int(round(score))
+        self._labels.append(label)
+        self._totals += row
+        self._frame = None
+
+    def pop(self):
+        """最後の行を取り除き、(ラベル, {プレイヤー: 点数}) を返す（合計点は差分で戻す）"""
+        row_index = len(self._labels) - 1
+        if row_index < 0:
+            raise IndexError("取り除く行がありません")
+        row = self._data[row_index]
+        scores = {p: int(row[i]) for i, p in enumerate(self._players)}
+        self._totals -= row
+        row[:] = 0
+        self._frame = None
+        return self._labels.pop(), scores
+
+    def replace(self, row_index, scores):
+        """記録済みの行の点数を置き換え、合計点は新旧の差分だけ更新する"""
+        if not 0 <= row_index < len(self._labels):
+            raise IndexError(f"行がありません: {row_index}")
+        for player in scores:
+            if player not in self._col_index:
+                self._add_column(player)
+        row = self._data[row_index]
+        old_row = row.copy()
+        row[:] = 0
+        for player, score in scores.items():
+            row[self._col_index[player]] = int(round(score))
+        self._totals += row - old_row
+        self._frame = None
+
+    def add_player(self, player, initial_score=0):
+        """途中参加のプレイヤーを追加する（初期値の行に初期得点を入れ、それ以降の月は0点）"""
+        if player in self._col_index:
+            return
+        col = self._add_column(player)
+        if self._labels:
+            self._data[0, col] = initial_score
+            self._totals[col] = initial_score
+        self._frame = None
+
+    def _add_column(self, player):
+        col = len(self._players)
+        if col >= self._data.shape[1]:
+            self._grow(cols=self._data.shape[1] * 2)
+        self._players.append(player)
+        self._col_index[player] = col
+        return col
+
+    def _grow(self, rows=None, cols=None):
+        rows = rows or self._data.shape[0]
+        cols = cols or self._data.shape[1]
+        data = np.zeros((rows, cols), dtype=np.int64)
+        old_rows, old_cols = self._data.shape
+        data[:old_rows, :old_cols] = self._data
+        self._data = data
+        totals = np.zeros(cols, dtype=np.int64)
+        totals[:old_cols] = self._totals
+        self._totals = totals
+
+    # --- 保存・復元 ---
+    def snapshot(self):
+        """JSON に保存できる形（プレイヤー・行ラベル・各行の点数）にする"""
+        return {"players": self.players, "labels": list(self._labels), "rows": self.rows().tolist()}
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """snapshot() の結果から得点表を復元する"""
+        ledger = cls(row_capacity=max(len(snapshot["labels"]), DEFAULT_ROW_CAPACITY))
+        for player in snapshot["players"]:
+            ledger._add_column(player)
+        for label, row in zip(snapshot["labels"], snapshot["rows"]):
+            ledger.append(label, dict(zip(snapshot["players"], row)))
+        return ledger
+
+    # --- 表示・出力 ---
+    def to_frame(self):
+        """表示・CSV出力用の DataFrame（index は 0, '1月', '2月', ...）"""
+        if self._frame is None:
+            self._frame = pd.DataFrame(self.rows().copy(), index=list(self._labels), columns=list(self._players))
+        return self._frame
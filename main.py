@@ -1,10 +1,17 @@
 import streamlit as st
-import pandas as pd
+import sqlite3
+from datetime import datetime
+from ledger import ScoreLedger
+from functions import get_game_store, resume_saved_game
+from YOLO_model.warmup import get_model_warmer, warmup_enabled
+from profiler import start_run
 
 st.markdown('<meta name="robots" content="noindex">', unsafe_allow_html=True)
 
 # --- ページ設定とCSSでのサイドバー非表示 ---
 st.set_page_config(page_title="花札 得点計算", page_icon="🎴",initial_sidebar_state="collapsed")
+# ?profile=1 をつけたときだけ、ページ全体の再実行の所要時間を記録する
+profile = start_run("main")
 
 # サイドバーのナビゲーションを非表示にするCSS
 hide_sidebar_style = """
@@ -20,13 +27,19 @@ st.markdown(hide_sidebar_style, unsafe_allow_html=True)
 if 'players' not in st.session_state:
     st.session_state.players = []
 if 'scores' not in st.session_state:
-    st.session_state.scores = pd.DataFrame()
+    st.session_state.scores = ScoreLedger()
 if 'game_type' not in st.session_state:
     st.session_state.game_type = ""
 if 'current_month' not in st.session_state:
     st.session_state.current_month = 1
 if 'input_modes' not in st.session_state:
     st.session_state.input_modes = {}
+if 'game_id' not in st.session_state:
+    st.session_state.game_id = None
+
+# 認識モデルをバックグラウンドで読み込んでおく（ページの表示は待たない）
+if warmup_enabled():
+    get_model_warmer().start()
 
 # --- メインコンテンツ ---
 st.title('🎴 花札 得点計算アプリ')
@@ -36,11 +49,40 @@ if not st.session_state.players:
     st.info('新しいゲームを開始します。')
     if st.button('新しいゲームを始める', type="primary"):
         st.switch_page("pages/setting.py")
+
+    # --- 保存されたゲームの再開 ---
+    with profile.section("list_games"):
+        try:
+            saved_games = get_game_store().list_games()
+        except sqlite3.Error as e:
+            saved_games = []
+            st.warning(f"保存されたゲームの読み込み中にエラーが発生しました: {e}")
+    if saved_games:
+        with st.expander("保存されたゲームを再開する"):
+            game_labels = {}
+            for game_id, players, month, updated_at in saved_games:
+                progress = f"{month}月" if month <= 12 else "終了"
+                game_labels[game_id] = f"{'、'.join(players)}（{progress}・{datetime.fromtimestamp(updated_at):%m/%d %H:%M}）"
+            selected_game_id = st.selectbox("ゲームを選択", options=list(game_labels), format_func=game_labels.get)
+            typed_game_id = st.text_input("またはゲームIDを入力", placeholder="ゲームID")
+            if st.button('このゲームを再開する'):
+                try:
+                    resumed = resume_saved_game(typed_game_id.strip() or selected_game_id)
+                except (sqlite3.Error, ValueError) as e:
+                    st.warning(f"保存されたゲームの読み込み中にエラーが発生しました: {e}")
+                else:
+                    if resumed:
+                        st.switch_page("pages/points.py")
+                    else:
+                        st.error('指定されたゲームIDのゲームが見つかりませんでした。')
 else:
     st.success('進行中のゲームがあります。')
+    if st.session_state.game_id:
+        st.caption(f"ゲームID: {st.session_state.game_id}（このIDでいつでも再開できます）")
     st.write('**プレイヤー:**', '、'.join(st.session_state.players))
     st.write('**現在の得点:**')
-    st.dataframe(st.session_state.scores)
+    with profile.section("scores_table"):
+        st.dataframe(st.session_state.scores.to_frame())
     
     col1, col2 = st.columns(2)
     with col1:
@@ -49,5 +91,8 @@ else:
     with col2:
         if st.button('ゲームをリセットする'):
             st.session_state.players = []
-            st.session_state.scores = pd.DataFrame()
-            st.rerun()
\ No newline at end of file
+            st.session_state.scores = ScoreLedger()
+            st.session_state.game_id = None
+            st.rerun()
+
+profile.finish()
@@ -0,0 +1,183 @@
+import os
+import time
+from dataclasses import asdict, dataclass, field
+
+from ledger import ScoreLedger
+
+# 取り消して（やり直せる状態にして）おける月の数
+DEFAULT_UNDO_DEPTH = int(os.environ.get("HANAFUDA_UNDO_DEPTH", "3"))
+# このイベント数ごとに状態のスナップショットを保存する（再開時はそれ以降のイベントだけを再生する）
+SNAPSHOT_INTERVAL = 8
+
+# イベントの種類
+RECORD = "record"  # 月を記録した
+AMEND = "amend"    # 記録済みの月を修正した
+UNDO = "undo"      # 最後の月を取り消した
+REDO = "redo"      # 取り消した月をやり直した
+JOIN = "join"      # プレイヤーが途中参加した
+
+
+@dataclass(frozen=True, slots=True)
+class MonthEvent:
+    """得点表への操作1件。一度作ったら書き換えない
+
+    row は得点表の行番号（0 が初期値、1 からが各月）。scores はその行の得点変動
+    （JOIN では {プレイヤー: 初期得点}）、month は精算に使った入力（MonthInput.to_dict の形。
+    精算済みの点数だけを受け取った場合は None）。
+    """
+    seq: int
+    kind: str
+    row: int
+    label: str = ""
+    scores: dict = field(default_factory=dict)
+    month: dict = None
+    recorded_at: float = 0.0
+
+
+class MonthLog:
+    """記録した月をイベントとして持ち、取り消し・やり直し・過去の月の修正をするクラス
+
+    得点表 (ScoreLedger) はイベントを適用するたびに差分で更新するので、
+    過去の月を修正しても、その月の行と合計点だけが変わる（ほかの月は精算し直さない）。
+    ゲームを読み込むときは restore() で、最後のスナップショットから後のイベントだけを再生する。
+    events に持つのは作成（または復元）してから後のイベントだけで、通し番号は seq で数える。
+    """
+
+    def __init__(self, ledger=None, undo_depth=DEFAULT_UNDO_DEPTH):
+        self.ledger = ledger if ledger is not None else ScoreLedger()
+        self.undo_depth = undo_depth
+        self.events = []
+        self.seq = 0  # 最後に適用したイベントの通し番号
+        self.snapshot_seq = None  # 最後に保存したスナップショットの位置（まだなければ None）
+        self._entries = {}  # 行番号 -> その行の点数を決めたイベント（イベントのない行は修正できない）
+        self._redo = []     # 取り消した月のイベント（最後に取り消したものが末尾）
+
+    # --- 参照 ---
+    @property
+    def can_undo(self):
+        last_row = len(self.ledger) - 1
+        return last_row >= 1 and last_row in self._entries and len(self._redo) < self.undo_depth
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    def entry(self, row):
+        """その行の点数を決めたイベント（なければ None）"""
+        return self._entries.get(row)
+
+    def next_redo(self):
+        """やり直すと戻ってくる月のイベント（なければ None）"""
+        return self._redo[-1] if self._redo else None
+
+    def editable_rows(self):
+        """入力から修正できる（精算に使った入力が残っている）行番号のリスト"""
+        return [row for row, event in sorted(self._entries.items()) if event.month is not None]
+
+    # --- 操作（どれも適用したイベントを返す） ---
+    def record(self, label, scores, month=None):
+        """新しい月を記録する（やり直せる月は消える）"""
+        return self._push(RECORD, len(self.ledger), label, scores, month)
+
+    def undo(self):
+        """最後の月を取り消す。取り消せなければ None"""
+        if not self.can_undo:
+            return None
+        last_row = len(self.ledger) - 1
+        entry = self._entries[last_row]
+        return self._push(UNDO, last_row, entry.label, entry.scores)
+
+    def redo(self):
+        """最後に取り消した月を元に戻す。戻せなければ None"""
+        if not self._redo:
+            return None
+        entry = self._redo[-1]
+        return self._push(REDO, len(self.ledger), entry.label, entry.scores, entry.month)
+
+    def amend(self, row, scores, month=None):
+        """記録済みの月の点数（と入力）を置き換える"""
+        if not 1 <= row < len(self.ledger):
+            raise IndexError(f"修正できる月がありません: {row}")
+        return self._push(AMEND, row, self.ledger.label(row), scores, month)
+
+    def join(self, player, initial_score=0):
+        """途中参加のプレイヤーを追加する"""
+        return self._push(JOIN, 0, player, {player: initial_score})
+
+    def _push(self, kind, row, label, scores, month=None):
+        event = MonthEvent(
+            seq=self.seq + 1, kind=kind, row=row, label=str(label),
+            scores={p: int(s) for p, s in scores.items()}, month=month, recorded_at=time.time(),
+        )
+        self._apply(event)
+        self.events.append(event)
+        self.seq = event.seq
+        return event
+
+    def _apply(self, event):
+        kind = event.kind
+        if kind in (RECORD, REDO):
+            if event.row != len(self.ledger):
+                raise ValueError(f"記録する行がずれています: {event.row} (得点表は {len(self.ledger)} 行)")
+            self.ledger.append(event.label, event.scores)
+            self._entries[event.row] = event
+            if kind == RECORD:
+                self._redo.clear()
+            else:
+                self._redo.pop()
+        elif kind == UNDO:
+            self.ledger.pop()
+            self._redo.append(self._entries.pop(event.row))
+        elif kind == AMEND:
+            self.ledger.replace(event.row, event.scores)
+            self._entries[event.row] = event
+        elif kind == JOIN:
+            for player, initial_score in event.scores.items():
+                self.ledger.add_player(player, initial_score)
+        else:
+            raise ValueError(f"不明なイベントです: {kind}")
+
+    # --- 保存・復元 ---
+    def snapshot_due(self):
+        """スナップショットを保存する頃合いか（まだ一度も保存していないときも True）"""
+        return self.snapshot_seq is None or self.seq - self.snapshot_seq >= SNAPSHOT_INTERVAL
+
+    def snapshot(self):
+        """今の状態（得点表と、各行・取り消した月のイベント）を JSON に保存できる形にする
+
+        イベントは中身ごと入れるので、復元にはスナップショットより後のイベントしかいらない。
+        """
+        return {
+            "seq": self.seq,
+            "ledger": self.ledger.snapshot(),
+            "entries": [[row, asdict(event)] for row, event in sorted(self._entries.items())],
+            "redo": [asdict(event) for event in self._redo],
+        }
+
+    @classmethod
+    def restore(cls, snapshot, events, undo_depth=DEFAULT_UNDO_DEPTH):
+        """snapshot() の結果と、seq 順に並んだスナップショットより後のイベントから状態を復元する
+
+        イベントが1つでも抜けていたら（保存に失敗した月があったら）、
+        途中までの得点表を黙って返さずに ValueError にする。
+        イベントを seq で参照している古い形式のスナップショットなら、参照されたイベントも events に含めて渡す。
+        """
+        log = cls(ScoreLedger.from_snapshot(snapshot["ledger"]), undo_depth)
+        seq = snapshot["seq"]
+        referenced = {event.seq: event for event in events if event.seq <= seq}
+
+        def event_of(ref):
+            return referenced[ref] if isinstance(ref, int) else MonthEvent(**ref)
+
+        log.seq = log.snapshot_seq = seq
+        log._entries = {row: event_of(ref) for row, ref in snapshot["entries"]}
+        log._redo = [event_of(ref) for ref in snapshot["redo"]]
+        for event in events:
+            if event.seq <= seq:
+                continue
+            if event.seq != log.seq + 1:
+                raise ValueError(f"イベントが抜けています: {log.seq} の次が {event.seq} です")
+            log._apply(event)
+            log.events.append(event)
+            log.seq = event.seq
+        return log
@@ -1,21 +1,109 @@
 import streamlit as st
-import pages.setting as setting
-from ultralytics import YOLO
 import hashlib
-from functions import calculate_score_from_cards, calculate_points_from_detections, calculate_score_from_image, record_scores_callback, format_score
-from YOLO_model.YOLO_fanctions import delete_detection_callback
+import os
+from functions import current_rules, calculate_score_from_cards, calculate_points_from_detections, calculate_score_from_image, record_scores_callback, format_score, save_current_game, generate_unique_names, month_input_from_session
+from functions import hand_from_detections, propose_teyaku, select_teyaku_callback, tachi_candidates
+from functions import format_pile_yaku, prefill_dekiyaku, sync_capture_pile
+from functions import cancel_edit_callback, edit_month_callback, get_month_log, redo_month_callback, undo_month_callback
+from cards import DECK
+from scoring import MODE_MANUAL, ba_multiplier, card_points
+from YOLO_model.YOLO_fanctions import delete_detection_callback, remove_photo_callback
+from YOLO_model.detections import PhotoDetections
+from YOLO_model.live_scan import LiveScan, decode_frame, live_camera
+from YOLO_model.inference_queue import InferenceService
+from YOLO_model.thread_budget import get_inference_scheduler
+from YOLO_model.detection_cache import DetectionCache, cache_key, weights_version
+from YOLO_model.preprocess import InferenceProfile
+from YOLO_model.backends import BACKEND_WEIGHTS, configured_backend
+from YOLO_model.warmup import FAILED, get_model_warmer
+from tracing import get_tracer, new_trace_id
+from profiler import start_run
+
+DETECTOR_BACKEND = configured_backend()
+MODEL_PATH = BACKEND_WEIGHTS.get(DETECTOR_BACKEND, "")
+INFERENCE_PROFILE = InferenceProfile.from_env()
 
 st.markdown('<meta name="robots" content="noindex">', unsafe_allow_html=True)
+# ?profile=1 をつけたときだけ、ページ全体の再実行の所要時間を記録する
+profile = start_run("points")
 
 @st.cache_resource
-def load_yolo_model():
-    """YOLOモデルをロードし、キャッシュする関数"""
-    try:
-        model = YOLO('YOLO_model/best.pt') 
-        return model
-    except Exception as e:
-        st.error(f"モデルの読み込み中にエラーが発生しました: {e}")
+def start_inference_service(_yolo_models):
+    """全セッションで共有する、バッチ推論のサービスを起動する関数（同時に動かす推論の数とスレッド数は InferenceScheduler が決める）"""
+    return InferenceService(_yolo_models[0], scheduler=get_inference_scheduler(), tracer=get_tracer(), replicas=_yolo_models)
+
+def load_inference_service():
+    """YOLOモデルの準備ができていれば推論サービスを返し、準備中・失敗ならNoneを返す関数
+
+    モデルは「写真で自動入力」が選ばれたときに初めてバックグラウンドで読み込む
+    （HANAFUDA_DETECTOR_BACKEND で torch / onnx / onnx-int8 を選択）。
+    """
+    warmer = get_model_warmer()
+    warmer.start()
+    if not warmer.ready:
         return None
+    return start_inference_service(warmer.replicas or [warmer.model])
+
+def model_warming_notice(player):
+    """モデルの準備状況を表示する（失敗したときは定期的な再実行をやめて、読み込み直すボタンを出す）"""
+    warmer = get_model_warmer()
+    if warmer.state == FAILED:
+        st.error(f"モデルの読み込み中にエラーが発生しました: {warmer.error}")
+        st.button("モデルを読み込み直す", key=f"retry_model_{player}", on_click=warmer.retry)
+    else:
+        model_loading_notice()
+
+@st.fragment(run_every=2)
+def model_loading_notice():
+    """準備中と表示し、準備ができたか失敗したらページ全体を再実行するフラグメント"""
+    warmer = get_model_warmer()
+    if warmer.ready or warmer.state == FAILED:
+        st.rerun()
+    st.info("⏳ 認識モデルを準備中です。写真は先にアップロードしておけます。", icon="🔄")
+
+@st.fragment
+def live_scan_panel(player, model):
+    """カメラ映像を流したまま札を認識し、結果が安定したら確定するフラグメント
+
+    フレームが届くたびにこのフラグメントだけが再実行される。推論するかどうかは LiveScan が
+    フレームの差分と推論の上限回数（HANAFUDA_LIVE_MAX_RATE 回/秒）から決める。
+    """
+    scan_key = f'live_scan_{player}'
+    if st.session_state.get(scan_key) is None:
+        st.session_state[scan_key] = LiveScan.from_env()
+    scan = st.session_state[scan_key]
+
+    frame = live_camera(scan.sample_ms, INFERENCE_PROFILE.imgsz, paused=scan.locked or model is None,
+                        key=f'live_cam_{player}_{st.session_state.run_id}')
+    if frame and model is not None:
+        scan.offer(frame["frame"], frame["thumb"], lambda: calculate_score_from_image(
+            decode_frame(frame), model, profile=INFERENCE_PROFILE, trace_id=new_trace_id()
+        ), mount=frame.get("mount"))
+
+    if scan.detections is not None:
+        names = "、".join(scan.detections.names()) or "なし"
+        st.caption(f"認識中の札（{len(scan.detections)}枚）: {names}")
+    st.progress(min(scan.stable_count, scan.stable_frames) / scan.stable_frames,
+                text=f"安定: {min(scan.stable_count, scan.stable_frames)}/{scan.stable_frames}フレーム"
+                     f"（推論 {scan.stats['inferred']}回・使い回し {scan.stats['reused']}回・スキップ {scan.stats['skipped']}回）")
+
+    if scan.locked:
+        st.success("認識結果が安定しました。")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("この結果を写真として追加する", key=f"live_add_{player}", type="primary", use_container_width=True):
+                st.session_state[f'photos_{player}'].add(f"live-{new_trace_id()}", scan.detections, "camera")
+                scan.reset()
+                st.rerun()
+        with col2:
+            if st.button("もう一度スキャンする", key=f"live_retry_{player}", use_container_width=True):
+                scan.reset()
+                st.rerun(scope="fragment")
+
+@st.cache_resource
+def load_detection_cache():
+    """全セッションで共有する認識結果のキャッシュ（HANAFUDA_DETECTION_CACHE_DIR を指定するとディスクにも保存）"""
+    return DetectionCache(disk_dir=os.environ.get("HANAFUDA_DETECTION_CACHE_DIR"))
     
 if st.session_state.get("navigate_to_results", False):
     st.session_state.navigate_to_results = False
@@ -30,11 +118,10 @@ if not st.session_state.get('players'):
     st.warning("ゲームが設定されていません。メインメニューに戻ります。")
     st.switch_page("main.py")
 
-model = load_yolo_model()
+detection_cache = load_detection_cache()
 current_month = st.session_state.current_month
 
-scores_df = st.session_state.scores
-total_scores = scores_df.sum()
+ledger = st.session_state.scores
 
 hide_sidebar_style = """
     <style>
@@ -47,72 +134,125 @@ st.markdown(hide_sidebar_style, unsafe_allow_html=True)
 st.divider()
 
 # 現在の得点状況をダッシュボード風に表示
-st.subheader('現在のスコア')
-
-# 表示する列をプレイヤー数に合わせる
-num_players = len(st.session_state.players)
-if num_players >= 3:
-    # プレイヤーが4人以上の場合、2行に分割する
-    half_point = (num_players + 1) // 2 #切り上げで分割点を計算
-    row1_cols = st.columns(half_point)
-    row2_cols = st.columns(num_players - half_point)
-    cols = row1_cols + row2_cols # 2つの行の列を結合
-else:
-    # 3人以下の場合は1行で表示
-    cols = st.columns(num_players)
-score_unit = st.session_state.game_rules.get("score_unit", "貫/点")
-for i, player in enumerate(st.session_state.players):
-    with cols[i]:
-        total_score = total_scores.get(player, 0)
-        
-        # 前回の月から増えた点数（delta）を計算
-        last_score = 0
-        if not scores_df.empty:
-            last_score = scores_df.iloc[-1].get(player, 0)
-
-        st.metric(
-            label=f"👤 {player}",
-            value=format_score(total_score, score_unit),
-            delta=format_score(last_score, score_unit, delta_mode=True) if last_score != 0 else ""
-        )
+@st.fragment
+def scoreboard():
+    """現在のスコアを表示するフラグメント（得点が変わるのは記録時のページ全体の再実行だけ）"""
+    st.subheader('現在のスコア')
+
+    # 表示する列をプレイヤー数に合わせる
+    num_players = len(st.session_state.players)
+    if num_players >= 3:
+        # プレイヤーが4人以上の場合、2行に分割する
+        half_point = (num_players + 1) // 2 #切り上げで分割点を計算
+        row1_cols = st.columns(half_point)
+        row2_cols = st.columns(num_players - half_point)
+        cols = row1_cols + row2_cols # 2つの行の列を結合
+    else:
+        # 3人以下の場合は1行で表示
+        cols = st.columns(num_players)
+    score_unit = current_rules().score_unit
+    for i, player in enumerate(st.session_state.players):
+        with cols[i]:
+            total_score = ledger.total(player)
+            
+            # 前回の月から増えた点数（delta）
+            last_score = ledger.last_delta(player)
+
+            st.metric(
+                label=f"👤 {player}",
+                value=format_score(total_score, score_unit),
+                delta=format_score(last_score, score_unit, delta_mode=True) if last_score != 0 else ""
+            )
+
+with profile.section("scoreboard"):
+    scoreboard()
 st.divider()
 
-with st.expander("プレイヤーを途中参加させる"):
-    def add_player_callback():
-        if len(st.session_state.players) >= 7:
-            st.error("プレイヤーが上限の7人に達しているため、これ以上追加できません。")
-            return 
-        new_player_name = st.session_state.new_player_name_input
-        new_player_score = st.session_state.new_player_initial_score_input
-        if new_player_name:
-            # 現在のプレイヤー名と新しい名前を結合して、重複チェック
-            combined_names = st.session_state.players + [new_player_name]
-            unique_names = setting.generate_unique_names(combined_names)            
-            # 新しく追加されたプレイヤーのユニーク名を取得
-            added_player_unique_name = unique_names[-1]
-            # セッション情報を更新
-            st.session_state.players.append(added_player_unique_name)
-            st.session_state.scores[added_player_unique_name] = 0     
-            st.session_state.scores.iloc[0, st.session_state.scores.columns.get_loc(added_player_unique_name)] = new_player_score     
-            st.success(f"プレイヤー「{added_player_unique_name}」が参加しました！")
-            st.session_state.new_player_name_input = ""
-            if st.session_state.game_rules["game_name"] == "八八":
+@st.fragment
+def add_player_panel():
+    """プレイヤーの途中参加のフラグメント（追加したときだけページ全体を再実行する）"""
+    with st.expander("プレイヤーを途中参加させる"):
+        def add_player_callback():
+            if len(st.session_state.players) >= 7:
+                st.error("プレイヤーが上限の7人に達しているため、これ以上追加できません。")
+                return 
+            new_player_name = st.session_state.new_player_name_input
+            new_player_score = st.session_state.new_player_initial_score_input
+            if new_player_name:
+                # 現在のプレイヤー名と新しい名前を結合して、重複チェック
+                combined_names = st.session_state.players + [new_player_name]
+                unique_names = generate_unique_names(combined_names)            
+                # 新しく追加されたプレイヤーのユニーク名を取得
+                added_player_unique_name = unique_names[-1]
+                # セッション情報を更新
+                st.session_state.players.append(added_player_unique_name)
+                save_current_game([get_month_log().join(added_player_unique_name, new_player_score)])
+                st.session_state.player_added = added_player_unique_name
+                st.session_state.new_player_name_input = ""
+                if current_rules().game_name == "八八":
+                    st.session_state.new_player_initial_score_input = 60
+                else: st.session_state.new_player_initial_score_input = 0 # 初期値に戻す            
+            else:
+                st.warning("プレイヤー名を入力してください。")
+
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            if current_rules().game_name == "八八":
                 st.session_state.new_player_initial_score_input = 60
-            else: st.session_state.new_player_initial_score_input = 0 # 初期値に戻す            
-        else:
-            st.warning("プレイヤー名を入力してください。")
-
-    col1, col2 = st.columns([2, 1])
-    with col1:
-        if st.session_state.game_rules["game_name"] == "八八":
-            st.session_state.new_player_initial_score_input = 60
-        else: st.session_state.new_player_initial_score_input = 0
-        st.text_input("新しいプレイヤーの名前", key="new_player_name_input", placeholder="プレイヤー名")
-    with col2: 
-        score = st.number_input(f'初期得点{i+1}', key=f'new_player_initial_score_input', min_value=0, step=1, label_visibility="collapsed",value=st.session_state.new_player_initial_score_input)
-    st.button("このプレイヤーを追加する", on_click=add_player_callback)
-
-st.title(f'✍️ {current_month}月の得点入力')
+            else: st.session_state.new_player_initial_score_input = 0
+            st.text_input("新しいプレイヤーの名前", key="new_player_name_input", placeholder="プレイヤー名")
+        with col2: 
+            st.number_input('初期得点', key=f'new_player_initial_score_input', min_value=0, step=1, label_visibility="collapsed",value=st.session_state.new_player_initial_score_input)
+        st.button("このプレイヤーを追加する", on_click=add_player_callback)
+
+    # スコア表や入力欄にも新しいプレイヤーを出すため、ページ全体を再実行する
+    if st.session_state.get("player_added"):
+        st.session_state.joined_message = f"プレイヤー「{st.session_state.player_added}」が参加しました！"
+        st.session_state.player_added = None
+        st.rerun()
+
+with profile.section("add_player"):
+    add_player_panel()
+if st.session_state.get("joined_message"):
+    st.success(st.session_state.joined_message)
+    st.session_state.joined_message = None
+
+def month_log_panel():
+    """記録した月の取り消し・やり直し・修正の欄（どのボタンも得点表が変わるので、ページ全体を再実行する）"""
+    month_log = get_month_log()
+    editable_rows = month_log.editable_rows()
+    if not (month_log.can_undo or month_log.can_redo or editable_rows):
+        return
+    with st.expander("記録の取り消し・修正"):
+        col1, col2 = st.columns(2)
+        with col1:
+            last_label = ledger.label(len(ledger) - 1) if len(ledger) > 1 else ""
+            st.button(f"↩️ {last_label}の記録を取り消す" if month_log.can_undo else "↩️ 記録を取り消す",
+                      on_click=undo_month_callback, disabled=not month_log.can_undo, use_container_width=True)
+        with col2:
+            redo_entry = month_log.next_redo()
+            st.button(f"↪️ {redo_entry.label}の記録を元に戻す" if redo_entry else "↪️ 取り消した記録を元に戻す",
+                      on_click=redo_month_callback, disabled=redo_entry is None, use_container_width=True)
+        st.caption(f"取り消せるのは続けて{month_log.undo_depth}か月分までです。新しく記録すると、取り消した記録は元に戻せなくなります。")
+        if editable_rows:
+            c1, c2 = st.columns([2, 1])
+            with c1:
+                row = st.selectbox("修正する月", options=editable_rows, format_func=ledger.label, key='edit_month_row', label_visibility="collapsed")
+            with c2:
+                st.button("この月の入力を直す", on_click=edit_month_callback, args=(row,), use_container_width=True)
+
+with profile.section("month_log"):
+    month_log_panel()
+
+editing_month = st.session_state.get('editing_month')
+if editing_month and editing_month >= len(ledger):
+    editing_month = st.session_state.editing_month = None
+if editing_month:
+    st.title(f'✍️ {ledger.label(editing_month)}の記録を修正')
+    st.info(f"{ledger.label(editing_month)}の入力を読み込みました。直してから下のボタンで記録すると、{ledger.label(editing_month)}の得点と合計点だけが変わります。")
+    st.button("修正をやめて今月の入力に戻る", on_click=cancel_edit_callback)
+else:
+    st.title(f'✍️ {current_month}月の得点入力')
 # ジャンプ先の目印（アンカー）を設置
 st.markdown("<a id='top_anchor'></a>", unsafe_allow_html=True)
 if 'monthly_scores' not in st.session_state:
@@ -121,65 +261,138 @@ if 'monthly_scores' not in st.session_state:
 st.divider()
 st.subheader('今月の設定')
 
-# プレイヤーが4人以上の場合に「出る・降りる」選択を表示
-game_rules = st.session_state.game_rules
-num_players = len(st.session_state.players)
-active_players_options = st.session_state.players
-orita_players = [p for p in st.session_state.players if p not in st.session_state.get('active_players', [])]
-
-if num_players >= 4:
-    st.multiselect(
-        "今月勝負するプレイヤー（出る人）を選択",
-        options=st.session_state.players,
-        default=st.session_state.players,
-        key='active_players'
-    )
-    if len(st.session_state.active_players) < 2:
-        st.warning("最低でも2人は勝負に参加する必要があります。")
-    if game_rules.get("enable_orichin") or game_rules.get("enable_oikomi") or game_rules.get("enable_mizuten"):
-        with st.expander("下り賃・追い込み賃・みずてんの設定"):
-            # みずてん
-            if game_rules.get("enable_mizuten"):
-                st.selectbox("みずてんのプレイヤー", options=['なし'] + st.session_state.active_players, key='mizuten_player')
-                st.divider()
-
-            # 下り賃・追い込み賃
-            if orita_players:
-                st.write("**下りたプレイヤーの設定**")
-                cols = st.columns(len(orita_players))
-                for i, player in enumerate(orita_players):
-                    with cols[i]:
-                        st.write(f"**{player}**")
-                        if game_rules.get("enable_orichin"):
-                            st.number_input("下り賃", min_value=0, step=1, key=f'orichin_{player}')
-                        if game_rules.get("enable_oikomi"):
-                            st.number_input("追い込み賃", min_value=0, step=1, key=f'oikomichin_{player}')
-            else:
-                st.info("下りたプレイヤーがいないため、下り賃・追い込み賃の入力欄はありません。")
-elif num_players < 4 and 'active_players' not in st.session_state:
-    st.session_state.active_players = st.session_state.players
-
-if game_rules.get("zetsuba_oba", True):
-    ba_options = ("小場 (x1)", "大場 (x2)", "絶場 (x4)")
-    st.radio("場の状況", options=ba_options, key='ba_status', horizontal=True)
-
-# 倍率設定UI
-st.number_input("追加の倍率", min_value=1, step=1, key='custom_multiplier')
-ba_choice = st.session_state.get('ba_status', '小場 (x1)')
-ba_multiplier = 1
-if "大場" in ba_choice: ba_multiplier = 2
-if "絶場" in ba_choice: ba_multiplier = 4
+game_rules = current_rules()
+
+def month_dependencies():
+    """今月の設定のうち、ほかの入力欄に影響するもの（出る人と倍率）を session_state から読む"""
+    active_players = tuple(st.session_state.get('active_players', st.session_state.players))
+    multiplier = ba_multiplier(st.session_state.get('ba_status', '小場 (x1)'), game_rules.zetsuba_oba) * st.session_state.get('custom_multiplier', 1)
+    return active_players, multiplier
+
+@st.fragment
+def month_settings_panel(rendered_dependencies):
+    """今月の設定（出る人・下り賃・みずてん・場の状況・倍率）のフラグメント
+
+    下り賃などを変えてもこのフラグメントだけを再実行し、出る人か倍率が
+    rendered_dependencies（ページを描いたときの値）から変わったときだけページ全体を再実行する。
+    """
+    # プレイヤーが4人以上の場合に「出る・降りる」選択を表示
+    num_players = len(st.session_state.players)
+    orita_players = [p for p in st.session_state.players if p not in st.session_state.get('active_players', [])]
+
+    if num_players >= 4:
+        st.multiselect(
+            "今月勝負するプレイヤー（出る人）を選択",
+            options=st.session_state.players,
+            default=st.session_state.players,
+            key='active_players'
+        )
+        if len(st.session_state.active_players) < 2:
+            st.warning("最低でも2人は勝負に参加する必要があります。")
+        if game_rules.enable_orichin or game_rules.enable_oikomi or game_rules.enable_mizuten:
+            with st.expander("下り賃・追い込み賃・みずてんの設定"):
+                # みずてん
+                if game_rules.enable_mizuten:
+                    st.selectbox("みずてんのプレイヤー", options=['なし'] + st.session_state.active_players, key='mizuten_player')
+                    st.divider()
 
-custom_multiplier = st.session_state.get('custom_multiplier', 1)
-multiplier = ba_multiplier * custom_multiplier
+                # 下り賃・追い込み賃
+                if orita_players:
+                    st.write("**下りたプレイヤーの設定**")
+                    cols = st.columns(len(orita_players))
+                    for i, player in enumerate(orita_players):
+                        with cols[i]:
+                            st.write(f"**{player}**")
+                            if game_rules.enable_orichin:
+                                st.number_input("下り賃", min_value=0, step=1, key=f'orichin_{player}')
+                            if game_rules.enable_oikomi:
+                                st.number_input("追い込み賃", min_value=0, step=1, key=f'oikomichin_{player}')
+                else:
+                    st.info("下りたプレイヤーがいないため、下り賃・追い込み賃の入力欄はありません。")
+    elif num_players < 4 and 'active_players' not in st.session_state:
+        st.session_state.active_players = st.session_state.players
+
+    if game_rules.zetsuba_oba:
+        ba_options = ("小場 (x1)", "大場 (x2)", "絶場 (x4)")
+        st.radio("場の状況", options=ba_options, key='ba_status', horizontal=True)
+
+    # 倍率設定UI
+    st.number_input("追加の倍率", min_value=1, step=1, key='custom_multiplier')
+
+    if month_dependencies() != rendered_dependencies:
+        st.rerun()
+
+with profile.section("month_settings"):
+    month_settings_panel(month_dependencies())
+active_players_list, multiplier = month_dependencies()
+active_players_list = list(active_players_list)
 
 st.divider()
 st.subheader('今回の得点を入力')
 # ---手役の処理 ---
-with st.expander("手役が成立した場合"):
+def card_label(index):
+    return DECK[index].label
+
+def hand_teyaku_panel(player):
+    """配られた手札（7枚）を選ぶか写真から読み取り、成立する手役を提案する"""
+    hand_key = f'hand_cards_{player}'
+    photo = st.file_uploader("手札の写真", key=f'hand_photo_{player}_{st.session_state.run_id}', type=['jpg', 'jpeg', 'png'])
+    if photo is not None:
+        photo_hash = hashlib.md5(photo.getvalue()).hexdigest()
+        # 同じ写真なら、手札を手で直したあとに読み取り直さない
+        if st.session_state.get(f'hand_photo_hash_{player}') != photo_hash:
+            model = load_inference_service()
+            if model is None:
+                st.info("⏳ 認識モデルを準備中です。少し待ってからもう一度開いてください。")
+            else:
+                photo_cache_key = cache_key(photo_hash, weights_version(MODEL_PATH), INFERENCE_PROFILE.cache_token())
+                detections = calculate_score_from_image(photo, model, detection_cache, photo_cache_key, INFERENCE_PROFILE, new_trace_id())
+                if detections is not None:
+                    hand, unmatched = hand_from_detections(detections)
+                    st.session_state[hand_key] = hand[:7]
+                    st.session_state[f'hand_photo_hash_{player}'] = photo_hash
+                    if unmatched or len(hand) != 7:
+                        st.warning(f"{len(hand)}枚を読み取りました。手札が7枚になるように直してください。")
+
+    hand = st.multiselect("手札（7枚）", options=range(len(DECK)), format_func=card_label, max_selections=7, key=hand_key)
+    if len(hand) < 7:
+        st.caption(f"手札を7枚選ぶと、成立する手役を判定します（{len(hand)}/7枚）")
+        return
+    field_options = tachi_candidates(hand)
+    field = []
+    if field_options:
+        field = st.multiselect("場にある札（立三本の判定に使います）", options=field_options, format_func=card_label, key=f'hand_field_{player}')
+    proposal = propose_teyaku(hand, field, game_rules)
+    if proposal:
+        st.success(f"成立する手役: {'・'.join(proposal)}")
+        st.button("この手役を選択する", key=f'apply_teyaku_{player}', on_click=select_teyaku_callback, args=(player, proposal))
+    else:
+        st.info("成立する手役はありません。")
+
+@st.fragment
+def teyaku_selector(player):
+    """1人分の手役の選択欄のフラグメント"""
+    selected_teyaku = st.multiselect(
+        f"**{player}**さんの手役",
+        options=game_rules.active_teyaku,
+        key=f'teyaku_selection_{player}' 
+    )
+    if game_rules.active_teyaku:
+        with st.popover("手札から判定", use_container_width=True):
+            hand_teyaku_panel(player)
+    tobikomi_yaku = {"三本", "立三本"}
+    nukeyaku_yaku = {"赤", "短一", "十一", "空素"}
+
+    # setを使って選択された役と条件役の共通部分があるかチェック
+    if not tobikomi_yaku.isdisjoint(selected_teyaku):
+        st.checkbox("飛び込み (+12点)", key=f"tobikomi_{player}")
+    
+    if not nukeyaku_yaku.isdisjoint(selected_teyaku):
+        st.checkbox("抜け役 (+12点)", key=f"nukeyaku_{player}")
+
+with st.expander("手役が成立した場合"), profile.section("teyaku"):
     # 勝負しているプレイヤー全員分の入力欄を作成
-    display_players = st.session_state.get('active_players', st.session_state.players)
-    active_teyaku = [name for name, data in st.session_state.game_rules['teyaku'].items() if data['active']]
+    display_players = active_players_list
     
     # プレイヤーの人数に応じて列を分割
     num_display_players = len(display_players)
@@ -187,157 +400,195 @@ with st.expander("手役が成立した場合"):
         cols = st.columns(num_display_players)
         for i, player in enumerate(display_players):
             with cols[i]:
-                selected_teyaku = st.multiselect(
-                    f"**{player}**さんの手役",
-                    options=active_teyaku,
-                    key=f'teyaku_selection_{player}' 
-                )
-                tobikomi_yaku = {"三本", "立三本"}
-                nukeyaku_yaku = {"赤", "短一", "十一", "空素"}
-
-                # setを使って選択された役と条件役の共通部分があるかチェック
-                if not tobikomi_yaku.isdisjoint(selected_teyaku):
-                    st.checkbox("飛び込み (+12点)", key=f"tobikomi_{player}")
-                
-                if not nukeyaku_yaku.isdisjoint(selected_teyaku):
-                    st.checkbox("抜け役 (+12点)", key=f"nukeyaku_{player}")
+                teyaku_selector(player)
 
 outcome_options = ("役なし（取り札勝負）", "出来役あり", "特殊役あり")
 st.radio("今月の勝負の決まり方を選択", options=outcome_options, key='outcome_type', horizontal=True)
 outcome_type = st.session_state.outcome_type
 
-active_players_list = st.session_state.get('active_players', st.session_state.players)
-base_scores = {}
-base_score = 0
-
-if outcome_type == "役なし（取り札勝負）":
-    for player in active_players_list:
-        st.subheader(f'"{player}" さんの入力欄')
-        mode_options = ("取り札入力", "得点入力", "写真で自動入力")
-        mode = st.selectbox("入力モード", options=mode_options, key=f'mode_select_{player}')
-        st.session_state.input_modes[player] = mode
-        if mode == "得点入力":
-            st.number_input("獲得点数", step=1,min_value=0, key=f'manual_score_{player}', label_visibility="collapsed")
-            base_scores[player] = st.session_state[f'manual_score_{player}']
-        elif mode == "取り札入力":
-            c1, c2, c3, c4 = st.columns(4)
-            with c1: brights = st.number_input("光札", min_value=0, key=f'brights_{player}')
-            with c2: animals = st.number_input("タネ", min_value=0, key=f'animals_{player}')
-            with c3: ribbons = st.number_input("短冊", min_value=0, key=f'ribbons_{player}')
-            with c4: chaff = st.number_input("カス", min_value=0, key=f'chaff_{player}')
-            
-            # 倍率を反映した計算結果を表示
-            base_score = calculate_score_from_cards(brights, animals, ribbons, chaff)
-            final_score = base_score * multiplier
-            st.info(f"計算結果: {base_score}点 × {multiplier}倍 = **{final_score}点**")
-            base_scores[player] = base_score
-
-        elif mode == "写真で自動入力":
-            detections_key = f'detections_{player}'
-            last_photo_hash_key = f'last_photo_hash_{player}'
-            tab1, tab2 = st.tabs(["ファイルからアップロード", "カメラで撮影"])
-            with tab1:
-                uploaded_file = st.file_uploader("写真をアップロード", key=f'uploader_{player}_{st.session_state.run_id}', type=['jpg', 'jpeg', 'png'])
-            with tab2:
-                camera_file = st.camera_input("カメラで撮影", key=f'cam_input_{player}_{st.session_state.run_id}')
-            
-            image_buffer = uploaded_file or camera_file
-
-            is_new_photo = False
-            if image_buffer:
-                # アップロードされたファイルの中身を読み取り、ハッシュ値を計算
-                file_bytes = image_buffer.getvalue()
-                current_photo_hash = hashlib.md5(file_bytes).hexdigest()
-                # 保存されている前回のハッシュ値と比較
-                if st.session_state.get(last_photo_hash_key) != current_photo_hash:
-                    is_new_photo = True
-            
-            # 新しい画像の場合のみ、YOLOの認識処理を実行
-            if is_new_photo:
-                with st.spinner('画像を認識中...'):
-                    st.session_state[detections_key] = calculate_score_from_image(image_buffer, model)
-                    # 処理済みの画像のハッシュ値を保存
-                    st.session_state[last_photo_hash_key] = current_photo_hash
-
-            # 写真がクリアされた場合、関連する状態をリセット
-            if not image_buffer and st.session_state.get(detections_key):
-                st.session_state[detections_key] = []
-                st.session_state[last_photo_hash_key] = None
-                st.rerun()
-
-            # 認識結果をエキスパンダーの中に表示
-            if st.session_state.get(detections_key):
-                with st.expander("認識されたカード一覧（クリックで表示/非表示）"):
-                    c1, c2, c3 = st.columns([3, 2, 1])
-                    c1.write("**札の名前**")
-                    c2.write("**信頼度**")
-                    sorted_detections = sorted(st.session_state[detections_key], key=lambda x: x['conf'], reverse=True)
-                    
-                    if not sorted_detections:
-                        st.write("カードがありません。")
-
-                    for i, detection in enumerate(sorted_detections):
-                        col1, col2, col3 = st.columns([3, 2, 1])
-                        with col1: st.text(detection['name'])
-                        with col2: st.progress(detection['conf'], text=f"{detection['conf']:.0%}")
-                        with col3: st.button("削除", key=f"del_{player}_{i}", on_click=delete_detection_callback, args=(detections_key, i))
-                    st.divider()
+def card_total_warning():
+    """八八で参加プレイヤーの取り札の合計が264点にならないときの警告（session_state から計算する）"""
+    if game_rules.game_name != '八八':
+        return None
+    month = month_input_from_session()
+    total_base_score = 0
+    for player in month.active_players:
+        player_input = month.inputs[player]
+        if player_input.mode == MODE_MANUAL:
+            total_base_score += player_input.manual_score
+        else:
+            total_base_score += card_points(game_rules.card_scores, player_input.brights, player_input.animals, player_input.ribbons, player_input.chaff)
+    if total_base_score != 264 and total_base_score != 0:
+        return f"警告: 参加プレイヤーの合計点が264点になりません (現在: {total_base_score}点)"
+    return None
+
+def photo_input_panel(player, multiplier):
+    """写真から取り札を認識する入力欄（アップロード・カメラ・ライブスキャン・認識結果の一覧）"""
+    detections_key = f'detections_{player}'
+    photos_key = f'photos_{player}'
+    if st.session_state.get(photos_key) is None:
+        st.session_state[photos_key] = PhotoDetections()
+    photo_set = st.session_state[photos_key]
+    model = load_inference_service()
+    if model is None:
+        model_warming_notice(player)
+    tab1, tab2, tab3 = st.tabs(["ファイルからアップロード", "カメラで撮影", "ライブスキャン"])
+    with tab1:
+        uploaded_files = st.file_uploader("写真をアップロード（複数枚に分けて撮った場合はまとめて選択）", key=f'uploader_{player}_{st.session_state.run_id}', type=['jpg', 'jpeg', 'png'], accept_multiple_files=True)
+    with tab2:
+        camera_file = st.camera_input("カメラで撮影（撮るたびに写真が追加されます）", key=f'cam_input_{player}_{st.session_state.run_id}')
+    with tab3:
+        live_scan_panel(player, model)
+
+    # アップロード・撮影された写真の中身を読み取り、ハッシュ値を計算
+    current_photos = {}
+    for source, image_buffer in [("upload", f) for f in uploaded_files or []] + ([("camera", camera_file)] if camera_file else []):
+        trace_id = new_trace_id()
+        with get_tracer().span("getvalue", trace_id) as span:
+            file_bytes = image_buffer.getvalue()
+            span["bytes"] = len(file_bytes)
+        with get_tracer().span("md5", trace_id):
+            photo_hash = hashlib.md5(file_bytes).hexdigest()
+        current_photos[photo_hash] = (source, image_buffer, trace_id)
+
+    # アップロード欄から外された写真の分だけ取り除く（カメラの写真は一覧の削除ボタンで外す）
+    for photo_hash in [h for h, source in photo_set.sources.items() if source == "upload" and h not in current_photos]:
+        photo_set.remove(photo_hash)
+
+    # 新しい写真だけYOLOで認識する（モデルの準備中は準備ができてから）
+    new_photos = {h: v for h, v in current_photos.items() if h not in photo_set}
+    if new_photos and model is not None:
+        with st.spinner(f'画像を認識中...（{len(new_photos)}枚）'):
+            for photo_hash, (source, image_buffer, trace_id) in new_photos.items():
+                photo_cache_key = cache_key(photo_hash, weights_version(MODEL_PATH), INFERENCE_PROFILE.cache_token())
+                photo_set.add(photo_hash, calculate_score_from_image(image_buffer, model, detection_cache, photo_cache_key, INFERENCE_PROFILE, trace_id), source)
+    st.session_state[detections_key] = photo_set.merged()
+    pile = sync_capture_pile(player, game_rules)
+
+    # 認識済みの写真の一覧
+    if len(photo_set.sources) > 1 or any(source == "camera" for source in photo_set.sources.values()):
+        for n, (photo_hash, source) in enumerate(list(photo_set.sources.items()), start=1):
+            col1, col2 = st.columns([5, 1])
+            photo_detections = photo_set.photos.get(photo_hash)
+            status = f"{len(photo_detections)}枚を認識" if photo_detections is not None else "認識に失敗"
+            with col1: st.caption(f"写真{n}（{'カメラ' if source == 'camera' else 'アップロード'}）: {status}")
+            with col2: st.button("外す", key=f"remove_photo_{player}_{photo_hash}", on_click=remove_photo_callback, args=(photos_key, detections_key, photo_hash))
+
+    # 認識結果をエキスパンダーの中に表示
+    if st.session_state.get(detections_key):
+        with st.expander("認識されたカード一覧（クリックで表示/非表示）"):
+            c1, c2, c3 = st.columns([3, 2, 1])
+            c1.write("**札の名前**")
+            c2.write("**信頼度**")
+            detections = st.session_state[detections_key]
+            card_names = detections.names()
+
+            # 信頼度の高い順に表示し、削除ボタンには元の並びでの番号を渡す
+            for i in detections.order_by_conf().tolist():
+                conf = float(detections.confs[i])
+                col1, col2, col3 = st.columns([3, 2, 1])
+                with col1: st.text(card_names[i])
+                with col2: st.progress(conf, text=f"{conf:.0%}")
+                with col3: st.button("削除", key=f"del_{player}_{i}", on_click=delete_detection_callback, args=(detections_key, i, photos_key, f'pile_{player}'))
+            st.divider()
+
+        # リアルタイムでスコアを再計算して表示
+        base_score = calculate_points_from_detections(st.session_state[detections_key], game_rules)
+        final_score = base_score * multiplier
+        st.success(f"認識結果: {base_score}点 × {multiplier}倍 = **{final_score}点**")
+        if pile is not None and pile.yaku:
+            st.info(f"取り札から成立する出来役: {format_pile_yaku(pile, game_rules)}")
+        cache_stats = detection_cache.stats()
+        st.caption(f"認識キャッシュ: ヒット {cache_stats['hits'] + cache_stats['disk_hits']}回 / ミス {cache_stats['misses']}回")
+
+@st.fragment
+def player_input_panel(player, multiplier, rendered_warning):
+    """1人分の取り札・得点・写真の入力欄のフラグメント
+
+    入力を変えてもこのプレイヤーの欄だけを再実行する。合計点の警告
+    （rendered_warning はページを描いたときの内容）が変わったときだけページ全体を再実行する。
+    """
+    st.subheader(f'"{player}" さんの入力欄')
+    mode_options = ("取り札入力", "得点入力", "写真で自動入力")
+    mode = st.selectbox("入力モード", options=mode_options, key=f'mode_select_{player}')
+    st.session_state.input_modes[player] = mode
+    if mode == "得点入力":
+        st.number_input("獲得点数", step=1,min_value=0, key=f'manual_score_{player}', label_visibility="collapsed")
+    elif mode == "取り札入力":
+        c1, c2, c3, c4 = st.columns(4)
+        with c1: brights = st.number_input("光札", min_value=0, key=f'brights_{player}')
+        with c2: animals = st.number_input("タネ", min_value=0, key=f'animals_{player}')
+        with c3: ribbons = st.number_input("短冊", min_value=0, key=f'ribbons_{player}')
+        with c4: chaff = st.number_input("カス", min_value=0, key=f'chaff_{player}')
+        
+        # 倍率を反映した計算結果を表示
+        base_score = calculate_score_from_cards(brights, animals, ribbons, chaff)
+        final_score = base_score * multiplier
+        st.info(f"計算結果: {base_score}点 × {multiplier}倍 = **{final_score}点**")
 
-                # リアルタイムでスコアを再計算して表示
-                current_detected_names = [d['name'] for d in st.session_state[detections_key]]
-                base_score = calculate_points_from_detections(current_detected_names, game_rules)
-                final_score = base_score * multiplier
-                st.success(f"認識結果: {base_score}点 × {multiplier}倍 = **{final_score}点**")
-            
-            # 写真がクリアされた場合、関連する状態をリセット
-            if not image_buffer and st.session_state.get(detections_key):
-                st.session_state[detections_key] = []
-                st.session_state[last_photo_hash_key] = None
-                st.rerun()
+    elif mode == "写真で自動入力":
+        photo_input_panel(player, multiplier)
 
-            base_scores[player] = base_score
+    if card_total_warning() != rendered_warning:
+        st.rerun()
 
-    if game_rules.get('game_name') == '八八':
-        total_base_score = sum(base_scores.values())
-        if total_base_score != 264 and total_base_score != 0:
-            warning_message = f"警告: 参加プレイヤーの合計点が264点になりません (現在: {total_base_score}点)"
+if outcome_type == "役なし（取り札勝負）":
+    warning_message = card_total_warning()
+    with profile.section("player_inputs"):
+        for player in active_players_list:
+            player_input_panel(player, multiplier, warning_message)
 
 elif outcome_type == "出来役あり":
-    st.selectbox("勝者", options=['なし'] + active_players_list, key='dekiyaku_winner')
-    active_dekiyaku = [name for name, data in st.session_state.game_rules['dekiyaku'].items() if data['active']]
-    selected_yaku = st.multiselect("成立した出来役", options=active_dekiyaku, key='dekiyaku_selection')
-    if selected_yaku: 
-        game_rules = st.session_state.game_rules
-        st.markdown("###### 追加点の入力")
-        for yaku in selected_yaku:
-            # 役のデータに 'is_variable': True が設定されているかチェック
-            if game_rules['dekiyaku'][yaku].get('is_variable', False):
-                yaku_data = game_rules['dekiyaku'][yaku]
-                st.number_input(
-                    label=f"「{yaku}」の追加{yaku_data.get('item_unit', '枚')}", 
-                    min_value=0, 
-                    step=1, 
-                    key=f"dekiyaku_extra_{yaku}" # ユニークなキー
-                )    
-    # 選択された役の中に法度適用役があるかチェック
-    is_hatto_round = any(st.session_state.game_rules['dekiyaku'][yaku].get('hatto_applicable', False) for yaku in selected_yaku)
-    if is_hatto_round:
-        winner = st.session_state.get('dekiyaku_winner', 'なし')
-        losers = [p for p in active_players_list if p != winner]
-        st.multiselect("法度(ハット)を犯したプレイヤーを選択", options=losers, key='hatto_players')
-
+    @st.fragment
+    def dekiyaku_selector(active_players_list):
+        """出来役の勝者・役・追加点・法度の選択欄のフラグメント"""
+        winner = st.selectbox("勝者", options=['なし'] + active_players_list, key='dekiyaku_winner')
+        if winner != 'なし':
+            # 勝者の取り札の写真から出来役を判定し、選択欄と追加点に入れる（取り札が変わったときだけ入れ直す）
+            with st.expander(f"{winner}さんの取り札を写真から読み取る"):
+                photo_input_panel(winner, month_dependencies()[1])
+            if prefill_dekiyaku(winner, game_rules) is not None:
+                st.caption("写真の取り札から判定した出来役を入力しました。違う場合は直してください。")
+        selected_yaku = st.multiselect("成立した出来役", options=game_rules.active_dekiyaku, key='dekiyaku_selection')
+        if selected_yaku: 
+            st.markdown("###### 追加点の入力")
+            for yaku in selected_yaku:
+                # 追加点を入力する役（is_variable）かチェック
+                if yaku in game_rules.variable_yaku['dekiyaku']:
+                    yaku_data = game_rules.yaku('dekiyaku')[yaku]
+                    st.number_input(
+                        label=f"「{yaku}」の追加{yaku_data.item_unit or '枚'}", 
+                        min_value=0, 
+                        step=1, 
+                        key=f"dekiyaku_extra_{yaku}" # ユニークなキー
+                    )    
+        # 選択された役の中に法度適用役があるかチェック
+        is_hatto_round = not game_rules.hatto_yaku.isdisjoint(selected_yaku)
+        if is_hatto_round:
+            winner = st.session_state.get('dekiyaku_winner', 'なし')
+            losers = [p for p in active_players_list if p != winner]
+            st.multiselect("法度(ハット)を犯したプレイヤーを選択", options=losers, key='hatto_players')
+
+    with profile.section("dekiyaku"):
+        dekiyaku_selector(active_players_list)
 
 elif outcome_type == "特殊役あり":
-    st.selectbox("勝者", options=['なし'] + active_players_list, key='special_yaku_winner')
-    active_special_yaku = [name for name, data in st.session_state.game_rules['special_yaku'].items() if data['active']]
-    st.multiselect("成立した特殊な役", options=active_special_yaku, key='special_yaku_selection')
-    st.info("※特殊役が成立した場合、手役の点数は無効になります。")
+    @st.fragment
+    def special_yaku_selector(active_players_list):
+        """特殊役の勝者・役の選択欄のフラグメント"""
+        st.selectbox("勝者", options=['なし'] + active_players_list, key='special_yaku_winner')
+        st.multiselect("成立した特殊な役", options=game_rules.active_special_yaku, key='special_yaku_selection')
+        st.info("※特殊役が成立した場合、手役の点数は無効になります。")
+
+    with profile.section("special_yaku"):
+        special_yaku_selector(active_players_list)
 
 active_players_list = st.session_state.get('active_players', st.session_state.get('players', []))
 is_button_disabled = len(active_players_list) < 2
 
 # --- 記録ボタンにコールバック関数を指定 ---
-st.button(f'{st.session_state.current_month}月の得点を記録する', type="primary", use_container_width=True, on_click=record_scores_callback,disabled=is_button_disabled)
+record_label = f'{ledger.label(editing_month)}の記録を修正する' if editing_month else f'{st.session_state.current_month}月の得点を記録する'
+st.button(record_label, type="primary", use_container_width=True, on_click=record_scores_callback,disabled=is_button_disabled)
 if st.session_state.get("success_message"):
     st.success(st.session_state.success_message, icon="✅")
     st.session_state.success_message = None # 一度表示したら消す
@@ -351,6 +602,29 @@ if st.session_state.get("form_error"):
 if warning_message:
     st.warning(warning_message)
 
+# --- 写真認識のトレース（URLに ?debug=1 をつけたときだけ表示） ---
+if st.query_params.get("debug") == "1":
+    with st.expander("🔧 写真認識の処理時間（デバッグ）"):
+        stage_stats = get_tracer().percentiles()
+        if not stage_stats:
+            st.write("まだ記録がありません。")
+        else:
+            st.write("**区間ごとの処理時間（直近の記録、ミリ秒）**")
+            st.dataframe(
+                [{"区間": stage, "件数": s["count"], "p50": round(s["p50"], 1), "p95": round(s["p95"], 1), "p99": round(s["p99"], 1)}
+                 for stage, s in stage_stats.items()],
+                hide_index=True, use_container_width=True
+            )
+            scheduler_stats = get_inference_scheduler().stats()
+            if scheduler_stats["runs"]:
+                st.caption(
+                    f"推論スロット: {scheduler_stats['mode']}（{scheduler_stats['threads']}スレッド）/ "
+                    f"平均の待ち {scheduler_stats['avg_wait'] * 1000:.1f} ms / 平均の計算 {scheduler_stats['avg_compute'] * 1000:.1f} ms / "
+                    f"切り替え {scheduler_stats['switches']}回"
+                )
+            st.write("**直近の記録**")
+            st.dataframe(get_tracer().recent(30), hide_index=True, use_container_width=True)
+
 # --- ページ下部のナビゲーション ---
 st.divider()
 c1, c2 = st.columns(2)
@@ -360,3 +634,5 @@ with c1:
 with c2:
     if st.button('ゲームを終了してリザルトへ', type="secondary", use_container_width=True):
         st.switch_page("pages/result.py")
+
+profile.finish()
@@ -1,8 +1,13 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+from ledger import ScoreLedger
+from functions import current_rules, start_saved_game
+from profiler import start_run
 
 st.markdown('<meta name="robots" content="noindex">', unsafe_allow_html=True)
+# ?profile=1 をつけたときだけ、ページ全体の再実行の所要時間を記録する
+profile = start_run("result")
 
 # サイドバー非表示CSS
 hide_sidebar_style = """
@@ -23,8 +28,9 @@ st.title('🏆 最終結果')
 st.balloons()
 
 # --- スコア計算 ---
-scores_df = st.session_state.scores
-total_scores = scores_df.sum().sort_values(ascending=False)
+ledger = st.session_state.scores
+scores_df = ledger.to_frame()
+total_scores = pd.Series(ledger.totals()).sort_values(ascending=False)
 winner_name = total_scores.idxmax()
 winner_score = total_scores.max()
 
@@ -52,12 +58,13 @@ bar_fig = px.bar(
     color_discrete_map=player_color_map, 
     labels={'Player': 'プレイヤー', 'Score': '合計点'}
 )
-st.plotly_chart(bar_fig, use_container_width=True)
+with profile.section("bar_chart"):
+    st.plotly_chart(bar_fig, use_container_width=True)
 
 # --- 各月の得点詳細のグラフをPlotlyで描画 ---
 st.subheader('各月の得点詳細')
 tab1, tab2 = st.tabs(["折れ線グラフ",  "シンプル表"])
-with tab1:
+with tab1, profile.section("line_chart"):
     st.write("各プレイヤーの累計得点の推移を表示します。")
     if not scores_df.empty:
         cumulative_scores_df = scores_df.astype(float).cumsum()
@@ -77,14 +84,13 @@ with tab1:
         st.plotly_chart(line_fig, use_container_width=True)
     else:
         st.write("スコアデータがありません。")
-with tab2:
+with tab2, profile.section("table"):
     # シンプルな表: スクロールなしで全体表示
     if not scores_df.empty:
         table_df = scores_df.copy()
         new_index = ['初期値'] + [f'{i}月' for i in range(1, len(table_df))]
         table_df.index = new_index        
-        total_scores_row = table_df.sum().to_dict()
-        table_df.loc['合計点'] = total_scores_row
+        table_df.loc['合計点'] = ledger.totals()
         st.table(table_df)
     else:
         st.write("スコアデータがありません。")
@@ -95,8 +101,7 @@ if not scores_df.empty:
     new_index_csv = ['初期値'] + [f'{i}月' for i in range(1, len(csv_table_df))]
     csv_table_df.index = new_index_csv
 
-    total_scores_row = csv_table_df.sum().to_dict()
-    csv_table_df.loc['合計点'] = total_scores_row
+    csv_table_df.loc['合計点'] = ledger.totals()
     csv_data = csv_table_df.to_csv(index_label='プレイヤー').encode('utf-8-sig')
 
     st.download_button(
@@ -121,22 +126,24 @@ with col1:
         unique_player_names = st.session_state.players
         
         # ゲーム名が八八の場合は初期値を60、それ以外は0
-        initial_score_value = 60 if st.session_state.game_rules["game_name"] == "八八" else 0
+        initial_score_value = 60 if current_rules().game_name == "八八" else 0
         
         initial_scores = {player: initial_score_value for player in unique_player_names}
-        st.session_state.scores = pd.DataFrame([initial_scores])
+        st.session_state.scores = ScoreLedger(initial_scores)
 
         st.session_state.current_month = 1
         st.session_state.input_modes = {}
         st.session_state.navigate_to_results = False
+        start_saved_game()
 
         st.switch_page("pages/points.py")
 with col2:
     # ---「ルール設定に戻る」ボタン---
     if st.button('⚙️ ルール設定に戻る', use_container_width=True):
         # ゲーム設定は維持し、スコアのみ初期化
-        st.session_state.scores = pd.DataFrame()
+        st.session_state.scores = ScoreLedger()
         st.session_state.players = []
+        st.session_state.game_id = None
         st.session_state.current_month = 1
         st.session_state.input_modes = {}
         st.session_state.navigate_to_results = False
@@ -151,3 +158,5 @@ with col3:
             del st.session_state[key]
 
         st.switch_page("main.py")
+
+profile.finish()
@@ -1,9 +1,14 @@
 import streamlit as st
-import pandas as pd
-from functions import create_yaku_editor, generate_unique_names, load_preset
-from rules import DEFAULT_KOIKOI_RULES
+from functions import (
+    create_yaku_editor, current_rules, generate_unique_names, load_preset, show_simulation_summary, start_saved_game,
+)
+from rule_sets import PRESETS, RuleOverlay
+from ledger import ScoreLedger
+from profiler import start_run
 
 st.markdown('<meta name="robots" content="noindex">', unsafe_allow_html=True)
+# ?profile=1 をつけたときだけ、ページ全体の再実行の所要時間を記録する
+profile = start_run("setting")
 
 hide_sidebar_style = """
     <style>
@@ -18,7 +23,7 @@ st.markdown(hide_sidebar_style, unsafe_allow_html=True)
 st.title('⚙️ ゲーム設定')
 
 if 'game_rules' not in st.session_state:
-    st.session_state.game_rules = DEFAULT_KOIKOI_RULES.copy()
+    st.session_state.game_rules = RuleOverlay(PRESETS['こいこい'])
 
 # --- プリセット選択 ---
 st.subheader('プリセット')
@@ -35,35 +40,49 @@ with st.expander("ルールの編集", expanded=True):
         "基本ルール", "札の点数", "出来役の設定", "手役の設定", "特殊役の設定"
     ])
 
-    with tab_basic:
-        st.session_state.game_rules["score_unit"] = st.radio(
+    # ルールの変更は共有のプリセットを書き換えず、このセッションの RuleOverlay にだけ記録する
+    overlay = st.session_state.game_rules
+    rules = overlay.compiled
+    with tab_basic, profile.section("basic_rules"):
+        overlay.set(("score_unit",), st.radio(
             "点数表示の単位", 
             ("貫/点", "文"),
-            index=("貫/点", "文").index(st.session_state.game_rules.get("score_unit", "貫/点")),
+            index=("貫/点", "文").index(rules.score_unit),
             horizontal=True
-        )        
-        st.session_state.game_rules["zetsuba_oba"] = st.toggle(
+        ))
+        overlay.set(("zetsuba_oba",), st.toggle(
             "絶場・大場を有効にする", 
-            value=st.session_state.game_rules["zetsuba_oba"]
-        )
-        st.session_state.game_rules["enable_orichin"] = st.toggle("下り賃を有効にする", value=st.session_state.game_rules.get("enable_orichin", True))
-        st.session_state.game_rules["enable_oikomi"] = st.toggle("追い込み賃を有効にする", value=st.session_state.game_rules.get("enable_oikomi", True))
-        st.session_state.game_rules["enable_mizuten"] = st.toggle("みずてんを有効にする", value=st.session_state.game_rules.get("enable_mizuten", True))
-    with tab_cards:
-        scores = st.session_state.game_rules["card_scores"]
+            value=rules.zetsuba_oba
+        ))
+        overlay.set(("enable_orichin",), st.toggle("下り賃を有効にする", value=rules.enable_orichin))
+        overlay.set(("enable_oikomi",), st.toggle("追い込み賃を有効にする", value=rules.enable_oikomi))
+        overlay.set(("enable_mizuten",), st.toggle("みずてんを有効にする", value=rules.enable_mizuten))
+    with tab_cards, profile.section("card_scores"):
         st.write("各種別の札の基本点を設定します。")
         c1, c2, c3, c4 = st.columns(4)
-        with c1: scores["光"] = st.number_input("光札", value=scores["光"])
-        with c2: scores["タネ"] = st.number_input("タネ", value=scores["タネ"])
-        with c3: scores["短冊"] = st.number_input("短冊", value=scores["短冊"])
-        with c4: scores["カス"] = st.number_input("カス", value=scores["カス"])
-    with tab_dekiyaku:
+        with c1: overlay.set(("card_scores", "光"), st.number_input("光札", value=rules.card_score("光")))
+        with c2: overlay.set(("card_scores", "タネ"), st.number_input("タネ", value=rules.card_score("タネ")))
+        with c3: overlay.set(("card_scores", "短冊"), st.number_input("短冊", value=rules.card_score("短冊")))
+        with c4: overlay.set(("card_scores", "カス"), st.number_input("カス", value=rules.card_score("カス")))
+    with tab_dekiyaku, profile.section("dekiyaku_editor"):
         create_yaku_editor("出来役", "dekiyaku")
-    with tab_teyaku:
+    with tab_teyaku, profile.section("teyaku_editor"):
         create_yaku_editor("手役", "teyaku")
-    with tab_special:
+    with tab_special, profile.section("special_yaku_editor"):
         create_yaku_editor("特殊な役", "special_yaku")
 
+# --- ルールのシミュレーション ---
+with st.expander("このルールの期待値をシミュレーションする"), profile.section("simulation"):
+    st.write("配りと打ち（取れる札が最も高い手を出す打ち方）を繰り返して、席ごと・役ごとの1か月あたりの期待値と分散を推定します。")
+    c1, c2 = st.columns(2)
+    with c1: sim_months = st.number_input("月数", min_value=1000, max_value=200000, value=20000, step=1000)
+    with c2: sim_seed = st.number_input("乱数のシード", min_value=0, value=0, step=1)
+    if st.button("シミュレーションを実行"):
+        st.session_state.simulation_params = (int(sim_months), int(sim_seed))
+    if "simulation_params" in st.session_state:
+        show_simulation_summary(current_rules(), *st.session_state.simulation_params)
+    st.caption("数百万か月分は python simulator.py --rules 八八 --months 1000000 で、全コアを使って計算できます。")
+
 st.divider()
 
 # --- プレイヤー情報入力とゲーム開始 ---
@@ -84,7 +103,7 @@ for i in range(num_players):
         name = st.text_input(f'プレイヤー{i+1}の名前', key=f'p{i}', label_visibility="collapsed")
         player_names.append(name)
     with score_col:
-        if st.session_state.game_rules["game_name"] == "八八":
+        if current_rules().game_name == "八八":
             score = st.number_input(f'初期得点{i+1}', key=f'initial_score_{i}', min_value=0, step=1, label_visibility="collapsed",value=60)
         else: score = st.number_input(f'初期得点{i+1}', key=f'initial_score_{i}', min_value=0, step=1, label_visibility="collapsed")
         initial_scores[name] = score
@@ -97,13 +116,16 @@ if st.button('この内容でゲームを開始する', type="primary", use_cont
         
         st.session_state.players = unique_player_names
         
-        # 入力された初期スコアを元にDataFrameを初期化
+        # 入力された初期スコアを元に得点表を初期化
         final_initial_scores = {unique_name: initial_scores.get(original_name, 0) for original_name, unique_name in zip(player_names, unique_player_names)}
-        st.session_state.scores = pd.DataFrame([final_initial_scores])
+        st.session_state.scores = ScoreLedger(final_initial_scores)
 
         st.session_state.current_month = 1
         st.session_state.input_modes = {}
+        start_saved_game()
         st.success("設定が完了しました！")
         st.switch_page("pages/points.py")
     else:
-        st.error('全てのプレイヤーの名前を入力してください。')
\ No newline at end of file
+        st.error('全てのプレイヤーの名前を入力してください。')
+
+profile.finish()
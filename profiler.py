@@ -0,0 +1,136 @@
+import contextlib
+import os
+import pickle
+import sys
+import threading
+import time
+
+import streamlit as st
+
+from tracing import Tracer, new_trace_id
+
+# 再実行のプロファイルの出力先（空文字にするとファイルには書かない）
+PROFILE_FILE = os.environ.get("HANAFUDA_PROFILE_FILE", os.path.join("logs", "rerun_profile.jsonl"))
+
+
+def profiling_enabled():
+    """HANAFUDA_PROFILE=1 か、URLに ?profile=1 がついているときだけプロファイルする"""
+    if os.environ.get("HANAFUDA_PROFILE", "0") == "1":
+        return True
+    try:
+        return st.query_params.get("profile") == "1"
+    except Exception:
+        return False
+
+
+def session_state_bytes():
+    """session_state の値を pickle したときのバイト数の合計（pickle できない値は sys.getsizeof）"""
+    total = 0
+    for value in st.session_state.to_dict().values():
+        try:
+            total += len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            total += sys.getsizeof(value)
+    return total
+
+
+def widget_count():
+    """この実行で描かれたウィジェットの数（取れない環境では None）"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx()
+        return len(ctx.widget_ids_this_run) if ctx is not None else None
+    except Exception:
+        return None
+
+
+class RunProfile:
+    """1回のスクリプトの実行（ページ全体の再実行）の所要時間を測るクラス
+
+    with profile.section("scoreboard"): ... で区間ごとの時間を測り、finish() で
+    実行全体の時間・session_state のバイト数・ウィジェット数と一緒にログに書き出す。
+    """
+
+    def __init__(self, page, tracer):
+        self.page = page
+        self.run_id = new_trace_id()
+        self.sections = {}
+        self._tracer = tracer
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections[name] = self.sections.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def finish(self):
+        """実行全体の記録をログに書き、プロファイルのパネルを表示する"""
+        wall_ms = (time.perf_counter() - self._start) * 1000
+        run = {
+            "wall_ms": round(wall_ms, 3),
+            "session_state_bytes": session_state_bytes(),
+            "widgets": widget_count(),
+            "sections": {name: round(ms, 3) for name, ms in self.sections.items()},
+        }
+        self._tracer.record(f"run:{self.page}", wall_ms, self.run_id, **{k: v for k, v in run.items() if k != "wall_ms"})
+        for name, ms in self.sections.items():
+            self._tracer.record(f"{self.page}:{name}", ms, self.run_id)
+        render_panel(self.page, run, self._tracer)
+        return run
+
+
+class _NullProfile:
+    """プロファイルしないときに使う、何もしない RunProfile"""
+
+    @contextlib.contextmanager
+    def section(self, name):
+        yield
+
+    def finish(self):
+        return None
+
+
+_NULL_PROFILE = _NullProfile()
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_profile_tracer():
+    """再実行のプロファイル専用の Tracer（写真認識のトレースとは別のファイルに書く）"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(path=PROFILE_FILE)
+        return _tracer
+
+
+def start_run(page):
+    """ページの先頭で呼ぶ。プロファイルが無効なら何もしないオブジェクトを返す"""
+    if not profiling_enabled():
+        return _NULL_PROFILE
+    return RunProfile(page, get_profile_tracer())
+
+
+def render_panel(page, run, tracer):
+    """今回の実行の内訳と、これまでの実行の p50/p95 を折りたたみのパネルに表示する"""
+    with st.expander(f"⏱️ 再実行のプロファイル（{page}）"):
+        widgets = run["widgets"] if run["widgets"] is not None else "-"
+        st.write(f"**今回の実行**: {run['wall_ms']:.1f} ms / ウィジェット {widgets}個 / "
+                 f"session_state {run['session_state_bytes'] / 1024:.1f} KB")
+        if run["sections"]:
+            st.dataframe(
+                [{"区間": name, "ms": round(ms, 1)} for name, ms in run["sections"].items()],
+                hide_index=True, use_container_width=True
+            )
+        stats = {name: s for name, s in tracer.percentiles().items() if name == f"run:{page}" or name.startswith(f"{page}:")}
+        if stats:
+            st.write("**これまでの実行（ミリ秒）**")
+            st.dataframe(
+                [{"区間": name, "回数": s["count"], "p50": round(s["p50"], 1), "p95": round(s["p95"], 1)}
+                 for name, s in stats.items()],
+                hide_index=True, use_container_width=True
+            )
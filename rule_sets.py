@@ -0,0 +1,209 @@
+import functools
+import hashlib
+import json
+from dataclasses import dataclass, field
+from types import MappingProxyType
+
+from rules import DEFAULT_HACHIHACHI_RULES, DEFAULT_KOIKOI_RULES, ITSUMONO_HACHIHACHI_RULES
+from scoring import CARD_TYPES, ScoringRules
+
+YAKU_KINDS = ("dekiyaku", "teyaku", "special_yaku")
+
+
+@dataclass(frozen=True, slots=True)
+class YakuEntry:
+    """役1つ分の設定（None の項目は元の辞書にもなかったもの）"""
+    score: int
+    active: bool = True
+    is_variable: bool = None
+    per_item_score: int = None
+    item_unit: str = None
+    hatto_applicable: bool = None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledRules:
+    """変更できない、ハッシュ可能なゲームルール
+
+    プリセットは1つのインスタンスを全セッションで共有する。有効な役の一覧・法度の役・
+    追加点を入力する役・札の点数のベクトル・精算用の ScoringRules はコンパイル時に1回だけ作る。
+    """
+    game_name: str
+    score_unit: str = "貫/点"
+    zetsuba_oba: bool = True
+    enable_orichin: bool = False
+    enable_oikomi: bool = False
+    enable_mizuten: bool = False
+    card_scores: tuple = (0, 0, 0, 0)  # CARD_TYPES 順
+    dekiyaku: tuple = ()  # ((役の名前, YakuEntry), ...)
+    teyaku: tuple = ()
+    special_yaku: tuple = ()
+    # 以下はコンパイル時に計算する
+    active_dekiyaku: tuple = field(init=False, compare=False, repr=False)
+    active_teyaku: tuple = field(init=False, compare=False, repr=False)
+    active_special_yaku: tuple = field(init=False, compare=False, repr=False)
+    hatto_yaku: frozenset = field(init=False, compare=False, repr=False)
+    variable_yaku: MappingProxyType = field(init=False, compare=False, repr=False)
+    scoring: ScoringRules = field(init=False, compare=False, repr=False)
+    fingerprint: str = field(init=False, compare=False, repr=False)
+    _tables: MappingProxyType = field(init=False, compare=False, repr=False)
+    _hash: int = field(init=False, compare=False, repr=False)
+
+    def __post_init__(self):
+        tables = MappingProxyType({kind: MappingProxyType(dict(getattr(self, kind))) for kind in YAKU_KINDS})
+        as_dict = self.to_dict()
+        canonical = json.dumps(as_dict, ensure_ascii=False)
+        derived = {
+            "active_dekiyaku": tuple(name for name, entry in self.dekiyaku if entry.active),
+            "active_teyaku": tuple(name for name, entry in self.teyaku if entry.active),
+            "active_special_yaku": tuple(name for name, entry in self.special_yaku if entry.active),
+            "hatto_yaku": frozenset(name for name, entry in self.dekiyaku if entry.hatto_applicable),
+            "variable_yaku": MappingProxyType({
+                kind: tuple(name for name, entry in getattr(self, kind) if entry.is_variable) for kind in YAKU_KINDS
+            }),
+            "scoring": ScoringRules.from_game_rules(as_dict),
+            "fingerprint": hashlib.md5(canonical.encode("utf-8")).hexdigest()[:16],
+            "_tables": tables,
+            "_hash": hash((self.game_name, self.score_unit, self.zetsuba_oba, self.enable_orichin, self.enable_oikomi,
+                           self.enable_mizuten, self.card_scores, self.dekiyaku, self.teyaku, self.special_yaku)),
+        }
+        for name, value in derived.items():
+            object.__setattr__(self, name, value)
+
+    def __hash__(self):
+        return self._hash
+
+    def yaku(self, kind):
+        """{役の名前: YakuEntry}（kind は 'dekiyaku' / 'teyaku' / 'special_yaku'）"""
+        return self._tables[kind]
+
+    def card_score(self, card_type):
+        return self.card_scores[CARD_TYPES.index(card_type)]
+
+    def to_dict(self):
+        """st.session_state.game_rules と同じ形の辞書（保存用。毎回新しく作る）"""
+        return {
+            "game_name": self.game_name,
+            "score_unit": self.score_unit,
+            "zetsuba_oba": self.zetsuba_oba,
+            "enable_orichin": self.enable_orichin,
+            "enable_oikomi": self.enable_oikomi,
+            "enable_mizuten": self.enable_mizuten,
+            "dekiyaku": {name: entry.to_dict() for name, entry in self.dekiyaku},
+            "teyaku": {name: entry.to_dict() for name, entry in self.teyaku},
+            "special_yaku": {name: entry.to_dict() for name, entry in self.special_yaku},
+            "card_scores": dict(zip(CARD_TYPES, self.card_scores)),
+        }
+
+
+def compile_rules(game_rules):
+    """game_rules 形式の辞書を CompiledRules にする（同じ内容なら同じインスタンスを返す）"""
+    if isinstance(game_rules, CompiledRules):
+        return game_rules
+    return _compile(json.dumps(game_rules, ensure_ascii=False))
+
+
+@functools.lru_cache(maxsize=128)
+def _compile(canonical):
+    game_rules = json.loads(canonical)
+    card_scores = game_rules.get("card_scores", {})
+    return CompiledRules(
+        game_name=game_rules.get("game_name", ""),
+        score_unit=game_rules.get("score_unit", "貫/点"),
+        zetsuba_oba=game_rules.get("zetsuba_oba", True),
+        enable_orichin=game_rules.get("enable_orichin", False),
+        enable_oikomi=game_rules.get("enable_oikomi", False),
+        enable_mizuten=game_rules.get("enable_mizuten", False),
+        card_scores=tuple(card_scores.get(t, 0) for t in CARD_TYPES),
+        **{
+            kind: tuple((name, YakuEntry(**data)) for name, data in game_rules.get(kind, {}).items())
+            for kind in YAKU_KINDS
+        },
+    )
+
+
+# プリセット（全セッションで共有する）
+PRESETS = MappingProxyType({
+    "こいこい": compile_rules(DEFAULT_KOIKOI_RULES),
+    "八八": compile_rules(DEFAULT_HACHIHACHI_RULES),
+    "いつもの八八": compile_rules(ITSUMONO_HACHIHACHI_RULES),
+})
+
+
+class RuleOverlay:
+    """共有のルール（base）に、セッションごとの変更（edits）だけを重ねて持つクラス
+
+    base は書き換えず、変更は {("card_scores", "光"): 30, ("dekiyaku", "四光", "active"): False, ...}
+    のようなパスと値の辞書に記録する（copy-on-write）。役の表をまとめて編集したときは
+    ("dekiyaku",) のようなパスに ((役の名前, YakuEntry), ...) を記録する。compiled は base と edits の組ごとに
+    1回だけコンパイルされ、同じ変更をしたセッション同士でも共有される。
+    """
+
+    __slots__ = ("base", "edits")
+
+    def __init__(self, base, edits=None):
+        self.base = compile_rules(base)
+        self.edits = dict(edits or {})
+
+    @property
+    def compiled(self):
+        if not self.edits:
+            return self.base
+        return _with_edits(self.base, tuple(self.edits.items()))
+
+    def get(self, path):
+        """現在の値（path は ("card_scores", "光") のようなキーのタプル）"""
+        if path in self.edits:
+            return self.edits[path]
+        return _lookup(_base_dict(self.base), path)
+
+    def set(self, path, value):
+        """値を変更する。base と同じ値に戻したときは変更の記録を消す"""
+        if _lookup(_base_dict(self.base), path) == value:
+            self.edits.pop(path, None)
+        else:
+            self.edits[path] = value
+
+    def set_yaku_table(self, kind, entries):
+        """役の一覧（((役の名前, YakuEntry), ...)）をまとめて置き換える（行の追加・削除も含む）"""
+        entries = tuple(entries)
+        for path in [path for path in self.edits if path[0] == kind]:
+            del self.edits[path]
+        if entries != getattr(self.base, kind):
+            self.edits[(kind,)] = entries
+
+    def __repr__(self):
+        return f"RuleOverlay({self.base.game_name!r}, edits={self.edits!r})"
+
+
+_MISSING = object()
+
+
+@functools.lru_cache(maxsize=16)
+def _base_dict(base):
+    return base.to_dict()
+
+
+def _lookup(rules, path):
+    for key in path:
+        if not isinstance(rules, dict) or key not in rules:
+            return _MISSING
+        rules = rules[key]
+    return rules
+
+
+@functools.lru_cache(maxsize=256)
+def _with_edits(base, edits):
+    rules = base.to_dict()
+    for path, value in edits:
+        if path[0] in YAKU_KINDS and len(path) == 1:
+            rules[path[0]] = {name: entry.to_dict() for name, entry in value}
+            continue
+        target = rules
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+        target[path[-1]] = value
+    return compile_rules(rules)
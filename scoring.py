@@ -0,0 +1,344 @@
+from dataclasses import asdict, dataclass, field, fields
+from types import MappingProxyType
+
+# 勝負の決まり方・入力モードの選択肢（pages/points.py のラジオボタン・セレクトボックスと同じ文字列）
+OUTCOME_CARDS = "役なし（取り札勝負）"
+OUTCOME_DEKIYAKU = "出来役あり"
+OUTCOME_SPECIAL = "特殊役あり"
+MODE_CARDS = "取り札入力"
+MODE_MANUAL = "得点入力"
+MODE_PHOTO = "写真で自動入力"
+NO_PLAYER = "なし"
+
+# 飛び込み・抜け役のボーナス点、みずてんの支払い点
+TEYAKU_BONUS = 12
+MIZUTEN_PAYMENT = 12
+
+CARD_TYPES = ("光", "タネ", "短冊", "カス")
+
+
+@dataclass(frozen=True, slots=True)
+class YakuRule:
+    """出来役・特殊役1つ分の精算に必要な設定"""
+    score: int
+    is_variable: bool = False
+    per_item_score: int = 1
+    hatto_applicable: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class ScoringRules:
+    """精算に必要な部分だけを game_rules から取り出したルール"""
+    card_scores: tuple = (0, 0, 0, 0)
+    dekiyaku: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))
+    special_yaku: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))
+    teyaku: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))
+    zetsuba_oba: bool = True
+    enable_orichin: bool = False
+    enable_oikomi: bool = False
+    enable_mizuten: bool = False
+
+    @classmethod
+    def from_game_rules(cls, game_rules):
+        """st.session_state.game_rules 形式の辞書からルールを作る"""
+        card_scores = game_rules.get('card_scores', {})
+        return cls(
+            card_scores=tuple(card_scores.get(t, 0) for t in CARD_TYPES),
+            dekiyaku=_yaku_rules(game_rules.get('dekiyaku', {})),
+            special_yaku=_yaku_rules(game_rules.get('special_yaku', {})),
+            teyaku=MappingProxyType({name: data['score'] for name, data in game_rules.get('teyaku', {}).items()}),
+            zetsuba_oba=game_rules.get("zetsuba_oba", True),
+            enable_orichin=game_rules.get("enable_orichin", False),
+            enable_oikomi=game_rules.get("enable_oikomi", False),
+            enable_mizuten=game_rules.get("enable_mizuten", False),
+        )
+
+
+def _yaku_rules(yaku_dict):
+    return MappingProxyType({
+        name: YakuRule(
+            score=data['score'],
+            is_variable=data.get('is_variable', False),
+            per_item_score=data.get('per_item_score', 1),
+            hatto_applicable=data.get('hatto_applicable', False),
+        )
+        for name, data in yaku_dict.items()
+    })
+
+
+def _checked_values(cls, data):
+    """JSON の辞書の項目と型を dataclass の定義と照らし合わせ、合わなければ ValueError を出す"""
+    if not isinstance(data, dict):
+        raise ValueError(f"辞書を指定してください: {data!r}")
+    unknown = set(data) - set(cls.__slots__)
+    if unknown:
+        raise ValueError(f"不明な項目があります: {', '.join(sorted(map(str, unknown)))}")
+    types = {f.name: f.type for f in fields(cls)}
+    for name, value in data.items():
+        expected = types[name]
+        if expected is tuple:
+            valid = isinstance(value, (list, tuple)) and all(isinstance(v, str) for v in value)
+        elif expected is int:
+            valid = isinstance(value, int) and not isinstance(value, bool)
+        else:
+            valid = isinstance(value, expected)
+        if not valid:
+            raise ValueError(f"{name} の値が正しくありません: {value!r}")
+    return dict(data)
+
+
+@dataclass(frozen=True, slots=True)
+class PlayerInput:
+    """1人分の月の入力（取り札・手役・下り賃など）"""
+    mode: str = MODE_CARDS
+    manual_score: int = 0
+    brights: int = 0
+    animals: int = 0
+    ribbons: int = 0
+    chaff: int = 0
+    teyaku: tuple = ()
+    tobikomi: bool = False
+    nukeyaku: bool = False
+    orichin: int = 0
+    oikomichin: int = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        """JSON の辞書から作る（teyaku はリストでもよい。項目の型が違えば ValueError）"""
+        values = _checked_values(cls, data)
+        if "teyaku" in values:
+            values["teyaku"] = tuple(values["teyaku"])
+        return cls(**values)
+
+    def to_dict(self):
+        """JSON に保存できる辞書にする（from_dict で元に戻せる）"""
+        return asdict(self)
+
+
+_EMPTY_INPUT = PlayerInput()
+
+
+@dataclass(frozen=True, slots=True)
+class MonthInput:
+    """1か月分の精算に必要な入力をまとめたもの"""
+    players: tuple
+    active_players: tuple
+    inputs: dict = field(default_factory=dict)
+    outcome_type: str = OUTCOME_CARDS
+    yaku_winner: str = NO_PLAYER
+    yaku_selection: tuple = ()
+    yaku_extras: dict = field(default_factory=dict)
+    hatto_players: tuple = ()
+    mizuten_player: str = NO_PLAYER
+    ba_status: str = "小場 (x1)"
+    custom_multiplier: int = 1
+
+    @classmethod
+    def from_dict(cls, data):
+        """JSON の辞書から作る（active_players を省略すると全員が参加したものとする。項目の型が違えば ValueError）"""
+        values = _checked_values(cls, data)
+        if "players" not in values:
+            raise ValueError("players を指定してください")
+        extras = values.get("yaku_extras", {})
+        if not all(isinstance(n, int) and not isinstance(n, bool) for n in extras.values()):
+            raise ValueError(f"yaku_extras の値は整数で指定してください: {extras!r}")
+        values["players"] = tuple(values["players"])
+        values["active_players"] = tuple(values.get("active_players", values["players"]))
+        values["inputs"] = {p: PlayerInput.from_dict(pi) for p, pi in values.get("inputs", {}).items()}
+        for name in ("yaku_selection", "hatto_players"):
+            if name in values:
+                values[name] = tuple(values[name])
+        return cls(**values)
+
+    def to_dict(self):
+        """JSON に保存できる辞書にする（from_dict で元に戻せる）"""
+        return asdict(self)
+
+
+def card_points(card_scores, brights, animals, ribbons, chaff):
+    """取り札の枚数と札の点数 (光, タネ, 短冊, カス) から点数を計算する"""
+    return int(
+        brights * card_scores[0] +
+        animals * card_scores[1] +
+        ribbons * card_scores[2] +
+        chaff * card_scores[3]
+    )
+
+
+def ba_multiplier(ba_status, zetsuba_oba=True):
+    """場の状況（小場・大場・絶場）から倍率を返す"""
+    if not zetsuba_oba:
+        return 1
+    if "絶場" in ba_status:
+        return 4
+    if "大場" in ba_status:
+        return 2
+    return 1
+
+
+def _settle_cards(month, rules, active):
+    """役なし（取り札勝負）の主得点"""
+    cs = rules.card_scores
+    inputs = month.inputs
+    base_scores = {}
+    for p in active:
+        pi = inputs.get(p, _EMPTY_INPUT)
+        if pi.mode == MODE_MANUAL:
+            base_scores[p] = pi.manual_score
+        else:
+            base_scores[p] = int(pi.brights * cs[0] + pi.animals * cs[1] + pi.ribbons * cs[2] + pi.chaff * cs[3])
+
+    n = len(active)
+    if n == 2:
+        # 【2人プレイの場合】 点差を直接やり取り
+        p1, p2 = active
+        diff = base_scores[p1] - base_scores[p2]
+        return {p1: diff, p2: -diff}
+    if n > 2:
+        # 平均との差を四捨五入し、丸め誤差は最高得点者が吸収する
+        avg = sum(base_scores.values()) / n
+        rounded_s = {p: int(round(s - avg)) for p, s in base_scores.items()}
+        err = sum(rounded_s.values())
+        if err != 0:
+            winner = max(base_scores, key=base_scores.get)
+            rounded_s[winner] -= err
+        return rounded_s
+    return dict.fromkeys(active, 0)
+
+
+def _settle_yaku(month, rules, active):
+    """出来役・特殊役で勝負が決まった場合の主得点"""
+    change = dict.fromkeys(active, 0)
+    winner = month.yaku_winner
+    if winner == NO_PLAYER or winner not in change:
+        return change
+
+    is_dekiyaku = month.outcome_type == OUTCOME_DEKIYAKU
+    yaku_rules = rules.dekiyaku if is_dekiyaku else rules.special_yaku
+    extras = month.yaku_extras
+    total_yaku_score = 0
+    is_hatto_round = False
+    for yaku in month.yaku_selection:
+        yaku_rule = yaku_rules[yaku]
+        score = yaku_rule.score
+        if yaku_rule.is_variable:
+            score += extras.get(yaku, 0) * yaku_rule.per_item_score
+        total_yaku_score += score
+        is_hatto_round = is_hatto_round or yaku_rule.hatto_applicable
+
+    losers = [p for p in active if p != winner]
+    # 特殊役の場合は法度を考慮しない
+    if is_dekiyaku and is_hatto_round and month.hatto_players:
+        # 法度が発生した場合は、法度を犯した人だけが倍額を支払う
+        hatto_players = month.hatto_players
+        winner_gain = 0
+        for loser in losers:
+            if loser in hatto_players:
+                payment = total_yaku_score * 2
+                change[loser] = -payment
+                winner_gain += payment
+        change[winner] = winner_gain
+    elif losers:
+        change[winner] = total_yaku_score * len(losers)
+        for loser in losers:
+            change[loser] = -total_yaku_score
+    return change
+
+
+def _apply_teyaku(month, rules, active, change):
+    """手役を参加者同士で差し引き精算する（各人 n×自分の手役 − 全員の合計）"""
+    inputs = month.inputs
+    teyaku_scores = rules.teyaku
+    totals = []
+    for p in active:
+        pi = inputs.get(p, _EMPTY_INPUT)
+        t = 0
+        for y in pi.teyaku:
+            t += teyaku_scores[y]
+        if pi.tobikomi:
+            t += TEYAKU_BONUS
+        if pi.nukeyaku:
+            t += TEYAKU_BONUS
+        totals.append(t)
+    if not any(totals):
+        return
+    grand_total = sum(totals)
+    n = len(active)
+    for p, t in zip(active, totals):
+        change[p] += n * t - grand_total
+
+
+def validate_month(month, rules):
+    """精算できない入力ならエラーメッセージを返す（問題がなければ None）"""
+    players = set(month.players)
+    if len(month.players) >= 4 and len(month.active_players) < 2:
+        return "参加者が2人未満です。出る人を2人以上選択してください。"
+    if not set(month.active_players) <= players:
+        return "参加者にプレイヤー以外の人が含まれています。"
+    for name in (month.yaku_winner, month.mizuten_player):
+        if name != NO_PLAYER and name not in players:
+            return f"プレイヤー「{name}」が見つかりません。"
+    if month.outcome_type not in (OUTCOME_CARDS, OUTCOME_DEKIYAKU, OUTCOME_SPECIAL):
+        return f"不明な勝負の決まり方です: {month.outcome_type}"
+    if month.outcome_type != OUTCOME_CARDS:
+        yaku_rules = rules.dekiyaku if month.outcome_type == OUTCOME_DEKIYAKU else rules.special_yaku
+        unknown = [yaku for yaku in month.yaku_selection if yaku not in yaku_rules]
+        if unknown:
+            return f"ルールにない役です: {', '.join(unknown)}"
+    for p, pi in month.inputs.items():
+        unknown = [yaku for yaku in pi.teyaku if yaku not in rules.teyaku]
+        if unknown:
+            return f"{p}: ルールにない手役です: {', '.join(unknown)}"
+    return None
+
+
+def settle_month(month, rules):
+    """1か月分の入力を精算し、全プレイヤーの得点変動を {プレイヤー: 点数} で返す"""
+    players = month.players
+    active = month.active_players
+    inputs = month.inputs
+
+    # --- 主得点 ---
+    if month.outcome_type == OUTCOME_CARDS:
+        change = _settle_cards(month, rules, active)
+    else:
+        change = _settle_yaku(month, rules, active)
+
+    # --- 手役（特殊役の月は無効） ---
+    if month.outcome_type != OUTCOME_SPECIAL:
+        _apply_teyaku(month, rules, active, change)
+
+    scores = {p: change.get(p, 0) for p in players}
+
+    # --- 下り賃・追い込み賃・みずてん ---
+    if rules.enable_orichin or rules.enable_oikomi:
+        orita_players = [p for p in players if p not in change]
+        if orita_players and change:
+            if rules.enable_orichin:
+                winner_for_orichin = max(change, key=change.get)
+                for p in orita_players:
+                    orichin = inputs.get(p, _EMPTY_INPUT).orichin
+                    if orichin > 0:
+                        scores[p] -= orichin
+                        scores[winner_for_orichin] += orichin
+            if rules.enable_oikomi:
+                for p in orita_players:
+                    oikomichin = inputs.get(p, _EMPTY_INPUT).oikomichin
+                    if oikomichin > 0:
+                        scores[p] += oikomichin * len(active)
+                        for active_player in active:
+                            scores[active_player] -= oikomichin
+
+    if rules.enable_mizuten and month.mizuten_player != NO_PLAYER:
+        mizuten_player = month.mizuten_player
+        for p in players:
+            scores[p] -= MIZUTEN_PAYMENT
+        scores[mizuten_player] += MIZUTEN_PAYMENT * len(players)
+
+    # --- 場の状況と追加の倍率（勝負した人のみ） ---
+    final_multiplier = ba_multiplier(month.ba_status, rules.zetsuba_oba) * month.custom_multiplier
+    if final_multiplier > 1:
+        for p in active:
+            scores[p] *= final_multiplier
+
+    return scores
@@ -0,0 +1,395 @@
+import concurrent.futures
+import multiprocessing
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from batch_scoring import batch_settle_card_play, batch_settle_teyaku
+from cards import CARD_BITS, CARD_MONTHS, CARD_TYPE_INDEX, DECK, dekiyaku_of, mask_of, teyaku_of, to_bits, type_counts
+from rule_sets import compile_rules
+
+# 1回の配りで何か月分をまとめて処理するか（メモリは1か月あたり数KB）
+DEFAULT_CHUNK_SIZE = 20_000
+
+# 打ち方（どの手札を出すか）
+GREEDY = "greedy"  # 取れる札が最も高い手を出す。取れないときは最も安い札を捨てる
+RANDOM = "random"  # 取れる札があれば取る（どの札かはランダム）。なければランダムに捨てる
+POLICIES = (GREEDY, RANDOM)
+
+# 勝負の決まり方（集計用）
+OUTCOMES = ("取り札勝負", "出来役", "特殊役", "流局")
+_CARDS, _DEKIYAKU, _SPECIAL, _DRAW = range(4)
+
+
+@dataclass(frozen=True, slots=True)
+class GameShape:
+    """配り方（人数・手札・場札の枚数）と、役がないときの決まり方"""
+    players: int
+    hand_size: int
+    field_size: int
+    settle_cards: bool  # 役がないときに取り札の点数で精算するか（False なら流局）
+
+
+GAME_SHAPES = {
+    "八八": GameShape(players=3, hand_size=7, field_size=6, settle_cards=True),
+    "こいこい": GameShape(players=2, hand_size=8, field_size=8, settle_cards=False),
+}
+
+
+def game_shape(rules):
+    return GAME_SHAPES.get(rules.game_name, GAME_SHAPES["八八"])
+
+
+# --- 配りと打ち方 ---
+def deal(rng, n, shape):
+    """n か月分を配り、(手札 (n, 人数), 場札 (n,), 山札の札の番号 (n, 枚数)) を返す"""
+    order = rng.permuted(np.tile(np.arange(len(DECK), dtype=np.int64), (n, 1)), axis=1)
+    bits = CARD_BITS[order]
+    h = shape.hand_size
+    hands = np.stack(
+        [np.bitwise_or.reduce(bits[:, p * h:(p + 1) * h], axis=1) for p in range(shape.players)], axis=1
+    )
+    start = shape.players * h
+    field_ = np.bitwise_or.reduce(bits[:, start:start + shape.field_size], axis=1)
+    stock = order[:, start + shape.field_size:]
+    return hands, field_, stock
+
+
+# 札の番号は月順に4枚ずつなので、場札のうち m 月の札は (場札 >> 4m) & 0b1111 の4ビットで表せる
+_MONTH_SHIFTS = np.arange(0, len(DECK), 4, dtype=np.uint64)
+_MONTHS = np.arange(12)
+
+
+def capture_tables(values):
+    """月ごと・場札の4ビット（16通り）ごとに、その月の札を出したときに取る札の集合と価値の表を作る
+
+    3枚あれば全部、1・2枚なら価値の高い方（同じなら番号の小さい方）を取る。
+    """
+    picks = np.zeros((12, 16), dtype=np.uint64)
+    gains = np.zeros((12, 16))
+    for m in range(12):
+        for nibble in range(1, 16):
+            on_field = [m * 4 + j for j in range(4) if nibble >> j & 1]
+            chosen = on_field if len(on_field) >= 3 else [max(on_field, key=lambda i: (values[i], -i))]
+            picks[m, nibble] = mask_of(chosen)
+            gains[m, nibble] = values[chosen].sum()
+    return picks, gains
+
+
+def _nibbles(field_):
+    """場札の月ごとの4ビット (n, 12)"""
+    return (field_[:, None] >> _MONTH_SHIFTS & np.uint64(15)).astype(np.intp)
+
+
+def _capture(field_, taken, cards, picks):
+    """札 cards (n,) を場に出し、同じ月の札があれば取る。(場札, 取り札) を新しい配列で返す"""
+    card_bits = CARD_BITS[cards]
+    months = CARD_MONTHS[cards]
+    nibbles = (field_ >> _MONTH_SHIFTS[months] & np.uint64(15)).astype(np.intp)
+    picked = picks[months, nibbles]
+    matched = nibbles > 0
+    taken = taken | np.where(matched, card_bits | picked, np.uint64(0))
+    field_ = (field_ & ~picked) | np.where(matched, np.uint64(0), card_bits)
+    return field_, taken
+
+
+def _choose(hand, field_, values, gains, policy, rng):
+    """打ち方に従って、手札から出す札の番号 (n,) を選ぶ"""
+    nibbles = _nibbles(field_)
+    matched = (nibbles > 0)[:, CARD_MONTHS]
+    if policy == RANDOM:
+        score = matched * 2.0 + rng.random(matched.shape)
+    else:
+        score = np.where(matched, values + gains[_MONTHS, nibbles][:, CARD_MONTHS], -values)
+    return np.argmax(np.where(to_bits(hand), score, -np.inf), axis=1)
+
+
+def play(hands, field_, stock, shape, values, policies, rng):
+    """全員が手札を出し切るまで打ち、各人の取り札の集合 (n, 人数) を返す
+
+    親（0番）から順に、手札を1枚出してから山札を1枚めくる。values は札ごとの価値 (48,)。
+    """
+    picks, gains = capture_tables(values)
+    hands = hands.copy()
+    taken = np.zeros_like(hands)
+    turn = 0
+    for _ in range(shape.hand_size):
+        for p in range(shape.players):
+            cards = _choose(hands[:, p], field_, values, gains, policies[p], rng)
+            hands[:, p] &= ~CARD_BITS[cards]
+            field_, taken[:, p] = _capture(field_, taken[:, p], cards, picks)
+            field_, taken[:, p] = _capture(field_, taken[:, p], stock[:, turn], picks)
+            turn += 1
+    return taken
+
+
+# --- 精算 ---
+def _special_extras(names, counts, points):
+    """特殊役の成立を {役の名前: 追加の数の配列} で返す（成立していない要素は -1）
+
+    素十六はカス16枚から1枚ごと、二た八は168点から10点ごとを追加として数え、
+    総八は全員がちょうど88点のときに親の役とする。
+    """
+    result = {}
+    if "素十六" in names:
+        result["素十六"] = np.where(counts[..., 3] >= 16, counts[..., 3] - 16, -1)
+    if "二た八" in names:
+        result["二た八"] = np.where(points >= 168, (points - 168) // 10, -1)
+    if "総八" in names:
+        everyone = (points == 88).all(axis=1, keepdims=True)
+        parent = np.arange(points.shape[1]) == 0
+        result["総八"] = np.where(everyone & parent, 0, -1)
+    return result
+
+
+def _score_yaku(table, found, shape):
+    """成立した役の点数 {役の名前: (n, 人数)}・各人の合計点・役があるか を返す"""
+    scores = {}
+    total = np.zeros(shape, dtype=np.int64)
+    achieved = np.zeros(shape, dtype=bool)
+    for name, extras in found.items():
+        entry = table[name]
+        score = entry.score
+        if entry.is_variable:
+            score = score + np.maximum(extras, 0) * (entry.per_item_score or 1)
+        scores[name] = np.where(extras >= 0, score, 0)
+        total += scores[name]
+        achieved |= extras >= 0
+    return scores, total, achieved
+
+
+def settle(rules, shape, hands, field_, taken):
+    """配りと取り札から、月ごとの得点変動 (n, 人数)・決まり方 (n,)・役ごとの得点 {(種類, 役): (n,)} を返す
+
+    出来役のある人がいればその中で合計点が最も高い人（同点なら親に近い人）の勝ち、
+    なければ特殊役、それもなければ取り札の点数で精算する（こいこいは流局）。
+    役の精算・取り札勝負・手役の差し引きは scoring.settle_month と同じで、
+    法度・下り賃・追い込み賃・みずてん・場の倍率は扱わない。
+    役ごとの得点は、その役を持つ人が役の分だけ受け取った点数。
+    """
+    n, players = taken.shape
+    rows = np.arange(n)
+    counts = type_counts(taken)
+    points = counts @ np.asarray(rules.card_scores, dtype=np.int64)
+
+    dekiyaku, dek_total, dek_achieved = _score_yaku(
+        rules.yaku("dekiyaku"), dekiyaku_of(taken, rules.active_dekiyaku), taken.shape
+    )
+    special, sp_total, sp_achieved = _score_yaku(
+        rules.yaku("special_yaku"), _special_extras(rules.active_special_yaku, counts, points), taken.shape
+    )
+    has_dek = dek_achieved.any(axis=1)
+    has_sp = ~has_dek & sp_achieved.any(axis=1)
+    winner = np.where(
+        has_dek,
+        np.argmax(np.where(dek_achieved, dek_total, -1), axis=1),
+        np.argmax(np.where(sp_achieved, sp_total, -1), axis=1),
+    )
+    score = np.where(has_dek[:, None], dek_total, sp_total)[rows, winner]
+
+    outcome = np.full(n, _CARDS if shape.settle_cards else _DRAW)
+    outcome[has_sp] = _SPECIAL
+    outcome[has_dek] = _DEKIYAKU
+
+    # 主得点（役の月は勝った人が他の全員から役の合計点を受け取る）
+    change = np.zeros((n, players), dtype=np.int64)
+    yaku_month = has_dek | has_sp
+    change[yaku_month] = -score[yaku_month, None]
+    change[rows[yaku_month], winner[yaku_month]] += score[yaku_month] * players
+    cards = outcome == _CARDS
+    change[cards] = batch_settle_card_play(points[cards], np.ones((cards.sum(), players), dtype=bool))
+
+    contributions = {}
+    for kind, scores, months in (("dekiyaku", dekiyaku, has_dek), ("special_yaku", special, has_sp)):
+        for name, values in scores.items():
+            contributions[(kind, name)] = np.where(months, values[rows, winner] * (players - 1), 0)
+
+    # 手役（特殊役の月は無効）
+    with_teyaku = outcome != _SPECIAL
+    if rules.active_teyaku:
+        table = rules.yaku("teyaku")
+        teyaku_totals = np.zeros((n, players), dtype=np.int64)
+        for name, flags in teyaku_of(hands, field_[:, None], rules.active_teyaku).items():
+            values = flags * table[name].score
+            teyaku_totals += values
+            contributions[("teyaku", name)] = np.where(with_teyaku, values.sum(axis=1) * (players - 1), 0)
+        change[with_teyaku] += batch_settle_teyaku(
+            teyaku_totals[with_teyaku], np.ones((with_teyaku.sum(), players), dtype=bool)
+        )
+    return change, outcome, contributions
+
+
+# --- 集計 ---
+@dataclass(slots=True)
+class SimulationSummary:
+    """シミュレーションの集計（合計と2乗の合計だけを持つので、複数の結果をそのまま足し合わせられる）"""
+    game_name: str
+    fingerprint: str
+    seed: int
+    policies: tuple
+    months: int = 0
+    seat_totals: list = field(default_factory=list)
+    seat_squares: list = field(default_factory=list)
+    outcomes: dict = field(default_factory=dict)
+    # {"種類/役の名前": [成立した月数, 得点の合計, 得点の2乗の合計]}
+    yaku: dict = field(default_factory=dict)
+
+    def add(self, change, outcome, contributions):
+        self.months += len(change)
+        totals = change.sum(axis=0)
+        squares = (change * change).sum(axis=0)
+        if not self.seat_totals:
+            self.seat_totals = [0] * change.shape[1]
+            self.seat_squares = [0] * change.shape[1]
+        for seat in range(change.shape[1]):
+            self.seat_totals[seat] += int(totals[seat])
+            self.seat_squares[seat] += int(squares[seat])
+        for code, label in enumerate(OUTCOMES):
+            self.outcomes[label] = self.outcomes.get(label, 0) + int((outcome == code).sum())
+        for (kind, name), values in contributions.items():
+            entry = self.yaku.setdefault(f"{kind}/{name}", [0, 0, 0])
+            entry[0] += int((values != 0).sum())
+            entry[1] += int(values.sum())
+            entry[2] += int((values * values).sum())
+
+    def merge(self, other):
+        if not self.seat_totals:
+            self.seat_totals = [0] * len(other.seat_totals)
+            self.seat_squares = [0] * len(other.seat_squares)
+        self.months += other.months
+        self.seat_totals = [a + b for a, b in zip(self.seat_totals, other.seat_totals)]
+        self.seat_squares = [a + b for a, b in zip(self.seat_squares, other.seat_squares)]
+        for label, count in other.outcomes.items():
+            self.outcomes[label] = self.outcomes.get(label, 0) + count
+        for key, values in other.yaku.items():
+            entry = self.yaku.setdefault(key, [0, 0, 0])
+            for i, value in enumerate(values):
+                entry[i] += value
+
+    def _mean_var(self, total, squares):
+        mean = total / self.months
+        return mean, max(squares / self.months - mean * mean, 0.0)
+
+    def seat_rows(self):
+        """席ごとの1か月あたりの期待値・分散・標準誤差"""
+        rows = []
+        for seat, (total, squares) in enumerate(zip(self.seat_totals, self.seat_squares)):
+            mean, var = self._mean_var(total, squares)
+            rows.append({
+                "席": "親" if seat == 0 else f"{seat + 1}番目",
+                "打ち方": self.policies[seat],
+                "期待値/月": round(mean, 3),
+                "分散": round(var, 1),
+                "標準誤差": round((var / self.months) ** 0.5, 3),
+            })
+        return rows
+
+    def yaku_rows(self):
+        """役ごとの成立率と、役を持つ人が受け取る点数の1か月あたりの期待値・分散"""
+        kinds = {"dekiyaku": "出来役", "teyaku": "手役", "special_yaku": "特殊役"}
+        rows = []
+        for key, (count, total, squares) in self.yaku.items():
+            kind, name = key.split("/", 1)
+            mean, var = self._mean_var(total, squares)
+            rows.append({
+                "種類": kinds[kind],
+                "役の名前": name,
+                "成立率": round(count / self.months, 5),
+                "1回あたり": round(total / count, 1) if count else 0.0,
+                "期待値/月": round(mean, 3),
+                "分散": round(var, 1),
+            })
+        return rows
+
+    def outcome_rows(self):
+        return [{"決まり方": label, "割合": round(count / self.months, 4)} for label, count in self.outcomes.items()]
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        values = dict(data)
+        values["policies"] = tuple(values["policies"])
+        return cls(**values)
+
+
+def simulate_chunk(game_rules, n, seed_seq, policies):
+    """n か月分を配って打ち、SimulationSummary を返す（プロセスプールの1タスク）"""
+    rules = compile_rules(game_rules)
+    shape = game_shape(rules)
+    rng = np.random.default_rng(seed_seq)
+    # 打ち方が札を比べるときの価値（札の点数。点数が0の種類でも捨てる順が決まるように1を足す）
+    values = np.asarray(rules.card_scores, dtype=np.float64)[CARD_TYPE_INDEX] + 1.0
+    hands, field_, stock = deal(rng, n, shape)
+    taken = play(hands, field_, stock, shape, values, policies, rng)
+    summary = SimulationSummary(rules.game_name, rules.fingerprint, int(seed_seq.entropy), tuple(policies))
+    summary.add(*settle(rules, shape, hands, field_, taken))
+    return summary
+
+
+def simulate(game_rules, months=100_000, seed=0, policies=None, workers=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ルール（game_rules 形式の辞書・CompiledRules）で months か月分を打ち、SimulationSummary を返す
+
+    配りは chunk_size か月ずつに分け、seed から作った乱数の種をそれぞれに割り当てるので、
+    workers（プロセスの数）を変えても同じ seed なら同じ結果になる。
+    policies は席ごとの打ち方（省略すると全員 GREEDY）。
+    """
+    rules = compile_rules(game_rules)
+    shape = game_shape(rules)
+    policies = tuple(policies or (GREEDY,) * shape.players)
+    if len(policies) != shape.players or not set(policies) <= set(POLICIES):
+        raise ValueError(f"打ち方は {shape.players} 人分を {', '.join(POLICIES)} から指定してください。")
+    sizes = [chunk_size] * (months // chunk_size) + ([months % chunk_size] if months % chunk_size else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    # 子プロセスにはハッシュ可能な CompiledRules ではなく辞書を渡す
+    tasks = [(rules.to_dict(), size, seed_seq, policies) for size, seed_seq in zip(sizes, seeds)]
+
+    summary = SimulationSummary(rules.game_name, rules.fingerprint, seed, policies)
+    if workers > 1 and len(tasks) > 1:
+        ctx = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(min(workers, len(tasks)), mp_context=ctx) as pool:
+            for part in pool.map(simulate_chunk, *zip(*tasks)):
+                summary.merge(part)
+    else:
+        for task in tasks:
+            summary.merge(simulate_chunk(*task))
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import os
+    import time
+
+    import pandas as pd
+
+    from rule_sets import PRESETS
+
+    parser = argparse.ArgumentParser(description="ルールのプリセットで配りと打ちを繰り返し、席ごと・役ごとの期待値と分散を推定する")
+    parser.add_argument("--rules", default="八八", help=f"プリセット（{' / '.join(PRESETS)}）または game_rules の JSON ファイル")
+    parser.add_argument("--months", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--policies", nargs="+", choices=POLICIES, help="席ごとの打ち方（親から順に）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--output", help="集計を JSON で保存する")
+    args = parser.parse_args()
+
+    if args.rules in PRESETS:
+        game_rules = PRESETS[args.rules]
+    else:
+        with open(args.rules, encoding="utf-8") as f:
+            game_rules = json.load(f)
+    start = time.perf_counter()
+    result = simulate(game_rules, args.months, args.seed, args.policies, args.workers, args.chunk_size)
+    elapsed = time.perf_counter() - start
+    print(f"{result.game_name}: {result.months:,}か月 / {elapsed:.1f}秒（{result.months / elapsed:,.0f}か月/秒）")
+    with pd.option_context("display.width", 120, "display.max_rows", 100):
+        print(pd.DataFrame(result.outcome_rows()).to_string(index=False))
+        print(pd.DataFrame(result.seat_rows()).to_string(index=False))
+        print(pd.DataFrame(result.yaku_rows()).to_string(index=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result.to_dict(), f, ensure_ascii=False, indent=1)
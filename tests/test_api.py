@@ -0,0 +1,88 @@
+import json
+
+from tornado.testing import AsyncHTTPTestCase
+
+import api_server
+from game_store import GameStore
+
+MONTH = {"inputs": {"A": {"brights": 2, "animals": 1, "chaff": 5}, "B": {"ribbons": 3}, "C": {}}}
+
+
+class ApiTestCase(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.app_state = api_server.AppState(GameStore(":memory:"))
+        return api_server.make_app(self.app_state)
+
+    def tearDown(self):
+        super().tearDown()
+        self.app_state.store.close()
+        self.app_state.executor.shutdown(wait=False)
+
+    def call(self, method, path, body=None):
+        response = self.fetch(path, method=method, body=None if body is None else json.dumps(body))
+        return response.code, json.loads(response.body)
+
+    def create_game(self, players=("A", "B", "C")):
+        code, game = self.call("POST", "/api/games", {"players": list(players), "rules": "八八"})
+        self.assertEqual(code, 201)
+        return game["game_id"]
+
+
+class SettleTest(ApiTestCase):
+
+    def test_settles_month(self):
+        code, body = self.call("POST", "/api/settle", {"rules": "八八", "month": {"players": ["A", "B", "C"], **MONTH}})
+        self.assertEqual(code, 200)
+        self.assertEqual(sum(body["results"][0].values()), 0)
+
+    def test_malformed_months_are_rejected(self):
+        malformed = [
+            {"players": ["A", "B"], "inputs": ["x"]},
+            {"players": "AB"},
+            {"players": ["A", "B"], "yaku_extras": [1]},
+            {"players": ["A", "B"], "yaku_extras": {"青短": "1"}},
+            {"players": ["A", "B"], "inputs": {"A": {"brights": "2"}}},
+            {"players": ["A", "B"], "inputs": {"A": 5}},
+            {"players": ["A", "B"], "custom_multiplier": True},
+            {"inputs": {}},
+            ["A", "B"],
+        ]
+        for month in malformed:
+            with self.subTest(month=month):
+                code, body = self.call("POST", "/api/settle", {"rules": "八八", "month": month})
+                self.assertEqual(code, 400)
+                self.assertIn("error", body)
+
+
+class GamesTest(ApiTestCase):
+
+    def test_initial_scores_must_be_integers_for_players(self):
+        for initial_scores in (5, {"A": "x"}, {"Z": 1}):
+            with self.subTest(initial_scores=initial_scores):
+                code, _ = self.call("POST", "/api/games", {"players": ["A", "B"], "initial_scores": initial_scores})
+                self.assertEqual(code, 400)
+
+    def test_presettled_scores_must_cover_every_player(self):
+        game_id = self.create_game()
+        for scores in ({"A": "x"}, {"A": 1, "B": -1}, {"A": 1, "B": -1, "C": 0, "Z": 0}, 5):
+            with self.subTest(scores=scores):
+                code, _ = self.call("POST", f"/api/games/{game_id}/months", {"scores": scores})
+                self.assertEqual(code, 400)
+        code, game = self.call("POST", f"/api/games/{game_id}/months", {"scores": {"A": 4, "B": -4, "C": 0}})
+        self.assertEqual(code, 201)
+        self.assertEqual(game["totals"], {"A": 64, "B": 56, "C": 60})
+
+    def test_body_cannot_override_players(self):
+        game_id = self.create_game()
+        code, game = self.call("POST", f"/api/games/{game_id}/months", {"players": ["A", "B", "Z"], **MONTH})
+        self.assertEqual(code, 201)
+        self.assertEqual(set(game["totals"]), {"A", "B", "C"})
+        self.assertEqual(sum(game["totals"].values()), 180)
+
+    def test_phantom_active_player_is_rejected(self):
+        game_id = self.create_game()
+        code, _ = self.call("POST", f"/api/games/{game_id}/months", {"active_players": ["A", "Z"], **MONTH})
+        self.assertEqual(code, 400)
+        _, game = self.call("GET", f"/api/games/{game_id}")
+        self.assertEqual(game["history"], [])
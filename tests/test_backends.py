@@ -0,0 +1,64 @@
+"""torch と ONNX / ONNX INT8 の認識結果が一致するかの確認
+
+写真は HANAFUDA_PARITY_IMAGES のフォルダ（既定は tests/fixtures/cards）から読む。
+ultralytics・onnxruntime・重みファイル・写真のどれかがなければ飛ばす。
+"""
+import collections
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from YOLO_model.backends import BACKEND_WEIGHTS, load_detector
+from YOLO_model.preprocess import DEFAULT_PROFILE, load_image_for_inference
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGES_DIR = os.environ.get("HANAFUDA_PARITY_IMAGES", os.path.join(ROOT, "tests", "fixtures", "cards"))
+# 同じ札とみなす箱の重なり（INT8 量子化で箱が少しずれるのは許す）
+MIN_IOU = 0.7
+
+
+def fixture_images():
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(IMAGES_DIR, f"*.{ext}")))
+    if not paths:
+        pytest.skip(f"写真がありません: {IMAGES_DIR}")
+    return [load_image_for_inference(path, DEFAULT_PROFILE.imgsz) for path in paths]
+
+
+def detect(backend, images):
+    """各写真の認識結果を [(クラスID, xyxy), ...] のリストで返す"""
+    if not os.path.exists(os.path.join(ROOT, BACKEND_WEIGHTS[backend])):
+        pytest.skip(f"{backend} 用の重みファイルがありません")
+    model = load_detector(backend)
+    kwargs = DEFAULT_PROFILE.predict_kwargs()
+    detected = []
+    for image in images:
+        boxes = model(image, **kwargs)[0].boxes
+        detected.append(list(zip(boxes.cls.cpu().numpy().astype(int), boxes.xyxy.cpu().numpy())))
+    return detected
+
+
+def iou(a, b):
+    x1, y1 = np.maximum(a[:2], b[:2])
+    x2, y2 = np.minimum(a[2:], b[2:])
+    inter = max(x2 - x1, 0) * max(y2 - y1, 0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8"])
+def test_onnx_matches_torch(backend, monkeypatch):
+    pytest.importorskip("ultralytics")
+    pytest.importorskip("onnxruntime")
+    monkeypatch.chdir(ROOT)
+    images = fixture_images()
+    reference, got = detect("torch", images), detect(backend, images)
+
+    for index, (ref, other) in enumerate(zip(reference, got)):
+        assert collections.Counter(c for c, _ in other) == collections.Counter(c for c, _ in ref), f"写真 {index}"
+        unmatched = dict(enumerate(other))
+        for class_id, box in ref:
+            candidates = [i for i, (c, _) in unmatched.items() if c == class_id]
+            best = max(candidates, key=lambda i: iou(box, unmatched[i][1]))
+            assert iou(box, unmatched.pop(best)[1]) >= MIN_IOU, f"写真 {index} のクラス {class_id}"
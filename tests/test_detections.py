@@ -0,0 +1,19 @@
+from YOLO_model.detections import Detections, _tables, class_table_for
+
+NAMES = ["1-hkr", "1-tan", "1-kas", "2-tne"]
+
+
+def test_class_table_is_shared_across_fresh_names_dicts():
+    # YOLO.names は参照するたびに新しい dict を返す
+    first = class_table_for(dict(enumerate(NAMES)))
+    size = len(_tables)
+    for _ in range(100):
+        assert class_table_for(dict(enumerate(NAMES))) is first
+    assert class_table_for(list(NAMES)) is first
+    assert len(_tables) == size
+
+
+def test_card_type_counts():
+    table = class_table_for(dict(enumerate(NAMES)))
+    detections = Detections.from_names(["1-hkr", "1-kas", "2-tne", "1-kas"], [0.9, 0.8, 0.7, 0.6], table)
+    assert detections.card_type_counts() == (1, 1, 0, 2)
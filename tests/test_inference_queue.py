@@ -0,0 +1,67 @@
+import threading
+import time
+
+from YOLO_model.inference_queue import InferenceService
+from YOLO_model.thread_budget import THIN, InferenceScheduler, ThreadBudget
+
+INFER_SECONDS = 0.1
+
+
+class SleepingModel:
+    """ultralytics の YOLO と同じく、同時に呼ばれても1つずつしか推論しない検出器"""
+
+    names = {0: "1-hkr"}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __call__(self, images, **options):
+        with self._lock:
+            time.sleep(INFER_SECONDS)
+        return [object() for _ in images]
+
+
+class ThinBudget(ThreadBudget):
+    """負荷にかかわらず THIN（2スロット）で動かす予算"""
+
+    def choose(self, load):
+        return THIN
+
+
+def run_concurrently(service, clients=2):
+    threads = [threading.Thread(target=service, args=(f"image-{i}",)) for i in range(clients)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.monotonic() - started
+
+
+def make_service(replicas):
+    scheduler = InferenceScheduler(ThinBudget(cores=2, slots=2))
+    return InferenceService(replicas[0], max_batch_size=1, max_wait=0.0, scheduler=scheduler, replicas=replicas)
+
+
+def test_replicas_run_slots_in_parallel():
+    service = make_service([SleepingModel(), SleepingModel()])
+    try:
+        elapsed = run_concurrently(service)
+        stats = service.stats()
+    finally:
+        service.close()
+    assert elapsed < INFER_SECONDS * 1.8
+    assert stats["avg_model_wait"] < INFER_SECONDS / 2
+
+
+def test_shared_model_wait_is_not_counted_as_compute():
+    service = make_service([SleepingModel()])
+    try:
+        elapsed = run_concurrently(service)
+        stats = service.stats()
+    finally:
+        service.close()
+    assert elapsed >= INFER_SECONDS * 2
+    # 2回目の推論はモデルのロックを待つ。その時間は計算時間に入れない
+    assert stats["model_wait_total"] >= INFER_SECONDS * 0.8
+    assert stats["scheduler"]["avg_compute"] < INFER_SECONDS * 1.5
@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+
+from game_store import GameStore
+from ledger import ScoreLedger
+from month_log import SNAPSHOT_INTERVAL, MonthLog
+
+PLAYERS = ["A", "B"]
+
+
+@pytest.fixture
+def store():
+    store = GameStore(":memory:")
+    yield store
+    store.close()
+
+
+def record_months(log, count):
+    return [log.record(f"{len(log.ledger)}月", {"A": i, "B": -i}, {"players": PLAYERS}) for i in range(count)]
+
+
+def save(store, game_id, log, events):
+    store.record_events(game_id, events, PLAYERS, {}, log, len(log.ledger))
+
+
+def assert_same_state(loaded, log):
+    assert loaded.ledger.to_frame().equals(log.ledger.to_frame())
+    assert loaded.seq == log.seq
+    assert loaded.editable_rows() == log.editable_rows()
+    assert loaded.next_redo() == log.next_redo()
+
+
+def test_load_replays_only_the_events_after_the_snapshot(store):
+    log = MonthLog(ScoreLedger({"A": 60, "B": 60}))
+    game_id = store.create_game(PLAYERS, {}, log.ledger)
+    for _ in range(SNAPSHOT_INTERVAL + 3):
+        save(store, game_id, log, record_months(log, 1))
+    save(store, game_id, log, [log.undo()])
+
+    loaded = store.load_game(game_id).log
+    assert_same_state(loaded, log)
+    assert [event.seq for event in loaded.events] == list(range(loaded.snapshot_seq + 1, log.seq + 1))
+    assert loaded.redo().seq == log.seq + 1
+
+
+def test_failed_save_is_covered_by_the_next_snapshot(store):
+    log = MonthLog(ScoreLedger({"A": 60, "B": 60}))
+    game_id = store.create_game(PLAYERS, {}, log.ledger)
+    save(store, game_id, log, record_months(log, 2))
+    # 保存できなかった月（save_current_game はスナップショットから書き直すようにする）
+    record_months(log, 1)
+    log.snapshot_seq = None
+    save(store, game_id, log, record_months(log, 1))
+
+    assert_same_state(store.load_game(game_id).log, log)
+
+
+def test_second_writer_cannot_reuse_a_seq(store):
+    log = MonthLog(ScoreLedger({"A": 60, "B": 60}))
+    game_id = store.create_game(PLAYERS, {}, log.ledger)
+    save(store, game_id, log, record_months(log, 1))
+    other = store.load_game(game_id).log
+    save(store, game_id, other, record_months(other, 1))
+    with pytest.raises(sqlite3.IntegrityError):
+        save(store, game_id, log, record_months(log, 1))
+
+
+def test_gap_after_the_snapshot_is_an_error():
+    log = MonthLog(ScoreLedger({"A": 60, "B": 60}))
+    record_months(log, 2)
+    snapshot = log.snapshot()
+    later = record_months(log, 2)
+    with pytest.raises(ValueError):
+        MonthLog.restore(snapshot, later[1:])
+
+
+def test_restores_snapshots_that_refer_to_events_by_seq():
+    log = MonthLog(ScoreLedger({"A": 60, "B": 60}))
+    events = record_months(log, 3)
+    log.undo()
+    snapshot = log.snapshot()
+    legacy = {**snapshot, "entries": [[row, event["seq"]] for row, event in snapshot["entries"]],
+              "redo": [event["seq"] for event in snapshot["redo"]]}
+
+    assert_same_state(MonthLog.restore(legacy, events), log)
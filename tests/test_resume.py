@@ -0,0 +1,55 @@
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import functions
+from game_store import GameStore
+from ledger import ScoreLedger
+from rule_sets import PRESETS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = GameStore(str(tmp_path / "games.sqlite3"))
+    monkeypatch.setattr(functions, "get_game_store", lambda: store)
+    monkeypatch.setenv("HANAFUDA_WARMUP", "0")
+    yield store
+    store.close()
+
+
+def test_resume_over_stale_session_records_months(store):
+    game_id = store.create_game(["A", "B"], PRESETS["八八"].to_dict(), ScoreLedger({"A": 60, "B": 60}))
+
+    at = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=60)
+    # 前のゲーム（4人）の今月の入力が残っているセッション
+    at.session_state.players = []
+    at.session_state.active_players = ["A", "B", "C", "D"]
+    at.session_state.hatto_players = ["C"]
+    at.session_state.input_modes = {"C": "点数入力"}
+    at.session_state.editing_month = 2
+    at.run()
+    at.text_input[0].set_value(game_id)
+    [b for b in at.button if b.label == "このゲームを再開する"][0].click().run()
+    assert not at.exception
+
+    assert at.session_state.active_players == ["A", "B"]
+    assert at.session_state.editing_month is None
+    assert set(at.session_state.input_modes) <= {"A", "B"}
+
+    # 再開後に開く得点入力ページへ、セッションをそのまま引き継ぐ
+    state = at.session_state.filtered_state
+    at = AppTest.from_file(os.path.join(ROOT, "pages", "points.py"), default_timeout=60)
+    for key, value in state.items():
+        at.session_state[key] = value
+    at.run()
+    assert not at.exception
+    at.number_input(key="brights_A").set_value(2).run()
+    at.number_input(key="chaff_B").set_value(10).run()
+    [b for b in at.button if b.label.endswith("得点を記録する")][0].click().run()
+    assert not at.exception
+    assert not at.error
+    assert at.session_state.current_month == 2
+    assert len(store.load_game(game_id).ledger) == 2
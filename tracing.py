@@ -0,0 +1,120 @@
+import collections
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import uuid
+
+# トレースの出力先（空文字にするとファイルには書かない）
+DEFAULT_TRACE_FILE = os.environ.get("HANAFUDA_TRACE_FILE", os.path.join("logs", "photo_trace.jsonl"))
+# 1にすると各区間の前後で RSS を測り、メモリの増減も記録する
+TRACE_MEMORY = os.environ.get("HANAFUDA_TRACE_MEMORY", "0") == "1"
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_bytes():
+    """現在の RSS（取れない環境では None）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def new_trace_id():
+    """写真1枚分の処理をまとめるためのID"""
+    return uuid.uuid4().hex[:12]
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class Tracer:
+    """写真認識の各区間（getvalue・md5・デコード・推論など）の所要時間を記録するクラス
+
+    区間は monotonic な perf_counter で測り、JSONL 形式でローテーションするファイルに
+    1行ずつ書き出す。直近 window 件は区間ごとにメモリにも残し、p50/p95/p99 を計算できる。
+    """
+
+    def __init__(self, path=DEFAULT_TRACE_FILE, track_memory=TRACE_MEMORY, window=500,
+                 max_bytes=5 * 1024 * 1024, backup_count=3):
+        self.track_memory = track_memory
+        self._lock = threading.Lock()
+        self._durations = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._recent = collections.deque(maxlen=window)
+        self._logger = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger = logging.getLogger(f"hanafuda.trace.{id(self)}")
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            self._logger.addHandler(handler)
+
+    def record(self, name, duration_ms, trace_id=None, **attrs):
+        """外で測った区間（ultralytics の Results.speed など）を記録する"""
+        span = {"ts": time.time(), "trace_id": trace_id, "stage": name, "ms": round(duration_ms, 3)}
+        span.update(attrs)
+        with self._lock:
+            self._durations[name].append(duration_ms)
+            self._recent.append(span)
+        if self._logger is not None:
+            self._logger.info(json.dumps(span, ensure_ascii=False, default=str))
+
+    @contextlib.contextmanager
+    def span(self, name, trace_id=None, **attrs):
+        """with tracer.span("decode", trace_id): ... の区間の所要時間を記録する"""
+        rss_before = _rss_bytes() if self.track_memory else None
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if rss_before is not None:
+                rss_after = _rss_bytes()
+                if rss_after is not None:
+                    attrs["rss_delta"] = rss_after - rss_before
+            self.record(name, duration_ms, trace_id, **attrs)
+
+    def percentiles(self):
+        """区間ごとの {件数, p50, p95, p99}（ミリ秒）を返す"""
+        with self._lock:
+            snapshot = {name: sorted(values) for name, values in self._durations.items()}
+        return {
+            name: {
+                "count": len(values),
+                "p50": _percentile(values, 50),
+                "p95": _percentile(values, 95),
+                "p99": _percentile(values, 99),
+            }
+            for name, values in snapshot.items()
+        }
+
+    def recent(self, limit=50):
+        """直近の区間を新しい順に返す"""
+        with self._lock:
+            return list(self._recent)[-limit:][::-1]
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """プロセス全体で1つの Tracer を返す"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer